@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""Preprocessing artifact bundle.
+
+The training scripts write everything the predictor needs besides the model
+weights (fitted vocabulary, normalization constants, sequence length and the
+pruned embedding matrix) into a small versioned directory, so that a single
+prediction does not have to re-read the training CSVs or re-parse GloVe.
+
+A bundle is bound to the model file it was written next to: loading it
+against any other model raises a ValueError.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+BUNDLE_VERSION = 1
+
+META_FILE = 'meta.json'
+TOKENIZER_FILE = 'tokenizer.json'
+EMB_MATRIX_FILE = 'emb_matrix.npy'
+
+
+def model_fingerprint(model_file):
+    '''
+    Function to compute the sha256 of a saved model file.
+
+    Parameters:
+        model_file : path of the .h5 model
+    Output:
+        hex digest of the file contents
+    '''
+    digest = hashlib.sha256()
+    with open(model_file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def save_bundle(bundle_dir, model_file, tokenizer, emb_matrix, max_retweet_count,
+                max_feature_values, constants):
+    '''
+    Function to write the preprocessing artifacts of a trained model.
+
+    Parameters:
+        bundle_dir : directory to write the bundle to
+        model_file : path of the saved model the bundle belongs to
+        tokenizer : fitted keras Tokenizer
+        emb_matrix : (NB_WORDS, GLOVE_DIM) embedding matrix
+        max_retweet_count : retweet normalization constant
+        max_feature_values : normalization constant of each pairwise user feature
+        constants : dict of the hyper-parameters the model was built with
+                    (NB_WORDS, GLOVE_DIM, LSTM_OUT, MAX_LEN, ...)
+    '''
+    os.makedirs(bundle_dir, exist_ok=True)
+
+    with open(os.path.join(bundle_dir, TOKENIZER_FILE), 'w') as f:
+        f.write(tokenizer.to_json())
+    np.save(os.path.join(bundle_dir, EMB_MATRIX_FILE), np.asarray(emb_matrix, dtype='float32'))
+
+    meta = {
+        'version': BUNDLE_VERSION,
+        'model_sha256': model_fingerprint(model_file),
+        'max_retweet_count': int(max_retweet_count),
+        'max_feature_values': [float(v) for v in max_feature_values],
+        'constants': {key: int(value) for key, value in constants.items()},
+    }
+    # meta.json is written last so a half-written bundle never looks complete
+    with open(os.path.join(bundle_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_bundle(bundle_dir, model_file, load_emb_matrix=False):
+    '''
+    Function to read a bundle written by save_bundle.
+
+    Parameters:
+        bundle_dir : directory the bundle was written to
+        model_file : path of the model that is going to be used with it
+        load_emb_matrix : also memory-map the embedding matrix
+    Output:
+        dict with the bundle meta data, the tokenizer json and
+        optionally the embedding matrix
+    '''
+    meta_file = os.path.join(bundle_dir, META_FILE)
+    if not os.path.exists(meta_file):
+        raise ValueError('no preprocessing bundle found in {}, run end-to-end.py first'.format(bundle_dir))
+
+    with open(meta_file) as f:
+        bundle = json.load(f)
+
+    if bundle.get('version') != BUNDLE_VERSION:
+        raise ValueError('bundle version {} is not supported (expected {})'.format(
+            bundle.get('version'), BUNDLE_VERSION))
+    if bundle['model_sha256'] != model_fingerprint(model_file):
+        raise ValueError('bundle in {} was not built with {}'.format(bundle_dir, model_file))
+
+    with open(os.path.join(bundle_dir, TOKENIZER_FILE)) as f:
+        bundle['tokenizer_json'] = f.read()
+    if load_emb_matrix:
+        bundle['emb_matrix'] = np.load(os.path.join(bundle_dir, EMB_MATRIX_FILE), mmap_mode='r')
+
+    return bundle
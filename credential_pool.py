@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Spread status lookups over several Twitter developer accounts.
+
+Each account has its own rate-limit window. CredentialPool keeps track of
+every account's remaining requests and reset time (from the x-rate-limit-*
+headers of its responses), hands each request to the account with the most
+budget left, and moves work away from an account as soon as it is
+throttled, so sweeps run concurrently on all accounts instead of blocking
+on the first one that hits its limit.
+
+Accounts are read from a JSON list:
+
+    [{"name": "main", "consumer_key": "...", "consumer_secret": "...",
+      "access_token": "...", "access_token_secret": "..."}, ...]
+"""
+
+import json
+import threading
+import time
+
+
+class RateLimited(Exception):
+    '''
+    Raised by a lookup function when its account is throttled.
+
+    Parameters:
+        reset : epoch seconds at which the account's window resets
+    '''
+
+    def __init__(self, reset):
+        super(RateLimited, self).__init__('rate limited until {}'.format(reset))
+        self.reset = reset
+
+
+def load_accounts(config_file):
+    '''
+    Function to read the account list.
+
+    Output:
+        list of dicts with name, consumer_key, consumer_secret, access_token, access_token_secret
+    '''
+    with open(config_file) as f:
+        accounts = json.load(f)
+    for account in accounts:
+        missing = {'name', 'consumer_key', 'consumer_secret', 'access_token', 'access_token_secret'} - set(account)
+        if missing:
+            raise ValueError('account {} in {} lacks {}'.format(account.get('name'), config_file, ', '.join(sorted(missing))))
+    return accounts
+
+
+class Account(object):
+    '''
+    Rate-limit state of one account.
+
+    Parameters:
+        name : account name
+        make_lookup : function (rate_limit callback) -> lookup function, e.g.
+                      lambda rate_limit: http_lookup(url, token, rate_limit)
+    '''
+
+    def __init__(self, name, make_lookup):
+        self.name = name
+        self.remaining = None     # unknown until the first response
+        self.reset = 0.
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.lookup = make_lookup(self.rate_limit)
+
+    def rate_limit(self, remaining, reset):
+        self.remaining, self.reset = remaining, reset
+
+    def budget(self, now):
+        if self.remaining is None or self.reset <= now:
+            return float('inf')
+        return self.remaining - self.in_flight
+
+
+class CredentialPool(object):
+    '''
+    Lookup function dispatching each request to the least used account.
+
+    Parameters:
+        accounts : list of Account
+        max_in_flight : concurrent requests per account
+    '''
+
+    def __init__(self, accounts, max_in_flight=2):
+        if not accounts:
+            raise ValueError('the credential pool needs at least one account')
+        self.accounts = accounts
+        self.max_in_flight = max_in_flight
+        self.concurrency = len(accounts)*max_in_flight
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        '''
+        Function to wait for an account with budget left and reserve one request on it.
+        '''
+        with self.condition:
+            while True:
+                now = time.time()
+                usable = [account for account in self.accounts
+                          if account.in_flight < self.max_in_flight and account.budget(now) > 0]
+                if usable:
+                    account = max(usable, key=lambda account: account.budget(now))
+                    account.in_flight += 1
+                    return account
+                # every account is busy or out of budget: wake up on a release or the first reset
+                resets = [account.reset - now for account in self.accounts if account.budget(now) <= 0]
+                self.condition.wait(max(min(resets), 0.01) if resets else None)
+
+    def release(self, account, throttled_until=None):
+        with self.condition:
+            account.in_flight -= 1
+            account.requests += 1
+            if throttled_until is not None:
+                account.throttled += 1
+                # a reset already in the past (clock skew) still backs off for a second
+                account.remaining, account.reset = 0, max(throttled_until, time.time() + 1.)
+            self.condition.notify_all()
+
+    def __call__(self, tweet_ids):
+        while True:
+            account = self.acquire()
+            try:
+                found = account.lookup(tweet_ids)
+            except RateLimited as e:
+                self.release(account, throttled_until=e.reset)
+                continue
+            except BaseException:
+                self.release(account)
+                raise
+            self.release(account)
+            return found
+
+    def stats(self):
+        return {account.name: {'requests': account.requests, 'throttled': account.throttled}
+                for account in self.accounts}
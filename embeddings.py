@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Binary word embedding store.
+
+GloVe style text files (`glove.twitter.27B.100d.txt`, `custom_WE.txt`) are
+converted once into a directory holding
+
+    vectors.npy  : contiguous (count, dim) float32 matrix, one row per line
+    hashes.npy   : sorted 64-bit hashes of the words
+    order.npy    : row of the word behind each entry of hashes.npy
+    words.npy    : utf-8 bytes of all words, in row order
+    offsets.npy  : start of each word inside words.npy
+    meta.json    : dimension, count and the source file it was built from
+
+Everything is opened with memory mapping, so opening a store is nearly free
+and only the pages of the rows we look up are ever read.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+META_FILE = 'meta.json'
+
+
+def _word_hash(word_bytes):
+    return int.from_bytes(hashlib.blake2b(word_bytes, digest_size=8).digest(), 'little')
+
+
+def _source_signature(txt_file):
+    stat = os.stat(txt_file)
+    return {'file': os.path.basename(txt_file), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+def store_dir_for(txt_file):
+    '''
+    Function to get the directory the binary store of a text embedding file lives in.
+    '''
+    return os.path.splitext(txt_file)[0] + '.store'
+
+
+def convert_text_embeddings(txt_file, store_dir=None):
+    '''
+    Function to convert a text embedding file into a binary store.
+
+    Lines whose vector does not have the dimension of the first line are
+    skipped. If a word occurs twice, the last occurrence wins, the same as
+    filling a dict line by line.
+
+    Parameters:
+        txt_file : "word v1 v2 ..." text file
+        store_dir : output directory, next to txt_file by default
+    Output:
+        path of the store directory
+    '''
+    store_dir = store_dir or store_dir_for(txt_file)
+    os.makedirs(store_dir, exist_ok=True)
+
+    with open(txt_file, encoding='utf-8') as f:
+        count = 0
+        dim = None
+        for line in f:
+            values = line.split()
+            if dim is None:
+                dim = len(values) - 1
+            if len(values) - 1 == dim:
+                count += 1
+
+    vectors = np.lib.format.open_memmap(os.path.join(store_dir, 'vectors.npy'), mode='w+',
+                                        dtype=np.float32, shape=(count, dim))
+    word_rows = {}
+    words = []
+    with open(txt_file, encoding='utf-8') as f:
+        row = 0
+        for line in f:
+            values = line.split()
+            if len(values) - 1 != dim:
+                continue
+            vectors[row] = np.array(values[1:], dtype=np.float32)
+            word = values[0].encode('utf-8')
+            words.append(word)
+            word_rows[word] = row
+            row += 1
+    vectors.flush()
+    del vectors
+
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(w) for w in words])
+    np.save(os.path.join(store_dir, 'words.npy'), np.frombuffer(b''.join(words), dtype=np.uint8))
+    np.save(os.path.join(store_dir, 'offsets.npy'), offsets)
+
+    rows = np.fromiter(word_rows.values(), dtype=np.int64, count=len(word_rows))
+    hashes = np.fromiter((_word_hash(w) for w in word_rows), dtype=np.uint64, count=len(word_rows))
+    sort = np.argsort(hashes, kind='stable')
+    np.save(os.path.join(store_dir, 'hashes.npy'), hashes[sort])
+    np.save(os.path.join(store_dir, 'order.npy'), rows[sort])
+
+    # meta.json is written last so a half-converted store is never picked up
+    meta = {'dim': dim, 'count': count, 'source': _source_signature(txt_file)}
+    with open(os.path.join(store_dir, META_FILE), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    return store_dir
+
+
+class EmbeddingStore(object):
+    '''
+    Read-only, memory-mapped view of a store written by convert_text_embeddings.
+    '''
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.dim = self.meta['dim']
+
+        def load(name):
+            return np.load(os.path.join(store_dir, name + '.npy'), mmap_mode='r')
+
+        self.vectors = load('vectors')
+        self._hashes = load('hashes')
+        self._order = load('order')
+        self._words = load('words')
+        self._offsets = load('offsets')
+
+    def __len__(self):
+        return len(self._order)
+
+    def lookup(self, words):
+        '''
+        Function to find the rows of many words at once.
+
+        Parameters:
+            words : list of words
+        Output:
+            int64 array with the row of each word, -1 where it is missing
+        '''
+        keys = [w.encode('utf-8') for w in words]
+        hashes = np.fromiter((_word_hash(k) for k in keys), dtype=np.uint64, count=len(keys))
+        positions = np.searchsorted(self._hashes, hashes)
+
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        n = len(self._hashes)
+        for i, (key, h, pos) in enumerate(zip(keys, hashes, positions)):
+            # walk the (almost always length one) run of equal hashes and compare the words
+            while pos < n and self._hashes[pos] == h:
+                row = int(self._order[pos])
+                if self._words[self._offsets[row]:self._offsets[row + 1]].tobytes() == key:
+                    rows[i] = row
+                    break
+                pos += 1
+        return rows
+
+    def __contains__(self, word):
+        return self.lookup([word])[0] >= 0
+
+    def get(self, word):
+        row = self.lookup([word])[0]
+        if row < 0:
+            return None
+        return np.array(self.vectors[row])
+
+
+def open_store(txt_file):
+    '''
+    Function to open the binary store of a text embedding file, converting
+    it first if the store is missing or older than the text file.
+    '''
+    store_dir = store_dir_for(txt_file)
+    meta_file = os.path.join(store_dir, META_FILE)
+    stale = True
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            stale = json.load(f)['source'] != _source_signature(txt_file)
+    if stale:
+        print('converting {} to a binary store...'.format(os.path.basename(txt_file)))
+        convert_text_embeddings(txt_file, store_dir)
+    return EmbeddingStore(store_dir)
+
+
+def load_keywords(keywords_file, tokenize):
+    '''
+    Function to read the keywords column of keywords.txt, normalised the
+    same way as the tweet text.
+    '''
+    keywords = []
+    with open(keywords_file) as f:
+        for line in f:
+            keywords.append(tokenize(line.split('  ')[0]))
+    return keywords
+
+
+def _target_vocab(word_index, nb_words):
+    # The word_index contains a token for all words of the training data so we need to limit that
+    return {w: i for w, i in word_index.items() if i < nb_words}
+
+
+def _report(stats):
+    print('embeddings: {hits} found ({custom_hits} from custom), {misses} missing (kept as zeros)'.format(**stats))
+    return stats
+
+
+def stream_emb_matrix(word_index, nb_words, glove_dim, glove_file, custom_file=None, keywords=()):
+    '''
+    Function to build the embedding matrix straight from the text files.
+
+    Only the vocabulary rows are materialised: each line is split off at
+    the first space, the word is checked against a hash set of the wanted
+    words and the vector is only parsed on a hit. Lines whose vector does
+    not have glove_dim values are skipped. If a word occurs twice in a
+    file, the last occurrence wins, the same as convert_text_embeddings,
+    so every file is read to its end.
+
+    Parameters and precedence are the same as for load_emb_matrix.
+    Output:
+        (nb_words, glove_dim) float32 matrix, dict of hit/miss counts
+    '''
+    emb_matrix = np.zeros((nb_words, glove_dim), dtype=np.float32)
+    vocab = _target_vocab(word_index, nb_words)
+
+    def fill(txt_file, wanted):
+        # fills the rows of the wanted words, a later line overwriting an earlier one
+        found = set()
+        with open(txt_file, encoding='utf-8') as f:
+            for line in f:
+                word, _, vector = line.partition(' ')
+                i = wanted.get(word)
+                if i is not None:
+                    vector = vector.split()
+                    if len(vector) == glove_dim:
+                        emb_matrix[i] = np.array(vector, dtype=np.float32)
+                        found.add(word)
+        return found
+
+    wanted = dict(vocab)
+    custom_hits = 0
+    if custom_file is not None:
+        keywords = set(keywords)
+        custom_wanted = {w: i for w, i in vocab.items() if w in keywords}
+        custom_found = fill(custom_file, custom_wanted)
+        custom_hits = len(custom_found)
+        # keywords found in the custom embeddings are not overwritten by GloVe
+        for w in custom_found:
+            del wanted[w]
+    hits = custom_hits + len(fill(glove_file, wanted))
+
+    return emb_matrix, _report({'hits': hits, 'custom_hits': custom_hits, 'misses': len(vocab) - hits})
+
+
+def load_emb_matrix(word_index, nb_words, glove_dim, glove_file, custom_file=None, keywords=(), binary=True):
+    '''
+    Function to build the embedding matrix of a fitted vocabulary.
+
+    Vectors come from GloVe; for the keywords, vectors from the custom
+    embeddings take precedence. Words found in neither are kept as rows
+    of zeros.
+
+    Parameters:
+        word_index : Tokenizer.word_index
+        nb_words : number of rows of the matrix (NB_WORDS)
+        glove_dim : dimension of the vectors (GLOVE_DIM)
+        glove_file : pre-trained GloVe text file
+        custom_file : custom embedding text file, optional
+        keywords : words to take from the custom embeddings
+        binary : use the memory-mapped stores (converted on first use),
+                 otherwise stream the text files with stream_emb_matrix
+    Output:
+        (nb_words, glove_dim) float32 matrix, dict of hit/miss counts
+    '''
+    if not binary:
+        return stream_emb_matrix(word_index, nb_words, glove_dim, glove_file, custom_file, keywords)
+
+    emb_matrix = np.zeros((nb_words, glove_dim), dtype=np.float32)
+    vocab = _target_vocab(word_index, nb_words)
+    words = list(vocab)
+    indices = np.array(list(vocab.values()), dtype=np.int64)
+    hit = np.zeros(len(words), dtype=bool)
+
+    if words:
+        glove = open_store(glove_file)
+        rows = glove.lookup(words)
+        found = np.flatnonzero(rows >= 0)
+        found = found[np.argsort(rows[found])]    # read the memory map front to back
+        emb_matrix[indices[found]] = glove.vectors[rows[found]]
+        hit[found] = True
+
+    custom_hits = 0
+    if custom_file is not None:
+        keywords = set(keywords)
+        custom_vocab = [k for k, w in enumerate(words) if w in keywords]
+        if custom_vocab:
+            custom = open_store(custom_file)
+            rows = custom.lookup([words[k] for k in custom_vocab])
+            for k, row in zip(custom_vocab, rows):
+                if row >= 0:
+                    emb_matrix[indices[k]] = custom.vectors[row]
+                    hit[k] = True
+                    custom_hits += 1
+
+    hits = int(hit.sum())
+    return emb_matrix, _report({'hits': hits, 'custom_hits': custom_hits, 'misses': len(words) - hits})
@@ -11,11 +11,9 @@ from pathlib import Path
 import sys
 import regex
 import math
-import random
 import json
 
 # Packages for data preparation
-from sklearn.model_selection import train_test_split
 from nltk.corpus import stopwords
 from keras.preprocessing.text import Tokenizer
 from keras.preprocessing.sequence import pad_sequences
@@ -32,57 +30,22 @@ from keras import regularizers
 from keras import backend as K
 from keras import regularizers
 
+# Local modules
+from bundle import save_bundle
+from embeddings import load_keywords, load_emb_matrix
+from inference import build_fused_decoder
+from numpy_inference import (WEIGHTS_FILE, export_weights, load_weights, quantization_report, quantize_weights,
+                             quantized_weights_file, saturation_report)
+from sequence_cache import load_sequences
+from training_data import (SPLITS_FILE, TWEETS_FILE, ShardStream, build_shards, load_splits, load_texts, read_shards,
+                           scan_dataset)
+from tweet_preprocessing import tokenize
+
 import nltk
 nltk.download('stopwords')
 
 path = os.path.dirname(os.path.realpath(__file__))
 
-"""Tweet text pre-processing"""
-
-FLAGS = re.MULTILINE | re.DOTALL | regex.VERSION1
-
-def hashtag(text):
-    text = text.group()
-    hashtag_body = text[1:]
-    if hashtag_body.isupper():
-        result = "<hashtag> {} <allcaps>".format(hashtag_body)
-    else:
-        result = " ".join(["<hashtag>"] + regex.split(r"(?=[A-Z])", hashtag_body, flags=FLAGS))
-    return result
-
-def allcaps(text):
-    text = text.group()
-    return text.lower() + " <allcaps>"
-
-
-def tokenize(text):
-    # Different regex parts for smiley faces
-    eyes = r"[8:=;]"
-    nose = r"['`\-]?"
-
-    # function so code less repetitive
-    def re_sub(pattern, repl):
-        return re.sub(pattern, repl, text, flags=FLAGS)
-
-    text = re_sub(r"https?:\/\/\S+\b|www\.(\w+\.)+\S*", "<url>")
-    text = re_sub(r"/"," / ")
-    text = re_sub(r"@\w+", "<user>")
-    text = re_sub(r"{}{}[)dD]+|[)dD]+{}{}".format(eyes, nose, nose, eyes), "<smile>")
-    text = re_sub(r"{}{}p+".format(eyes, nose), "<lolface>")
-    text = re_sub(r"{}{}\(+|\)+{}{}".format(eyes, nose, nose, eyes), "<sadface>")
-    text = re_sub(r"{}{}[\/|l*]".format(eyes, nose), "<neutralface>")
-    text = re_sub(r"<3","<heart>")
-    text = re_sub(r"[-+]?[.\d]*[\d]+[:,.\d]*", "<number>")
-    text = re_sub(r"#\S+", hashtag)
-    text = re_sub(r"([!?.]){2,}", r"\1 <repeat>")
-    text = re_sub(r"\b(\S*?)(.)\2{2,}\b", r"\1\2 <elong>")
-
-    ## -- I just don't understand why the Ruby script adds <allcaps> to everything so I limited the selection.
-    # text = re_sub(r"([^a-z0-9()<>'`\-]){2,}", allcaps)
-    text = re_sub(r"([A-Z]){2,}", allcaps)
-
-    return text.lower()
-
 NB_WORDS = 10000  # Parameter indicating the number of words we'll put in the dictionary
 VAL_SIZE = 1000  # Size of the validation set
 NB_START_EPOCHS = 2000  # Number of epochs we usually start to train with
@@ -93,56 +56,23 @@ LSTM_OUT = 256  # output dimension of language model lstm
 NORMALIZE_TO = 10  # normalize the value of features between 0 to NORMALIZE_TO
 RETWEETS_NORM_TO = 10    # normalize retweet between 0 to RETWEETS_NORM_TO
 HOURS = 72  # number of hours the dataset was recorded for
-RANDOM_NUM = random.randint(0,100)
 
-def deep_model(model, X_train, u_train, a_train, y_train, X_valid, u_valid, a_valid, y_valid):
+def deep_model(model, shard_dir):
 
-    train_shape = a_train.shape
-    train_shape = list(train_shape)
-    train_shape.append(1)
+    # batches are streamed from the shards on disk (see training_data.py)
+    # instead of the splits being held in memory by fit()
+    train_stream = ShardStream(shard_dir+'/train', BATCH_SIZE)
+    valid_stream = ShardStream(shard_dir+'/valid', BATCH_SIZE, shuffle=False)
 
-    valid_shape = a_valid.shape
-    valid_shape = list(valid_shape)
-    valid_shape.append(1)
-
-    history = model.fit([X_train, u_train, a_train.values.reshape(train_shape)]
-                       , y_train.values.reshape(train_shape)
+    history = model.fit_generator(iter(train_stream)
+                       , steps_per_epoch=train_stream.steps
                        , epochs=NB_START_EPOCHS
-                       , batch_size=BATCH_SIZE
-                       , validation_data=([X_valid, u_valid, a_valid.values.reshape(valid_shape)]
-                                          , y_valid.values.reshape(valid_shape))
-                       , verbose=1
-                       , shuffle=True)
+                       , validation_data=iter(valid_stream)
+                       , validation_steps=valid_stream.steps
+                       , verbose=1)
 
     return history
 
-def remove_stopwords(input_text):
-    '''
-    Function to remove English stopwords from a Pandas Series.
-    
-    Parameters:
-        input_text : text to clean
-    Output:
-        cleaned Pandas Series 
-    '''
-    stopwords_list = stopwords.words('english')
-    # Some words which might indicate a certain sentiment are kept via a whitelist
-    whitelist = ["n't", "not", "no"]
-    words = input_text.split() 
-    clean_words = [word for word in words if (word not in stopwords_list or word in whitelist) and len(word) > 1] 
-    return " ".join(clean_words) 
-    
-def remove_mentions(input_text):
-    '''
-    Function to remove mentions, preceded by @, in a Pandas Series
-    
-    Parameters:
-        input_text : text to clean
-    Output:
-        cleaned Pandas Series 
-    '''
-    return re.sub(r'@\w+', '', input_text)
-
 def eval_metric(history, metric_name):
     '''
     Function to evaluate a trained model on a chosen metric. 
@@ -202,128 +132,41 @@ def get_model():
     return model
 
 
-df = pd.read_csv(path+'/user_info_with_age.csv') 
-df = df[['tweet_id', 'text', 'friends_count', 'followers_count', 'account_age', 'total_tweet_count', 'favourited_tweet_count']]      # X, y
-df.text = df.text.apply(tokenize).apply(remove_stopwords).apply(remove_mentions)
-
-# find maximum
-dg = pd.read_csv(path+'/retweet_count_new_unnormalized.csv')
-dg = dg[[str(HOURS)]]
-max_retweet_count = int(dg.max())
+# tweet ids and the maxima the features and counts are normalised by, from one chunked pass over the CSVs
+dataset = scan_dataset(path, HOURS)
+max_retweet_count = dataset['max_retweet_count']
+max_feature_values = dataset['max_feature_values']
 print('MAX RETWEET COUNT: ',max_retweet_count)
+features_count = len(max_feature_values)
 
-# normalize data for hours 0 to 71 (auxilary hours)
-hrs = [str(i) for i in range(HOURS)]
-dg = pd.read_csv(path+'/retweet_count_new_unnormalized.csv')
-dg = (dg[hrs]/max_retweet_count)*RETWEETS_NORM_TO
-# dg = dg[hrs]
-
-X_train, X_test, a_train, a_test = train_test_split(df.text, dg, test_size=0.1, random_state=RANDOM_NUM)
-print('# Train data samples:', X_train.shape[0])
-print('# Test data samples:', X_test.shape[0])
-assert X_train.shape[0] == a_train.shape[0]
-assert X_test.shape[0] == a_test.shape[0]
-
-# normalize data for hours 1 to 72 (output hours)
-hrs = [str(i) for i in range(1,HOURS+1)]
-dg = pd.read_csv(path+'/retweet_count_new_unnormalized.csv')
-dg = (dg[hrs]/max_retweet_count)*RETWEETS_NORM_TO
-# dg = dg[hrs]
-
-X_train, X_test, y_train, y_test = train_test_split(df.text, dg, test_size=0.1, random_state=RANDOM_NUM)
-assert X_train.shape[0] == y_train.shape[0]
-assert X_test.shape[0] == y_test.shape[0]
-
-# user account features
-dh = pd.read_csv(path+'/user_info_with_age.csv') 
-user_featuers = ['friends_count', 'followers_count', 'account_age', 'total_tweet_count', 'favourited_tweet_count']
-
-features = []
-user_feature_count = len(user_featuers)
-for i in range(user_feature_count-1):
-    for j in range(i+1,user_feature_count):
-        feature = dh[user_featuers[i]]*dh[user_featuers[j]]
-        max_feature_value = feature.max()
-        feature = (feature/max_feature_value)*NORMALIZE_TO
-        features.append(feature)
-
-features_count = len(features)
-features = pd.concat(features, axis=1)
-
-X_train, X_test, u_train, u_test = train_test_split(df.text, features, test_size=0.1, random_state=RANDOM_NUM)
-print('# Train data samples:', X_train.shape[0])
-print('# Test data samples:', X_test.shape[0])
-assert X_train.shape[0] == u_train.shape[0]
-assert X_test.shape[0] == u_test.shape[0]
-
-seq_lengths = X_train.apply(lambda x: len(x.split(' ')))
-tweet_stats = seq_lengths.describe()
-MAX_LEN = int(tweet_stats['max'])
-print('MAX_LEN: ',MAX_LEN)
+# the same train/valid/test tweets in every stage and every run
+splits = load_splits(path+'/saved_models/'+SPLITS_FILE, dataset['tweet_ids'])
+train_rows, valid_rows, test_rows = splits['train'], splits['valid'], splits['test']
+print('# Train data samples:', len(train_rows) + len(valid_rows))
+print('# Test data samples:', len(test_rows))
 
+# cleaned, tokenized and padded text, shared with the other training stages through the cache
+tk, sequences, MAX_LEN = load_sequences(path+'/'+TWEETS_FILE, lambda: load_texts(path),
+                                        np.concatenate([train_rows, valid_rows]), path+'/cache', NB_WORDS)
+print('MAX_LEN: ',MAX_LEN)
 
-tk = Tokenizer(num_words=NB_WORDS,
-               filters='!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n',
-               lower=True,
-               split=" ")
-tk.fit_on_texts(X_train)      # creates a internal dictionary
-X_train_seq = tk.texts_to_sequences(X_train)
-X_test_seq = tk.texts_to_sequences(X_test)
-
-X_train_seq_trunc = pad_sequences(X_train_seq, maxlen=MAX_LEN)
-X_test_seq_trunc = pad_sequences(X_test_seq, maxlen=MAX_LEN)
-
-X_train_emb, X_valid_emb, y_train_emb, y_valid_emb = train_test_split(X_train_seq_trunc, y_train, test_size=0.1, random_state=RANDOM_NUM)
-X_train_emb, X_valid_emb, a_train_emb, a_valid_emb = train_test_split(X_train_seq_trunc, a_train, test_size=0.1, random_state=RANDOM_NUM)
-X_train_emb, X_valid_emb, u_train_emb, u_valid_emb = train_test_split(X_train_seq_trunc, u_train, test_size=0.1, random_state=RANDOM_NUM)
-assert X_valid_emb.shape[0] == y_valid_emb.shape[0]
-assert X_train_emb.shape[0] == y_train_emb.shape[0]
-print('Shape of training set:',X_train_emb.shape)
-print('Shape of validation set:',X_valid_emb.shape)
-
-"""Creating a Dictionary"""
-print('creating Dictionary...')
-glove_file = path+'/glove.twitter.27B.100d.txt'
-emb_dict = {}
-glove = open(glove_file)
-for line in glove:
-    values = line.split()
-    word = values[0]
-    vector = np.asarray(values[1:], dtype='float32')
-    emb_dict[word] = vector
-glove.close()
+# normalised rows of the splits, written to shards chunk by chunk on the first run and reused afterwards
+shard_dir = path+'/shards/end-to-end'
+for split in ('train', 'valid', 'test'):
+    if build_shards(shard_dir+'/'+split, path, dataset, sequences, splits[split], NORMALIZE_TO, RETWEETS_NORM_TO):
+        print('wrote the {} shards'.format(split))
+test = read_shards(shard_dir+'/test')
+X_test_seq_trunc, u_test = test['seq'], test['user']
+y_test = test['hours'][:, 1:]
 
+"""Creating the embedding matrix"""
 print('Keywords...')
-f = open(path+'/keywords.txt')
-keywords = []
-for line in f:
-    word = line.split('  ')[0]
-    word = tokenize(word)
-    keywords.append(word)
-
-print('words from custom Word Embedding...')
-custom_glove_file = path+'/custom_WE.txt'
-custom_glove = open(custom_glove_file)
-for line in custom_glove:
-    values = line.split()
-    word = values[0]
-    if word in keywords:
-        print(word)
-        vector = np.asarray(values[1:], dtype='float32')
-        emb_dict[word] = vector
-custom_glove.close()
-
-emb_matrix = np.zeros((NB_WORDS, GLOVE_DIM))
-for w, i in tk.word_index.items():
-    # The word_index contains a token for all words of the training data so we need to limit that
-    if i < NB_WORDS:
-        vect = emb_dict.get(w)
-        # Check if the word from the training data occurs in the GloVe word embeddings
-        # Otherwise the vector is kept with only zeros
-        if vect is not None:
-            emb_matrix[i] = vect
-    else:
-        break
+keywords = load_keywords(path+'/keywords.txt', tokenize)
+
+print('words from GloVe and custom Word Embedding...')
+emb_matrix, emb_stats = load_emb_matrix(tk.word_index, NB_WORDS, GLOVE_DIM,
+                                        path+'/glove.twitter.27B.100d.txt',
+                                        custom_file=path+'/custom_WE.txt', keywords=keywords)
 
 """Building Model"""
 
@@ -360,10 +203,16 @@ opt = opt = optimizers.Adam(learning_rate=0.01, clipnorm=1.0)
 final_model.compile(optimizer=opt, loss=poisson_loss)
 final_model.summary()
 
-glove_history = deep_model(final_model, X_train_emb, u_train_emb, a_train_emb, y_train_emb, X_valid_emb, u_valid_emb, a_valid_emb, y_valid_emb)
+glove_history = deep_model(final_model, shard_dir)
 
 save_model(final_model)
 
+# everything predict_my_retweet.py needs besides the weights
+save_bundle(path+'/saved_models/bundle', path+'/saved_models/final_model.h5', tk, emb_matrix,
+            max_retweet_count, max_feature_values,
+            {'NB_WORDS': NB_WORDS, 'GLOVE_DIM': GLOVE_DIM, 'LSTM_OUT': LSTM_OUT, 'MAX_LEN': MAX_LEN,
+             'NORMALIZE_TO': NORMALIZE_TO, 'RETWEETS_NORM_TO': RETWEETS_NORM_TO, 'HOURS': HOURS})
+
 with open(path+'/loss_log_total.txt', 'w') as f:
     for key, value in glove_history.history.items():
         f.write('%s:%s\n' % (key, value))
@@ -377,30 +226,41 @@ decoder_model = Model([decoder_inputs, decoder_state_input], [decoder_outputs] +
 encoder_model.summary()
 decoder_model.summary()
 
-def decode_sequence(input_seq,user_info_input):
-    state_value = encoder_model.predict([input_seq, user_info_input])
-    
-    target = 0
-    target_list = []
-    for t in range(1,HOURS+1):
-        targets = np.array([[[target]]])
-        targets, state_value = decoder_model.predict([targets,state_value])
-        target = targets[0][0][0]    # this is ln(lambda)
-        target = (math.exp(target)*max_retweet_count)/RETWEETS_NORM_TO   # unnormalize number of retweets
-        # target = math.exp(target)    # this is lambda
-        target = max(math.ceil(target)-1, math.floor(target))
-        target_list.append(target)
-        target = (target/max_retweet_count)*RETWEETS_NORM_TO   # normalize number of retweets
-
-    return target_list  
-
-u_test_np = u_test.to_numpy()	# this is input, hence its normalized
-y_test_np = y_test.to_numpy()*max_retweet_count/RETWEETS_NORM_TO   # GT
+# weights for the TensorFlow free inference path of predict_my_retweet.py
+export_weights(encoder_model, decoder_model, path+'/saved_models/final_model.h5', path+'/saved_models/'+WEIGHTS_FILE)
+# reduced-precision copies for running many replicas
+for precision in ('float16', 'int8'):
+    quantize_weights(path+'/saved_models/'+WEIGHTS_FILE, precision, path+'/saved_models/'+quantized_weights_file(precision))
+
+# runs all HOURS decoder steps inside one predict() call
+fused_model = build_fused_decoder(encoder_inputs, user_info_inputs, encoder_output_dense1, decoder_rnn,
+                                  time_distributed, max_retweet_count, RETWEETS_NORM_TO, HOURS)
+
+u_test_np = u_test	# this is input, hence its normalized
+y_test_np = y_test*max_retweet_count/RETWEETS_NORM_TO   # GT
 test_size = len(X_test_seq_trunc)
 results = open('results.txt', 'w')
+# the whole test split is forecast with a single predict() call
+predicted_test = fused_model.predict([X_test_seq_trunc, u_test_np], batch_size=BATCH_SIZE)
 for i in range(test_size):
     print('test: {}/{}'.format(i+1,test_size))
-    predicted_y = decode_sequence(np.array([X_test_seq_trunc[i]]),np.array([u_test_np[:][i]]))
     print('ground truth: ',y_test_np[i])
-    print('predicted: ',predicted_y)
-
+    print('predicted: ',predicted_test[i].tolist())
+
+# decoder steps the early saturation cut-off saves on the test split, and the error it adds
+test_states = encoder_model.predict([X_test_seq_trunc, u_test_np], batch_size=BATCH_SIZE)
+numpy_weights = load_weights(path+'/saved_models/'+WEIGHTS_FILE)
+for k in (3, 6, 12):
+    report = saturation_report(test_states, numpy_weights, max_retweet_count, RETWEETS_NORM_TO, HOURS, y_test_np, k=k)
+    print('saturation after {k} flat hours: {steps_saved:.1f} of {hours} decoder steps saved per tweet, '
+          'MAE {mae_full:.3f} -> {mae_saturation:.3f}, {changed_counts:.2%} of counts changed'.format(hours=HOURS, **report))
+
+# accuracy, latency and memory of the quantized weights against float32 on the test split
+report = quantization_report({precision: path+'/saved_models/'+quantized_weights_file(precision)
+                              for precision in ('float32', 'float16', 'int8')},
+                             X_test_seq_trunc, u_test_np, max_retweet_count, RETWEETS_NORM_TO, HOURS, y_test_np)
+for precision, row in report.items():
+    print('{:>7}: {:.1f} MB file, {:.1f} MB in memory ({:.1f} MB token gates), {:.3f} ms/tweet, MAE {:.3f}, '
+          '{:.2%} of counts differ from float32'
+          .format(precision, row['file_bytes']/1e6, row['memory_bytes']/1e6, row['token_gates_bytes']/1e6,
+                  row['ms_per_tweet'], row['mae'], row['changed_counts']))
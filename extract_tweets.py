@@ -5,40 +5,69 @@ from tweepy.streaming import StreamListener
 from tweepy import OAuthHandler
 from tweepy import Stream
 import datetime
-import csv
 import os
-# Takes tweets and a designated csv file and writes them to it.
+from keyword_matcher import load_keywords, status_text
+from stream_writer import BufferedCSVWriter
+# Takes tweets and a BufferedCSVWriter and queues them to be written to the csv files.
 
 class StdOutListener(StreamListener):
-    def __init__(self, max_count):
-        self.tweet_count = 1
+    def __init__(self, max_count, writer, progress_every=100, matcher=None):
+        self.writer = writer
+        # the live stream is already filtered by keyword (track=...), a
+        # KeywordMatcher does the same for replayed or archived statuses
+        self.matcher = matcher
+        # a resumed collection keeps counting from the tweets already written
+        self.tweet_count = len(writer.seen) + 1
         self.max_count = max_count
+        self.filter_counts = {}
+        self.progress_every = progress_every
         super(StdOutListener, self).__init__()
 
+    def skip_reason(self, status):
+        '''
+        Function to check a status against the collection filters.
+
+        Output:
+            None if the tweet is collected, else the filter that rejected it
+        '''
+        if status.id in self.writer.seen:
+            return 'seen'
+        if self.matcher is not None and not self.matcher.matches(status_text(status), status.created_at):
+            return 'keyword'
+        if status.lang != "en":
+            return 'lang'
+        if status.user.followers_count < 100:
+            return 'followers'
+        if hasattr(status, 'retweeted_status'):
+            return 'retweet'
+        if hasattr(status, 'quoted_status_id'):
+            return 'quote'
+        if (status.in_reply_to_status_id
+              or status.in_reply_to_user_id
+              or status.in_reply_to_screen_name):
+            return 'reply'
+        return None
+
     def on_status(self, status):
         
         if self.tweet_count > self.max_count:
             return False
         else:
-            if (status.lang == "en") and status.user.followers_count >= 100:
-                if(hasattr(status, 'retweeted_status')
-                  or hasattr(status, 'quoted_status_id')
-                  or status.in_reply_to_status_id
-                  or status.in_reply_to_user_id
-                  or status.in_reply_to_screen_name):
-                      pass
-                else:
-                    # Creating this formatting so when exported to csv the tweet stays on one line
-                    tweet_text = "'" + status.text.replace('\n', ' ') + "'"
-                    csvwriter_retweet_count.writerow([status.id,status.retweet_count])
-                    csvwriter_user_info.writerow([status.id, tweet_text, status.user.id, status.user.friends_count,
-                                         status.user.followers_count, status.user.created_at.strftime('%Y-%m-%d'),
-                                         status.user.statuses_count, status.user.favourites_count])
+            reason = self.skip_reason(status)
+            self.filter_counts[reason or 'collected'] = self.filter_counts.get(reason or 'collected', 0) + 1
+            if reason is None:
+                # Creating this formatting so when exported to csv the tweet stays on one line
+                tweet_text = "'" + status.text.replace('\n', ' ') + "'"
+                self.writer.write(status.id,
+                                  [status.id, tweet_text, status.user.id, status.user.friends_count,
+                                   status.user.followers_count, status.user.created_at.strftime('%Y-%m-%d'),
+                                   status.user.statuses_count, status.user.favourites_count],
+                                  [status.id, status.retweet_count])
 
-                    if(self.tweet_count%100 == 0):
-                        print(status.id, self.tweet_count)
-                    self.tweet_count += 1
-                    return True
+                if self.progress_every and self.tweet_count%self.progress_every == 0:
+                    print(status.id, self.tweet_count)
+                self.tweet_count += 1
+            return True
 
     def on_error(self, status_code):
         if status_code == 420:
@@ -49,32 +78,22 @@ if __name__ == '__main__':
 
     max_count = 1500           # number of tweets
 
-    listener = StdOutListener(max_count)
+#    path = os.getcwd()
+    path = os.path.dirname(os.path.realpath(__file__))
+    # appends to the csv files of an earlier run, skipping the tweets already in them
+    writer = BufferedCSVWriter(path)
+    if writer.resumed:
+        print('resuming with {} tweets already collected ({} rows written to one file only were dropped)'.format(
+            writer.resumed, writer.dropped))
+    listener = StdOutListener(max_count, writer)
     auth = OAuthHandler("CONSUMER_KEY", "CONSUMER_SECRET")
     auth.set_access_token("ACCESS_TOKEN", "ACCESS_TOKEN_SECRET")
     stream = Stream(auth, listener)
-#    path = os.getcwd()
-    path = os.path.dirname(os.path.realpath(__file__))
-    keywords = []
-    f = open(path+"/keywords.txt", "r")
-    for line in f:
-        keywords.append(line.split('  ')[0])
+    keywords = [keyword for keyword, _ in load_keywords(path+"/keywords.txt")]
     # print(keywords)
-    f.close()
     # Filter based on listed items
-    user_info = open(path+'/user_info_t1m1.csv','w')
-    temporal_retweet_count = open(path+'/temporal_retweet_count_t1m1.csv','w')
-
-    csvwriter_user_info = csv.writer(user_info)
-    csvwriter_retweet_count = csv.writer(temporal_retweet_count)
-
-    user_info_fields = ['tweet_id','text','user_id','friends_count','followers_count',
-                        'account_age','total_tweet_count','favourited_tweet_count']
-    retweet_count_fields = ['tweet_id',0]
-    
-    csvwriter_retweet_count.writerow(retweet_count_fields)
-    csvwriter_user_info.writerow(user_info_fields)
-
-    stream.filter(track=keywords)    # This is topic specific
-    user_info.close()
-    temporal_retweet_count.close()
+    try:
+        stream.filter(track=keywords)    # This is topic specific
+    finally:
+        writer.close()
+    print(writer.stats())
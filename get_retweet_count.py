@@ -1,45 +1,172 @@
 # -*- coding: utf-8 -*-
+"""Record the current retweet count of every collected tweet as the next
+hour of the snapshot log (see snapshot_log.py), run it hourly.
 
-import pandas as pd
-import tweepy
+The counts are fetched with the bulk statuses/lookup endpoint, up to 100
+tweets per request, so a 1500 tweet sweep is 15 requests. Deleted or
+otherwise unavailable tweets are left out of lookup responses and are
+recorded as NULL. The requests are spread over every account listed in
+accounts.json (see credential_pool.py), concurrently and away from throttled
+accounts. Only the tweets poll_schedule.py says are due are looked up.
+"""
+
+import json
 import os
-from tweepy import OAuthHandler
-
-
-auth = OAuthHandler("CONSUMER_KEY", "CONSUMER_SECRET")
-auth.set_access_token("ACCESS_TOKEN", "ACCESS_TOKEN_SECRET")
-api = tweepy.API(auth, wait_on_rate_limit=True)
-
-auth1 = OAuthHandler("CONSUMER_KEY1", "CONSUMER_SECRET1")
-auth1.set_access_token("ACCESS_TOKEN1", "ACCESS_TOKEN_SECRET1")
-api1 = tweepy.API(auth1, wait_on_rate_limit=True)
-
-path = os.path.dirname(os.path.realpath(__file__))
-retweet_file = open(path+'/temporal_retweet_count_t1m1.csv','r')
-header = retweet_file.readline()   # skip the first line
-present_index = len(header.split(','))-1
-retweet_count_list = []
-
-# for row in retweet_file:
-for i in range(750):
-    row = retweet_file.readline()
-    status_id = int(row.split(',')[0])
-    try:
-        status = api.get_status(status_id)
-        retweet_count_list.append(status.retweet_count)
-    except tweepy.TweepError:
-        retweet_count_list.append('NULL')
-
-for j in range(750):
-    row = retweet_file.readline()
-    status_id = int(row.split(',')[0])
-    try:
-        status = api1.get_status(status_id)
-        retweet_count_list.append(status.retweet_count)
-    except tweepy.TweepError:
-        retweet_count_list.append('NULL')
-  
-df = pd.read_csv(path+"/temporal_retweet_count_t1m1.csv")
-df[present_index] = retweet_count_list
-df.to_csv(path+'/temporal_retweet_count_t1m1.csv', index=False)
-retweet_file.close()
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from credential_pool import RateLimited
+
+BATCH_SIZE = 100    # most ids statuses/lookup accepts per request
+
+
+def _report_rate_limit(rate_limit, headers):
+    if rate_limit is not None and 'x-rate-limit-remaining' in headers:
+        rate_limit(int(headers['x-rate-limit-remaining']), float(headers['x-rate-limit-reset']))
+
+
+def tweepy_lookup(api, rate_limit=None):
+    '''
+    Function to make a lookup function from a tweepy API.
+
+    Parameters:
+        api : tweepy.API, with wait_on_rate_limit=False when used in a CredentialPool
+        rate_limit : optional callback (remaining, reset) called after every response
+    Output:
+        function (list of tweet ids) -> dict tweet id -> retweet count of the ones found,
+        raising RateLimited when the account is throttled
+    '''
+    import tweepy
+
+    def lookup(tweet_ids):
+        try:
+            statuses = api.statuses_lookup(tweet_ids, trim_user=True)
+        except tweepy.RateLimitError:
+            headers = api.last_response.headers
+            raise RateLimited(float(headers.get('x-rate-limit-reset', time.time() + 60)))
+        _report_rate_limit(rate_limit, api.last_response.headers)
+        return {status.id: status.retweet_count for status in statuses}
+    return lookup
+
+
+def http_lookup(base_url, token=None, rate_limit=None):
+    '''
+    Function to make a lookup function calling statuses/lookup at base_url
+    directly, e.g. a StubTwitterAPI.
+
+    Parameters:
+        base_url : API root, e.g. http://127.0.0.1:8080/1.1
+        token : optional bearer token identifying the account
+        rate_limit : optional callback (remaining, reset) called after every response
+    '''
+    def lookup(tweet_ids):
+        query = urlencode({'id': ','.join(str(tweet_id) for tweet_id in tweet_ids), 'trim_user': 'true'})
+        request = Request(base_url + '/statuses/lookup.json?' + query)
+        if token is not None:
+            request.add_header('Authorization', 'Bearer ' + token)
+        try:
+            with urlopen(request) as response:
+                _report_rate_limit(rate_limit, response.headers)
+                statuses = json.loads(response.read().decode('utf-8'))
+        except HTTPError as e:
+            if e.code == 429:
+                raise RateLimited(float(e.headers.get('x-rate-limit-reset', time.time() + 60)))
+            raise
+        return {status['id']: status['retweet_count'] for status in statuses}
+    return lookup
+
+
+def lookup_retweet_counts(lookup, tweet_ids, batch_size=BATCH_SIZE, workers=1):
+    '''
+    Function to get the retweet counts of many tweets, batch_size per request.
+
+    Parameters:
+        lookup : function (list of tweet ids) -> dict tweet id -> retweet count,
+                 e.g. a CredentialPool
+        tweet_ids : tweets to look up
+        batch_size : ids per request
+        workers : requests in flight at a time
+    Output:
+        list of retweet counts in tweet_ids order, 'NULL' for tweets not found
+    '''
+    batches = [list(tweet_ids[i:i + batch_size]) for i in range(0, len(tweet_ids), batch_size)]
+    if workers > 1:
+        with ThreadPoolExecutor(workers) as executor:
+            found = list(executor.map(lookup, batches))
+    else:
+        found = [lookup(batch) for batch in batches]
+
+    retweet_count_list = []
+    for batch, counts in zip(batches, found):
+        retweet_count_list.extend(counts.get(tweet_id, 'NULL') for tweet_id in batch)
+    return retweet_count_list
+
+
+def tweepy_pool(accounts, max_in_flight=2):
+    '''
+    Function to build a CredentialPool of tweepy APIs.
+
+    Parameters:
+        accounts : list of dicts, see credential_pool.load_accounts
+    '''
+    import tweepy
+    from credential_pool import Account, CredentialPool
+
+    def make_lookup(account):
+        auth = tweepy.OAuthHandler(account['consumer_key'], account['consumer_secret'])
+        auth.set_access_token(account['access_token'], account['access_token_secret'])
+        api = tweepy.API(auth, wait_on_rate_limit=False)
+        return lambda rate_limit: tweepy_lookup(api, rate_limit)
+
+    return CredentialPool([Account(account['name'], make_lookup(account)) for account in accounts], max_in_flight)
+
+
+if __name__ == '__main__':
+    import numpy as np
+    import pandas as pd
+    from credential_pool import load_accounts
+    from poll_schedule import SCHEDULE_FILE, PollSchedule
+    from snapshot_log import LOG_DIR, append_sweep, compact, logged_hours
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    # accounts.json lists the developer accounts to spread the sweep over
+    if os.path.exists(path+'/accounts.json'):
+        accounts = load_accounts(path+'/accounts.json')
+    else:
+        accounts = [{'name': 'default', 'consumer_key': "CONSUMER_KEY", 'consumer_secret': "CONSUMER_SECRET",
+                     'access_token': "ACCESS_TOKEN", 'access_token_secret': "ACCESS_TOKEN_SECRET"}]
+    pool = tweepy_pool(accounts)
+
+    # extract_tweets.py writes the tweets and their hour 0 counts; the hourly
+    # counts go to the snapshot log, one segment per sweep
+    log_dir = path+'/'+LOG_DIR
+    schedule_file = log_dir+'/'+SCHEDULE_FILE
+    df = pd.read_csv(path+"/temporal_retweet_count_t1m1.csv", dtype=str, keep_default_na=False)
+    hours = logged_hours(log_dir)
+    if not hours:
+        # first sweep: start the log from every column collected so far
+        for column in df.columns[1:]:
+            polled = df[df[column] != '']
+            append_sweep(log_dir, int(column), polled['tweet_id'].astype(np.int64).values,
+                         [count if count == 'NULL' else int(count) for count in polled[column]])
+        hours = logged_hours(log_dir)
+    if os.path.exists(schedule_file):
+        schedule = PollSchedule.load(schedule_file)
+    else:
+        schedule = PollSchedule.from_counts(*compact(log_dir))
+
+    # only tweets whose count is still moving are polled every hour, flat ones
+    # less and less often and deleted ones not at all
+    present_index = hours[-1] + 1
+    due = schedule.due(present_index).tolist()
+    new = df[~df['tweet_id'].astype(np.int64).isin(list(schedule.rows))]
+    tweet_ids = due + new['tweet_id'].astype(np.int64).tolist()
+    counts = lookup_retweet_counts(pool, tweet_ids, workers=pool.concurrency)
+    append_sweep(log_dir, present_index, tweet_ids, counts)
+    schedule.update(present_index, due, counts[:len(due)])
+    schedule.add(tweet_ids[len(due):], counts[len(due):], present_index)
+    schedule.save(schedule_file)
+    print('hour {}: polled {} of {} tweets, {}'.format(present_index, len(tweet_ids), len(schedule.rows), pool.stats()))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Batched inference helpers for the encoder/decoder retweet model.
+
+The models are the `encoder_model` and `decoder_model` built in
+end-to-end.py and predict_my_retweet.py: the encoder maps (token sequence,
+pairwise user features) to the initial decoder state, the decoder maps
+(previous hour, state) to (ln(lambda) of the next hour, state).
+
+build_fused_decoder() wires the same layers into one model that runs the
+whole hour-by-hour feedback loop in the graph, so a forecast is a single
+predict() call. Run `python inference.py` to check it against the step by
+step decode_sequences() and compare their latency.
+"""
+
+import numpy as np
+
+
+def user_features(user_info, max_feature_values, normalize_to):
+    '''
+    Function to compute the normalized pairwise user features.
+
+    Parameters:
+        user_info : (N, 5) friends_count, followers_count, account_age,
+                    total_tweet_count, favourited_tweet_count
+        max_feature_values : maximum of each pairwise product on the training data
+        normalize_to : NORMALIZE_TO the model was trained with
+    Output:
+        (N, 10) float array
+    '''
+    user_info = np.asarray(user_info, dtype=np.float64)
+    if user_info.ndim == 1:
+        user_info = user_info[np.newaxis]
+    i, j = np.triu_indices(user_info.shape[1], k=1)
+    return (user_info[:, i]*user_info[:, j]/np.asarray(max_feature_values, dtype=np.float64))*normalize_to
+
+
+def unnormalize(log_rate, max_retweet_count, retweets_norm_to):
+    '''
+    Function to turn decoder outputs (ln(lambda)) into whole retweet counts.
+    '''
+    target = (np.exp(np.asarray(log_rate, dtype=np.float64))*max_retweet_count)/retweets_norm_to
+    # max(ceil(x)-1, floor(x)) as in the single-tweet loop is floor(x)
+    return np.floor(target)
+
+
+def decode_sequences(encoder_model, decoder_model, input_seqs, user_info_inputs, max_retweet_count,
+                     retweets_norm_to, hours, batch_size=1024):
+    '''
+    Function to forecast the hourly retweet counts of many tweets at once.
+
+    The encoder runs once over the whole batch and the decoder is stepped
+    `hours` times over it, feeding back the rounded, renormalized
+    prediction of the previous hour exactly like the one tweet loop did.
+
+    Parameters:
+        encoder_model : Model([encoder_inputs, user_info_inputs], encoder_output_dense1)
+        decoder_model : Model([decoder_inputs, decoder_state_input], [decoder_outputs, decoder_state])
+        input_seqs : (N, MAX_LEN) padded token ids
+        user_info_inputs : (N, 10) normalized pairwise user features
+        max_retweet_count, retweets_norm_to : retweet normalization constants
+        hours : number of hours to forecast
+        batch_size : batch size handed to predict()
+    Output:
+        (N, hours) int64 array of predicted retweet counts
+    '''
+    state_value = encoder_model.predict([input_seqs, user_info_inputs], batch_size=batch_size)
+
+    n = len(state_value)
+    targets = np.zeros((n, 1, 1))
+    target_list = np.zeros((n, hours), dtype=np.int64)
+    for t in range(hours):
+        outputs, state_value = decoder_model.predict([targets, state_value], batch_size=batch_size)
+        target = unnormalize(outputs[:, 0, 0], max_retweet_count, retweets_norm_to)    # ln(lambda) -> retweets
+        target_list[:, t] = target
+        targets[:, 0, 0] = (target/max_retweet_count)*retweets_norm_to   # normalize number of retweets
+
+    return target_list
+
+
+def build_fused_decoder(encoder_inputs, user_info_inputs, encoder_output, decoder_rnn, time_distributed,
+                        max_retweet_count, retweets_norm_to, hours):
+    '''
+    Function to build a model forecasting all hours in one call.
+
+    The decoder layers are applied `hours` times inside the graph, each step
+    getting the previous step's state and its rounded, renormalized
+    prediction, the same feedback decode_sequences() does in Python. The
+    unnormalize/floor/renormalize part runs in float64 like the NumPy
+    version, so both give the same counts.
+
+    Parameters:
+        encoder_inputs, user_info_inputs : the Input layers of the model
+        encoder_output : output of dense_1, the initial decoder state
+        decoder_rnn, time_distributed : the trained rnn_1 and time_distributed_1 layers
+        max_retweet_count, retweets_norm_to : retweet normalization constants
+        hours : number of hours to forecast
+    Output:
+        Model([encoder_inputs, user_info_inputs], (N, hours) predicted retweet counts)
+    '''
+    import tensorflow as tf
+    from keras import backend as K
+    from keras.layers import Concatenate, Lambda
+    from keras.models import Model
+
+    def to_count(log_rate):
+        rate = K.exp(K.cast(log_rate, 'float64'))
+        return tf.floor(rate*max_retweet_count/retweets_norm_to)
+
+    def to_input(count):
+        return K.cast(count/max_retweet_count*retweets_norm_to, 'float32')
+
+    target = Lambda(lambda state: K.zeros_like(state[:, :1, None]), name='first_hour')(encoder_output)
+    state = encoder_output
+    counts = []
+    for t in range(hours):
+        output, state = decoder_rnn(target, initial_state=state)
+        count = Lambda(to_count, name='count_{}'.format(t + 1))(time_distributed(output))
+        counts.append(count)
+        target = Lambda(to_input, name='feedback_{}'.format(t + 1))(count)
+
+    counts = Concatenate(axis=1, name='hourly_counts')(counts)
+    counts = Lambda(lambda c: K.cast(c[:, :, 0], 'int64'), name='forecast')(counts)
+    return Model([encoder_inputs, user_info_inputs], counts)
+
+
+def build_models(bundle, model_file):
+    '''
+    Function to build the inference models of end-to-end.py from a bundle
+    and load the trained weights into them.
+
+    Parameters:
+        bundle : preprocessing bundle, see bundle.load_bundle
+        model_file : final_model.h5 the bundle was built with
+    Output:
+        encoder_model, decoder_model, fused_model
+    '''
+    from keras import regularizers
+    from keras.layers import Dense, Embedding, LSTM, Input, SimpleRNN, TimeDistributed, Concatenate
+    from keras.models import Model
+
+    constants = bundle['constants']
+    features_count = len(bundle['max_feature_values'])
+
+    encoder_inputs = Input(shape=(constants['MAX_LEN'], ), name='input_1')
+    embedding = Embedding(constants['NB_WORDS'], constants['GLOVE_DIM'], name='embedding_1')
+    embedding_inputs = embedding(encoder_inputs)
+    encoder = LSTM(constants['LSTM_OUT'], dropout_U = 0.3, dropout_W = 0.3, name='lstm_1', kernel_regularizer=regularizers.l2(0.05))
+    lstm_output = encoder(embedding_inputs)
+    user_info_inputs = Input(shape=(features_count,), name='input_2')
+    dense1 = Dense(units=128, name='dense_1', kernel_regularizer=regularizers.l2(0.05))     # Whc
+    full_info = Concatenate(name='concatenate_1')([lstm_output, user_info_inputs])
+    encoder_output_dense1 = dense1(full_info)
+
+    decoder_inputs = Input(shape=(None, 1), name='input_3')
+
+    # dynamic RNN
+    decoder_rnn = SimpleRNN(128, return_sequences=True, return_state=True, name='rnn_1', kernel_regularizer=regularizers.l2(0.05))
+    time_distributed = TimeDistributed(Dense(1, activation='linear'), name='time_distributed_1')
+
+    # We are passing encoder_output as the hidden state of dynamic RNN
+    decoder_outputs, _ = decoder_rnn(decoder_inputs, initial_state=encoder_output_dense1)
+    decoder_outputs = time_distributed(decoder_outputs)
+    final_model = Model([encoder_inputs, user_info_inputs, decoder_inputs], decoder_outputs)
+
+    # weights of encoder is already there in decoder, hence we dont need to call it saperatly.
+    final_model.load_weights(model_file, by_name=True)
+
+    encoder_model = Model([encoder_inputs, user_info_inputs], encoder_output_dense1)
+    decoder_state_input = Input(shape=(128,),name='input_4')
+    decoder_outputs, decoder_state = decoder_rnn(decoder_inputs, initial_state=decoder_state_input)
+    decoder_outputs = time_distributed(decoder_outputs)
+    decoder_model = Model([decoder_inputs, decoder_state_input], [decoder_outputs] + [decoder_state])
+
+    fused_model = build_fused_decoder(encoder_inputs, user_info_inputs, encoder_output_dense1, decoder_rnn,
+                                      time_distributed, bundle['max_retweet_count'],
+                                      constants['RETWEETS_NORM_TO'], constants['HOURS'])
+
+    return encoder_model, decoder_model, fused_model
+
+
+def random_batch(bundle, n, seed=0):
+    # token ids and user features spanning the vocabulary and the training feature range
+    constants = bundle['constants']
+    rng = np.random.RandomState(seed)
+    input_seqs = rng.randint(0, constants['NB_WORDS'], size=(n, constants['MAX_LEN']))
+    input_seqs[:, :constants['MAX_LEN'] // 2] = 0    # left padding as pad_sequences does
+    features = rng.uniform(0, constants['NORMALIZE_TO'], size=(n, len(bundle['max_feature_values'])))
+    return input_seqs, features
+
+
+if __name__ == '__main__':
+    import os
+    import time
+
+    from bundle import load_bundle
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    model_file = path+'/saved_models/final_model.h5'
+    bundle = load_bundle(path+'/saved_models/bundle', model_file)
+    constants = bundle['constants']
+    encoder_model, decoder_model, fused_model = build_models(bundle, model_file)
+
+    def step_by_step(input_seqs, features):
+        return decode_sequences(encoder_model, decoder_model, input_seqs, features,
+                                bundle['max_retweet_count'], constants['RETWEETS_NORM_TO'], constants['HOURS'])
+
+    def fused(input_seqs, features):
+        return fused_model.predict([input_seqs, features], batch_size=1024)
+
+    for n in (1, 256):
+        input_seqs, features = random_batch(bundle, n)
+        expected, result = step_by_step(input_seqs, features), fused(input_seqs, features)   # also warms up
+        print('batch {}: {} of {} hourly counts differ'.format(n, int((expected != result).sum()), expected.size))
+        for name, decode in (('step by step', step_by_step), ('fused', fused)):
+            start = time.perf_counter()
+            for _ in range(10):
+                decode(input_seqs, features)
+            print('  {:>12}: {:.1f} ms per call'.format(name, (time.perf_counter() - start)*100))
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Match tweets against the keywords of keywords.txt offline.
+
+extract_tweets.py leaves the keyword filtering to the streaming API
+(track=...). KeywordMatcher applies the same filter to archived statuses:
+all keyword terms go into one Aho-Corasick automaton, so a tweet's text is
+scanned once, character by character, whatever the number of keywords.
+
+Matching follows the track parameter: case-insensitive, a term only
+matches a whole token (punctuation, '#' and '@' around it are fine, so
+'covid' matches '#COVID.' but not 'covid19' or 'covidiot'), and a
+keyword of several words matches when all of its words are in the tweet,
+in any order. A keyword only matches tweets created on or after the date
+it was added, the second column of keywords.txt.
+
+    python keyword_matcher.py dump.jsonl [-o matched.jsonl]
+
+copies the statuses of a JSONL dump that match to matched.jsonl and
+reports the throughput and the hits per keyword.
+"""
+
+import datetime
+import re
+
+KEYWORDS_FILE = 'keywords.txt'
+
+
+def load_keywords(keywords_file):
+    '''
+    Function to read keywords.txt.
+
+    Output:
+        list of (keyword, activation date)
+    '''
+    keywords = []
+    with open(keywords_file, encoding='utf-8') as f:
+        for line in f:
+            fields = re.split(r'\s{2,}', line.strip())
+            if fields[0]:
+                keywords.append((fields[0], datetime.datetime.strptime(fields[1], '%m/%d/%Y').date()
+                                 if len(fields) > 1 else None))
+    return keywords
+
+
+def _is_word(ch):
+    return ch.isalnum() or ch == '_'
+
+
+class KeywordMatcher(object):
+    '''
+    Aho-Corasick matcher of track-style keywords.
+
+    Parameters:
+        keywords : list of keywords or of (keyword, activation date or None)
+    '''
+
+    def __init__(self, keywords):
+        keywords = [keyword if isinstance(keyword, tuple) else (keyword, None) for keyword in keywords]
+        self.keywords = [keyword for keyword, _ in keywords]
+        self.active_from = [active_from for _, active_from in keywords]
+
+        terms = {}
+        self.keyword_terms = []
+        for keyword in self.keywords:
+            self.keyword_terms.append(tuple(sorted({terms.setdefault(term, len(terms))
+                                                    for term in keyword.lower().split()})))
+        self.terms = sorted(terms, key=terms.get)
+        self.keywords_of_term = [[] for _ in self.terms]
+        for k, term_ids in enumerate(self.keyword_terms):
+            for term in term_ids:
+                self.keywords_of_term[term].append(k)
+        # a term starting (ending) with a letter or digit must not continue a
+        # token before (after) it
+        self.bounded = [(_is_word(term[0]), _is_word(term[-1])) for term in self.terms]
+
+        # trie of the terms, then failure links in breadth-first order, folded
+        # into a complete transition table so a scan is one dict lookup per
+        # character
+        goto, outputs = [{}], [[]]
+        for term_id, term in enumerate(self.terms):
+            state = 0
+            for ch in term:
+                if ch not in goto[state]:
+                    goto[state][ch] = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                state = goto[state][ch]
+            outputs[state].append((term_id, len(term)))
+
+        fail = [0]*len(goto)
+        self.delta = [None]*len(goto)
+        self.delta[0] = dict(goto[0])
+        queue = list(goto[0].values())    # one character states fail to the root
+        while queue:
+            next_queue = []
+            for state in queue:
+                self.delta[state] = dict(self.delta[fail[state]])
+                self.delta[state].update(goto[state])
+                outputs[state] = outputs[state] + outputs[fail[state]]
+                for ch, child in goto[state].items():
+                    fail[child] = self.delta[fail[state]].get(ch, 0)
+                    next_queue.append(child)
+            queue = next_queue
+        self.outputs = [tuple(output) for output in outputs]
+
+    def terms_in(self, text):
+        '''
+        Function to find the terms that occur as whole tokens in a text.
+
+        Output:
+            set of term ids
+        '''
+        text = text.lower()
+        delta, outputs, bounded = self.delta, self.outputs, self.bounded
+        found = set()
+        state = 0
+        for end, ch in enumerate(text, 1):
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                for term, length in outputs[state]:
+                    start = end - length
+                    check_start, check_end = bounded[term]
+                    if ((not check_start or start == 0 or not _is_word(text[start - 1]))
+                            and (not check_end or end == len(text) or not _is_word(text[end]))):
+                        found.add(term)
+        return found
+
+    def match(self, text, created_at=None):
+        '''
+        Function to find the keywords a tweet matches.
+
+        Parameters:
+            text : tweet text
+            created_at : date or datetime the tweet was created, None to
+                         ignore the activation dates
+        Output:
+            list of matched keywords, in keywords.txt order
+        '''
+        found = self.terms_in(text)
+        if not found:
+            return []
+        if isinstance(created_at, datetime.datetime):
+            created_at = created_at.date()
+        matched = set()
+        for term in found:
+            for k in self.keywords_of_term[term]:
+                if (k not in matched and all(t in found for t in self.keyword_terms[k])
+                        and (created_at is None or self.active_from[k] is None or created_at >= self.active_from[k])):
+                    matched.add(k)
+        return [self.keywords[k] for k in sorted(matched)]
+
+    def matches(self, text, created_at=None):
+        return bool(self.match(text, created_at))
+
+
+def status_text(status):
+    '''
+    Function to get the full text of a status dict or tweepy Status (the
+    text of a long tweet is cut short, its full text is in extended_tweet).
+    '''
+    if isinstance(status, dict):
+        return status.get('extended_tweet', {}).get('full_text') or status['text']
+    extended = getattr(status, 'extended_tweet', None)
+    return extended['full_text'] if extended else status.text
+
+
+def parse_created_at(created_at):
+    '''
+    Function to parse the created_at of a status JSON, e.g. 'Wed Jan 29 10:00:00 +0000 2020'.
+    '''
+    return datetime.datetime.strptime(created_at, '%a %b %d %H:%M:%S +0000 %Y')
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import os
+    import sys
+    import time
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    parser = argparse.ArgumentParser(description='Filter a JSONL dump of statuses by the keywords of keywords.txt')
+    parser.add_argument('input', help='JSONL file of statuses')
+    parser.add_argument('-o', '--output', default=None, help='write the matching statuses here')
+    parser.add_argument('--keywords', default=path+'/'+KEYWORDS_FILE)
+    parser.add_argument('--ignore-dates', action='store_true', help='match every keyword regardless of its date')
+    args = parser.parse_args()
+
+    matcher = KeywordMatcher(load_keywords(args.keywords))
+    hits = dict.fromkeys(matcher.keywords, 0)
+    statuses = matched = 0
+    match_time = 0.
+    start = time.time()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else None
+    with open(args.input, encoding='utf-8') as f:
+        for line in f:
+            status = json.loads(line)
+            if 'text' not in status:
+                continue      # delete notices, limit messages...
+            created_at = None if args.ignore_dates else parse_created_at(status['created_at'])
+            tic = time.perf_counter()
+            keywords = matcher.match(status_text(status), created_at)
+            match_time += time.perf_counter() - tic
+            statuses += 1
+            if keywords:
+                matched += 1
+                for keyword in keywords:
+                    hits[keyword] += 1
+                if output:
+                    output.write(line)
+    if output:
+        output.close()
+    elapsed = time.time() - start
+    print('{} statuses, {} matched, {:.0f} statuses/min overall, {:.0f} statuses/min matching alone'.format(
+        statuses, matched, 60*statuses/elapsed, 60*statuses/max(match_time, 1e-9)), file=sys.stderr)
+    for keyword, count in sorted(hits.items(), key=lambda item: -item[1]):
+        if count:
+            print('  {:<30} {}'.format(keyword, count), file=sys.stderr)
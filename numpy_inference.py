@@ -0,0 +1,640 @@
+# -*- coding: utf-8 -*-
+"""NumPy-only inference for the retweet model.
+
+export_weights() pulls the trained weights out of final_model.h5 once (this
+is the only part that needs Keras) and writes them to a .npz next to the
+model. The functions below reproduce the model's forward pass with plain
+NumPy matrix products, batched over many tweets, so online scoring does not
+need TensorFlow in the hot path.
+
+Forecaster puts it together with the bundle: raw tweet text and user info
+in, hourly forecast out, without importing Keras or TensorFlow. It caches
+the LSTM output per token sequence, so what-if sweeps over the user
+features of one tweet (Forecaster.sweep) cost about one LSTM pass.
+
+Run `python numpy_inference.py` to export the weights and check the NumPy
+encoder and decoder against the Keras ones.
+"""
+
+import json
+from collections import OrderedDict
+
+import numpy as np
+
+from bundle import model_fingerprint
+from inference import unnormalize, user_features
+
+WEIGHTS_FILE = 'numpy_weights.npz'
+PRECISIONS = ('float32', 'float16', 'int8')
+TOKEN_GATE_CHUNK = 4096     # vocabulary rows projected at a time by load_weights
+
+
+def export_weights(encoder_model, decoder_model, model_file, weights_file):
+    '''
+    Function to write the weights the NumPy runtime needs to a .npz file.
+
+    Parameters:
+        encoder_model : Model([encoder_inputs, user_info_inputs], encoder_output_dense1)
+        decoder_model : Model([decoder_inputs, decoder_state_input], [decoder_outputs, decoder_state])
+        model_file : final_model.h5 the models were loaded from / saved to
+        weights_file : output .npz
+    '''
+    lstm = encoder_model.get_layer('lstm_1')
+    embedding, = encoder_model.get_layer('embedding_1').get_weights()
+    lstm_kernel, lstm_recurrent_kernel, lstm_bias = lstm.get_weights()
+    dense_kernel, dense_bias = encoder_model.get_layer('dense_1').get_weights()
+    rnn_kernel, rnn_recurrent_kernel, rnn_bias = decoder_model.get_layer('rnn_1').get_weights()
+    td_kernel, td_bias = decoder_model.get_layer('time_distributed_1').get_weights()
+
+    np.savez(weights_file,
+             model_sha256=np.array(model_fingerprint(model_file)),
+             recurrent_activation=np.array(lstm.get_config()['recurrent_activation']),
+             embedding=embedding,
+             lstm_kernel=lstm_kernel, lstm_recurrent_kernel=lstm_recurrent_kernel, lstm_bias=lstm_bias,
+             dense_kernel=dense_kernel, dense_bias=dense_bias,
+             rnn_kernel=rnn_kernel, rnn_recurrent_kernel=rnn_recurrent_kernel, rnn_bias=rnn_bias,
+             td_kernel=td_kernel, td_bias=td_bias)
+
+
+def _quantize_int8(value, axis):
+    # symmetric int8 with one float32 scale per slice along `axis`
+    scale = np.abs(value).max(axis=axis, keepdims=True)/127.
+    scale[scale == 0] = 1.
+    return np.round(value/scale).astype(np.int8), scale.astype(np.float32)
+
+
+def quantized_weights_file(precision):
+    '''
+    Function to get the file name export_weights/quantize_weights use for a precision.
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError('precision must be one of {}'.format(', '.join(PRECISIONS)))
+    return WEIGHTS_FILE if precision == 'float32' else WEIGHTS_FILE.replace('.npz', '_{}.npz'.format(precision))
+
+
+def quantize_weights(weights_file, precision, quantized_file):
+    '''
+    Function to write a reduced-precision copy of the weights written by
+    export_weights.
+
+    float16 stores every array in half precision. int8 stores the embedding
+    with one scale per token and the LSTM kernels with one scale per output
+    unit. dense_1 and the decoder are a few percent of the weights but their
+    rounding is fed back through all HOURS decoder steps, so they stay
+    float16. The biases stay float32.
+
+    Parameters:
+        weights_file : .npz written by export_weights
+        precision : 'float16' or 'int8'
+        quantized_file : output .npz
+    '''
+    if precision not in PRECISIONS[1:]:
+        raise ValueError('precision must be float16 or int8')
+    with np.load(weights_file) as data:
+        arrays = {name: data[name] for name in data.files}
+
+    quantized = {'precision': np.array(precision)}
+    for name, value in arrays.items():
+        if value.dtype.kind in 'US' or value.ndim < 2:
+            quantized[name] = value
+        elif precision == 'int8' and (name == 'embedding' or name.startswith('lstm_')):
+            quantized[name], quantized[name + '_scale'] = _quantize_int8(value, 1 if name == 'embedding' else 0)
+        else:
+            quantized[name] = value.astype(np.float16)
+    np.savez(quantized_file, **quantized)
+
+
+def load_weights(weights_file, model_file=None):
+    '''
+    Function to read weights written by export_weights or quantize_weights.
+
+    Quantized weights are expanded back to float32 for the matrix products,
+    except the token gate table, which is the largest array and is kept at
+    the precision of the file. It is projected TOKEN_GATE_CHUNK vocabulary
+    rows at a time straight into that precision, so neither the embedding
+    nor the table is ever held as a whole in float32.
+
+    Parameters:
+        weights_file : .npz written by export_weights or quantize_weights
+        model_file : if given, refuse weights exported from another model
+    Output:
+        dict of float32 arrays, 'token_gates' (and 'token_gates_scale' for int8) at the file's precision
+    '''
+    with np.load(weights_file) as data:
+        weights = {name: data[name] for name in data.files}
+    model_sha256 = str(weights.pop('model_sha256'))
+    if model_file is not None and model_sha256 != model_fingerprint(model_file):
+        raise ValueError('{} was not exported from {}'.format(weights_file, model_file))
+    recurrent_activation = str(weights.pop('recurrent_activation'))
+    precision = str(weights.pop('precision', 'float32'))
+    scales = {name[:-len('_scale')]: weights.pop(name) for name in list(weights) if name.endswith('_scale')}
+    embedding, embedding_scale = weights.pop('embedding'), scales.pop('embedding', None)
+    weights = {name: value.astype(np.float32)*scales.get(name, np.float32(1.)) for name, value in weights.items()}
+    weights['recurrent_activation'] = recurrent_activation
+
+    # The embedding is frozen, so the input half of the LSTM gates only depends
+    # on the token id: project the whole vocabulary once and look rows up.
+    token_gates = np.empty((len(embedding), weights['lstm_kernel'].shape[1]),
+                           dtype=np.int8 if precision == 'int8' else np.dtype(precision))
+    if precision == 'int8':
+        weights['token_gates_scale'] = np.empty((len(embedding), 1), dtype=np.float32)
+    for start in range(0, len(embedding), TOKEN_GATE_CHUNK):
+        rows = slice(start, start + TOKEN_GATE_CHUNK)
+        vectors = embedding[rows].astype(np.float32)
+        if embedding_scale is not None:
+            vectors *= embedding_scale[rows]
+        gates = vectors @ weights['lstm_kernel'] + weights['lstm_bias']
+        if precision == 'int8':
+            token_gates[rows], weights['token_gates_scale'][rows] = _quantize_int8(gates, 1)
+        else:
+            token_gates[rows] = gates
+    weights['token_gates'] = token_gates
+    return weights
+
+
+def weights_nbytes(weights):
+    '''
+    Function to get the memory held by a dict from load_weights.
+
+    Output:
+        dict with the bytes of the token gate table (with its int8 scales)
+        and of all the arrays, the table included
+    '''
+    token_gates = sum(weights[name].nbytes for name in ('token_gates', 'token_gates_scale') if name in weights)
+    others = sum(value.nbytes for name, value in weights.items()
+                 if isinstance(value, np.ndarray) and not name.startswith('token_gates'))
+    return {'token_gates_bytes': token_gates, 'memory_bytes': token_gates + others}
+
+
+def token_gate_rows(weights, ids):
+    '''
+    Function to look up the input half of the LSTM gates of token ids, as float32.
+    '''
+    rows = weights['token_gates'][ids]
+    if 'token_gates_scale' in weights:
+        return rows*weights['token_gates_scale'][ids]
+    return rows.astype(np.float32, copy=False)
+
+
+def texts_to_padded(texts, tokenizer_json, max_len):
+    '''
+    Function to turn cleaned texts into padded token ids exactly like the
+    fitted keras Tokenizer's texts_to_sequences followed by pad_sequences,
+    without importing Keras.
+
+    Parameters:
+        texts : cleaned tweet texts
+        tokenizer_json : Tokenizer.to_json() of the fitted tokenizer
+        max_len : MAX_LEN, sequences keep their last max_len tokens and are zero padded on the left
+    Output:
+        (N, max_len) int32 token ids
+    '''
+    config = json.loads(tokenizer_json)['config']
+    word_index = config['word_index']
+    if isinstance(word_index, str):
+        word_index = json.loads(word_index)
+    num_words = config['num_words']
+    translate = str.maketrans({c: config['split'] for c in config['filters']})
+
+    padded = np.zeros((len(texts), max_len), dtype=np.int32)
+    for row, text in enumerate(texts):
+        if config['lower']:
+            text = text.lower()
+        ids = []
+        for word in text.translate(translate).split(config['split']):
+            i = word_index.get(word) if word else None
+            if i is not None and not (num_words and i >= num_words):
+                ids.append(i)
+        ids = ids[-max_len:]
+        if ids:
+            padded[row, max_len - len(ids):] = ids
+    return padded
+
+
+def _recurrent_activation(x, name):
+    if name == 'hard_sigmoid':
+        return np.clip(0.2*x + 0.5, 0., 1.)
+    if name == 'sigmoid':
+        return 1./(1. + np.exp(-x))
+    raise ValueError('unsupported LSTM recurrent_activation {}'.format(name))
+
+
+def lstm_encode(input_seqs, weights):
+    '''
+    Function to run embedding_1 and lstm_1 over padded token ids.
+
+    The model has no masking, so like Keras the LSTM also steps over the
+    left padding (token 0).
+
+    Parameters:
+        input_seqs : (N, MAX_LEN) padded token ids
+        weights : dict from load_weights
+    Output:
+        (N, LSTM_OUT) float32 last hidden state
+    '''
+    input_seqs = np.asarray(input_seqs)
+    units = weights['lstm_recurrent_kernel'].shape[0]
+    recurrent_kernel = weights['lstm_recurrent_kernel']
+    activation = weights['recurrent_activation']
+
+    h = np.zeros((len(input_seqs), units), dtype=np.float32)
+    c = np.zeros((len(input_seqs), units), dtype=np.float32)
+    for t in range(input_seqs.shape[1]):
+        z = token_gate_rows(weights, input_seqs[:, t]) + h @ recurrent_kernel
+        # keras gate order: input, forget, cell, output
+        i = _recurrent_activation(z[:, :units], activation)
+        f = _recurrent_activation(z[:, units:2*units], activation)
+        c = f*c + i*np.tanh(z[:, 2*units:3*units])
+        o = _recurrent_activation(z[:, 3*units:], activation)
+        h = o*np.tanh(c)
+    return h
+
+
+def encode(input_seqs, features, weights):
+    '''
+    Function to compute the initial decoder state, the NumPy encoder_model.
+    '''
+    return dense_projection(lstm_encode(input_seqs, weights), features, weights)
+
+
+def dense_projection(lstm_output, features, weights):
+    '''
+    Function to compute dense_1 over [lstm_1 output, user features], the
+    initial state of the decoder.
+
+    Parameters:
+        lstm_output : (N, LSTM_OUT) output of lstm_1
+        features : (N, 10) normalized pairwise user features
+        weights : dict from load_weights
+    Output:
+        (N, 128) float32 decoder state
+    '''
+    full_info = np.concatenate([np.asarray(lstm_output, dtype=np.float32),
+                                np.asarray(features, dtype=np.float32)], axis=1)
+    return full_info @ weights['dense_kernel'] + weights['dense_bias']
+
+
+def decoder_step(targets, state, weights):
+    '''
+    Function to run one hour of rnn_1 and time_distributed_1.
+
+    Parameters:
+        targets : (N,) normalized retweet count of the previous hour
+        state : (N, 128) decoder state
+        weights : dict from load_weights
+    Output:
+        (N,) ln(lambda) of the next hour, (N, 128) new state
+    '''
+    # SimpleRNN: h = tanh(x.W + h.U + b), the input is a single value per tweet
+    state = np.tanh(np.asarray(targets, dtype=np.float32)[:, np.newaxis]*weights['rnn_kernel'][0]
+                    + state @ weights['rnn_recurrent_kernel'] + weights['rnn_bias'])
+    return output_log_rate(state, weights), state
+
+
+def output_log_rate(state, weights):
+    '''
+    Function to run time_distributed_1, the ln(lambda) of the hour a decoder
+    state was stepped to.
+    '''
+    return state @ weights['td_kernel'][:, 0] + weights['td_bias'][0]
+
+
+def decode_states(state, weights, max_retweet_count, retweets_norm_to, hours, targets=None, saturation=None):
+    '''
+    Function to forecast the hourly retweet counts from initial decoder states,
+    with the same feedback loop as inference.decode_sequences.
+
+    Parameters:
+        state : (N, 128) initial decoder states
+        weights : dict from load_weights
+        max_retweet_count, retweets_norm_to : retweet normalization constants
+        hours : number of hours to forecast
+        targets : (N,) normalized count fed to the first step, zeros (the
+                  hour 0 input of a new tweet) by default
+        saturation : optional (threshold, k) early cut-off, see iter_decode
+    Output:
+        (N, hours) int64 array of predicted retweet counts
+    '''
+    target_list = np.zeros((len(state), hours), dtype=np.int64)
+    for t, target in enumerate(iter_decode(state, weights, max_retweet_count, retweets_norm_to, hours, targets,
+                                           saturation)):
+        target_list[:, t] = target
+    return target_list
+
+
+def iter_decode(state, weights, max_retweet_count, retweets_norm_to, hours, targets=None, saturation=None):
+    '''
+    Generator version of decode_states, yields the counts of each hour as
+    soon as that hour is decoded.
+
+    With saturation=(threshold, k) a tweet stops being decoded once its
+    predicted count has changed by less than `threshold` for k consecutive
+    hours, its later hours repeat the last count, and the decoder only keeps
+    stepping the tweets that have not settled.
+
+    Output:
+        generator of `hours` (N,) int64 arrays, the counts of hours 1, 2, ...
+    '''
+    state = np.asarray(state, dtype=np.float32)
+    if targets is None:
+        targets = np.zeros(len(state), dtype=np.float32)
+    counts = np.asarray(targets, dtype=np.float64)*max_retweet_count/retweets_norm_to
+    flat_hours = np.zeros(len(state), dtype=np.int64)
+    active = np.arange(len(state))
+    for t in range(hours):
+        if len(active):
+            log_rate, state = decoder_step(targets, state, weights)
+            target = unnormalize(log_rate, max_retweet_count, retweets_norm_to)
+            if saturation is not None:
+                threshold, k = saturation
+                flat_hours[active] = np.where(np.abs(target - counts[active]) < threshold, flat_hours[active] + 1, 0)
+            counts[active] = target
+            targets = ((target/max_retweet_count)*retweets_norm_to).astype(np.float32)   # normalize number of retweets
+            if saturation is not None:
+                keep = flat_hours[active] < k
+                active, state, targets = active[keep], state[keep], targets[keep]
+        yield counts.astype(np.int64)
+
+
+def saturation_steps(target_list, threshold, k):
+    '''
+    Function to count the decoder steps the saturation cut-off of
+    iter_decode takes on forecast curves.
+
+    Parameters:
+        target_list : (N, hours) counts decoded with saturation=(threshold, k)
+    Output:
+        (N,) int64 number of decoder steps run per tweet
+    '''
+    target_list = np.asarray(target_list, dtype=np.float64)
+    hours = target_list.shape[1]
+    flat = np.abs(np.diff(target_list, axis=1, prepend=0.)) < threshold
+    steps = np.full(len(target_list), hours, dtype=np.int64)
+    run = np.zeros(len(target_list), dtype=np.int64)
+    for t in range(hours):
+        run = np.where(flat[:, t], run + 1, 0)
+        steps = np.where((run >= k) & (steps == hours), t + 1, steps)
+    return steps
+
+
+def saturation_report(state, weights, max_retweet_count, retweets_norm_to, hours, ground_truth,
+                      threshold=1, k=6):
+    '''
+    Function to measure what the saturation cut-off saves and costs.
+
+    Parameters:
+        state : (N, 128) initial decoder states, e.g. encoder_model output on the test split
+        weights, max_retweet_count, retweets_norm_to, hours : as for decode_states
+        ground_truth : (N, hours) real retweet counts
+        threshold, k : saturation settings
+    Output:
+        dict with the average decoder steps saved per tweet and the mean
+        absolute error against ground truth with and without the cut-off
+    '''
+    full = decode_states(state, weights, max_retweet_count, retweets_norm_to, hours)
+    cut = decode_states(state, weights, max_retweet_count, retweets_norm_to, hours, saturation=(threshold, k))
+    ground_truth = np.asarray(ground_truth, dtype=np.float64)
+    return {'threshold': threshold, 'k': k,
+            'steps_saved': float(hours - saturation_steps(cut, threshold, k).mean()),
+            'mae_full': float(np.abs(full - ground_truth).mean()),
+            'mae_saturation': float(np.abs(cut - ground_truth).mean()),
+            'changed_counts': float((cut != full).mean())}
+
+
+class Forecaster(object):
+    '''
+    Hourly retweet forecasts from raw tweets using only NumPy.
+
+    The lstm_1 output only depends on the token ids, so it is kept in an LRU
+    cache keyed by the padded sequence: tweets whose cleaned text was seen
+    recently, and sweeps over user features for one text, skip the LSTM.
+
+    Parameters:
+        bundle : preprocessing bundle, see bundle.load_bundle
+        weights : dict from load_weights
+        cache_size : number of lstm_1 outputs kept, 0 disables the cache
+    '''
+
+    def __init__(self, bundle, weights, cache_size=10000):
+        self.bundle = bundle
+        self.weights = weights
+        self.constants = bundle['constants']
+        self.max_retweet_count = bundle['max_retweet_count']
+        self.cache_size = cache_size
+        self.lstm_cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def sequences(self, texts, workers=1):
+        from tweet_preprocessing import preprocess_texts
+        return texts_to_padded(preprocess_texts(list(texts), workers=workers), self.bundle['tokenizer_json'],
+                               self.constants['MAX_LEN'])
+
+    def features(self, user_info):
+        return user_features(user_info, self.bundle['max_feature_values'], self.constants['NORMALIZE_TO'])
+
+    def lstm_outputs(self, input_seqs):
+        '''
+        Function to get the lstm_1 output of padded sequences, running the
+        LSTM once over the ones missing from the cache.
+
+        Parameters:
+            input_seqs : (N, MAX_LEN) padded token ids
+        Output:
+            (N, LSTM_OUT) float32 array
+        '''
+        input_seqs = np.asarray(input_seqs)
+        keys = [row.tobytes() for row in input_seqs]
+        missing = OrderedDict()
+        for i, key in enumerate(keys):
+            if key not in self.lstm_cache and key not in missing:
+                missing[key] = i
+        computed = {}
+        if missing:
+            computed = dict(zip(missing, lstm_encode(input_seqs[list(missing.values())], self.weights)))
+        self.cache_hits += len(keys) - len(missing)
+        self.cache_misses += len(missing)
+
+        output = np.empty((len(keys), self.weights['lstm_recurrent_kernel'].shape[0]), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in computed:
+                output[i] = computed[key]
+            else:
+                output[i] = self.lstm_cache[key]
+                self.lstm_cache.move_to_end(key)
+        if self.cache_size:
+            for key, value in computed.items():
+                self.lstm_cache[key] = value
+            while len(self.lstm_cache) > self.cache_size:
+                self.lstm_cache.popitem(last=False)
+        return output
+
+    def decode(self, state, saturation=None):
+        return decode_states(state, self.weights, self.max_retweet_count, self.constants['RETWEETS_NORM_TO'],
+                             self.constants['HOURS'], saturation=saturation)
+
+    def iter_forecast(self, texts, user_info, saturation=None):
+        '''
+        Function to forecast many tweets hour by hour, see iter_decode.
+
+        Output:
+            generator of HOURS (N,) int64 arrays, the counts of hours 1, 2, ...
+        '''
+        state = dense_projection(self.lstm_outputs(self.sequences(texts)), self.features(user_info), self.weights)
+        return iter_decode(state, self.weights, self.max_retweet_count, self.constants['RETWEETS_NORM_TO'],
+                           self.constants['HOURS'], saturation=saturation)
+
+    def forecast(self, texts, user_info, workers=1):
+        '''
+        Function to forecast many tweets.
+
+        Parameters:
+            texts : raw tweet texts
+            user_info : (N, 5) friends_count, followers_count, account_age,
+                        total_tweet_count, favourited_tweet_count
+            workers : processes cleaning the texts, see tweet_preprocessing.preprocess_texts
+        Output:
+            (N, HOURS) int64 array of predicted retweet counts
+        '''
+        lstm_output = self.lstm_outputs(self.sequences(texts, workers))
+        return self.decode(dense_projection(lstm_output, self.features(user_info), self.weights))
+
+    def sweep(self, text, user_info_grid):
+        '''
+        Function to forecast one tweet under many user feature settings.
+
+        The text goes through the LSTM once (or not at all when cached), only
+        dense_1 and the decoder run over the grid, batched.
+
+        Parameters:
+            text : raw tweet text
+            user_info_grid : (M, 5) user fields to try, same order as forecast()
+        Output:
+            (M, HOURS) int64 array of predicted retweet counts
+        '''
+        features = self.features(user_info_grid)
+        lstm_output = np.repeat(self.lstm_outputs(self.sequences([text])), len(features), axis=0)
+        return self.decode(dense_projection(lstm_output, features, self.weights))
+
+
+def load_forecaster(path, precision='float32'):
+    '''
+    Function to load the bundle and exported weights saved by end-to-end.py.
+
+    Parameters:
+        path : directory holding saved_models/
+        precision : 'float32', or 'float16'/'int8' for the quantized weights
+    '''
+    from bundle import load_bundle
+
+    model_file = path+'/saved_models/final_model.h5'
+    bundle = load_bundle(path+'/saved_models/bundle', model_file)
+    return Forecaster(bundle, load_weights(path+'/saved_models/'+quantized_weights_file(precision), model_file))
+
+
+def quantization_report(weights_files, input_seqs, features, max_retweet_count, retweets_norm_to, hours,
+                        ground_truth=None):
+    '''
+    Function to compare the float32 weights with their quantized copies.
+
+    Parameters:
+        weights_files : dict precision -> weights file, including 'float32'
+        input_seqs, features : (N, MAX_LEN) padded token ids and (N, 10) user features
+        max_retweet_count, retweets_norm_to, hours : as for decode_states
+        ground_truth : optional (N, HOURS) real retweet counts
+    Output:
+        dict precision -> file size, in-memory weight size and the part of it
+        taken by the token gate table, ms per tweet,
+        share of hourly counts differing from float32, their mean absolute
+        difference and, with ground_truth, the MAE
+    '''
+    import os
+    import time
+
+    results, reference = {}, None
+    for precision in sorted(weights_files, key=PRECISIONS.index):
+        weights = load_weights(weights_files[precision])
+        start = time.perf_counter()
+        counts = decode_states(encode(input_seqs, features, weights), weights, max_retweet_count, retweets_norm_to,
+                               hours)
+        elapsed = time.perf_counter() - start
+        reference = counts if reference is None else reference
+        results[precision] = {
+            'file_bytes': os.path.getsize(weights_files[precision]),
+            **weights_nbytes(weights),
+            'ms_per_tweet': elapsed*1000/len(counts),
+            'changed_counts': float((counts != reference).mean()),
+            'abs_difference': float(np.abs(counts - reference).mean())}
+        if ground_truth is not None:
+            results[precision]['mae'] = float(np.abs(counts - np.asarray(ground_truth)).mean())
+    return results
+
+
+if __name__ == '__main__':
+    import os
+    import time
+
+    from keras.models import Model
+
+    from bundle import load_bundle
+    from inference import build_models, decode_sequences, random_batch
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    model_file = path+'/saved_models/final_model.h5'
+    weights_file = path+'/saved_models/'+WEIGHTS_FILE
+    bundle = load_bundle(path+'/saved_models/bundle', model_file)
+    constants = bundle['constants']
+
+    encoder_model, decoder_model, _ = build_models(bundle, model_file)
+    export_weights(encoder_model, decoder_model, model_file, weights_file)
+    weights = load_weights(weights_file, model_file)
+
+    input_seqs, features = random_batch(bundle, 1000)
+    states = encoder_model.predict([input_seqs, features], batch_size=1024)
+    lstm_output = Model(encoder_model.inputs[0], encoder_model.get_layer('lstm_1').output).predict(
+        input_seqs, batch_size=1024)
+    print('lstm_1 max abs difference: ', np.abs(lstm_encode(input_seqs, weights) - lstm_output).max())
+    print('dense_1 max abs difference: ', np.abs(dense_projection(lstm_output, features, weights) - states).max())
+
+    for n in (1, 1000):
+        start = time.perf_counter()
+        for _ in range(10):
+            encoder_model.predict([input_seqs[:n], features[:n]])
+        keras_time = (time.perf_counter() - start)/10
+        start = time.perf_counter()
+        for _ in range(10):
+            encode(input_seqs[:n], features[:n], weights)
+        numpy_time = (time.perf_counter() - start)/10
+        print('encoder, {} tweets: Keras {:.3f} ms/tweet, NumPy {:.3f} ms/tweet'.format(
+            n, keras_time*1000/n, numpy_time*1000/n))
+
+    start = time.perf_counter()
+    expected = decode_sequences(encoder_model, decoder_model, input_seqs, features, bundle['max_retweet_count'],
+                                constants['RETWEETS_NORM_TO'], constants['HOURS'])
+    keras_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = decode_states(states, weights, bundle['max_retweet_count'], constants['RETWEETS_NORM_TO'],
+                           constants['HOURS'])
+    numpy_time = time.perf_counter() - start
+
+    log_rate, _ = decoder_step(np.zeros(len(states), dtype=np.float32), states, weights)
+    keras_log_rate, _ = decoder_model.predict([np.zeros((len(states), 1, 1)), states])
+    print('first hour ln(lambda) max abs difference: ', np.abs(log_rate - keras_log_rate[:, 0, 0]).max())
+    print('hourly counts differing from Keras: {} of {}'.format(int((expected != result).sum()), expected.size))
+    print('Keras decoder: {:.1f} ms, NumPy decoder: {:.1f} ms for {} tweets'.format(
+        keras_time*1000, numpy_time*1000, len(states)))
+
+    # what-if sweep: one text, 1000 follower counts, against encoding the text once per setting
+    forecaster = Forecaster(bundle, weights)
+    text = 'Anyone with coronavirus symptoms can book an appointment at a regional testing site.'
+    grid = np.array([[818, followers, 133, 13594, 514] for followers in np.linspace(100, 10**6, 1000)])
+    start = time.perf_counter()
+    input_seqs = np.repeat(forecaster.sequences([text]), len(grid), axis=0)
+    expected = forecaster.decode(encode(input_seqs, forecaster.features(grid), weights))
+    full_time = time.perf_counter() - start
+    start = time.perf_counter()
+    swept = forecaster.sweep(text, grid)
+    sweep_time = time.perf_counter() - start
+    print('sweep of {} settings: {:.1f} ms, {:.1f} ms running the LSTM per setting, {} of {} counts differ'.format(
+        len(grid), sweep_time*1000, full_time*1000, int((swept != expected).sum()), expected.size))
@@ -1,284 +1,179 @@
 # -*- coding: utf-8 -*-
+"""Predict the hourly retweet counts of a tweet.
+
+    python predict_my_retweet.py
+        asks for one tweet and its user's numbers and prints the forecast
+
+    python predict_my_retweet.py --input user_info_t1m1.csv --output forecasts.csv [--chunk-size 10000]
+        scores every row of a file in the user_info layout written by
+        extract_tweets.py (CSV, or JSONL with the same fields). The file is
+        read, cleaned and scored chunk by chunk and each chunk is appended to
+        the output as soon as it is done, so memory does not grow with the
+        input. If the job is killed, running the same command again resumes
+        after the last completed chunk.
+"""
 
 # Basic packages
-import pandas as pd 
-import numpy as np
-import re
-import os
-import collections
-import matplotlib.pyplot as plt
-from pathlib import Path
-import sys
-import regex
-import math
-import random
+import argparse
+import datetime
 import json
+import os
 
-# Packages for data preparation
-from sklearn.model_selection import train_test_split
-from nltk.corpus import stopwords
-from keras.preprocessing.text import Tokenizer
-from keras.preprocessing.sequence import pad_sequences
-from keras.utils.np_utils import to_categorical
-from sklearn.preprocessing import LabelEncoder
-
-# Packages for modeling
-from keras import models
-from keras import optimizers
-from keras.models import Model
-from keras import layers
-from keras.layers import Dense, Embedding, LSTM, Input, SimpleRNN, TimeDistributed, Concatenate, BatchNormalization, LeakyReLU
-from keras import regularizers
-from keras import backend as K
-from keras import regularizers
-
-import nltk
-nltk.download('stopwords')
-
-path = os.path.dirname(os.path.realpath(__file__))
-
-# take input
-tweet_text = input("Enter tweet :") 
-friends_count = int(input("Enter friends_count :"))
-followers_count = int(input("Enter followers_count :"))
-account_age = int(input("Enter account_age in MONTHS :"))
-total_tweet_count = int(input("Enter total_tweet_count :"))
-favourited_tweet_count = int(input("Enter favourited_tweet_count :"))
-user_info_input = [friends_count, followers_count, account_age, total_tweet_count, favourited_tweet_count]
-
-"""Tweet text pre-processing"""
-
-FLAGS = re.MULTILINE | re.DOTALL | regex.VERSION1
-
-def hashtag(text):
-    text = text.group()
-    hashtag_body = text[1:]
-    if hashtag_body.isupper():
-        result = "<hashtag> {} <allcaps>".format(hashtag_body)
-    else:
-        result = " ".join(["<hashtag>"] + regex.split(r"(?=[A-Z])", hashtag_body, flags=FLAGS))
-    return result
-
-def allcaps(text):
-    text = text.group()
-    return text.lower() + " <allcaps>"
-
-
-def tokenize(text):
-    # Different regex parts for smiley faces
-    eyes = r"[8:=;]"
-    nose = r"['`\-]?"
-
-    # function so code less repetitive
-    def re_sub(pattern, repl):
-        return re.sub(pattern, repl, text, flags=FLAGS)
-
-    text = re_sub(r"https?:\/\/\S+\b|www\.(\w+\.)+\S*", "<url>")
-    text = re_sub(r"/"," / ")
-    text = re_sub(r"@\w+", "<user>")
-    text = re_sub(r"{}{}[)dD]+|[)dD]+{}{}".format(eyes, nose, nose, eyes), "<smile>")
-    text = re_sub(r"{}{}p+".format(eyes, nose), "<lolface>")
-    text = re_sub(r"{}{}\(+|\)+{}{}".format(eyes, nose, nose, eyes), "<sadface>")
-    text = re_sub(r"{}{}[\/|l*]".format(eyes, nose), "<neutralface>")
-    text = re_sub(r"<3","<heart>")
-    text = re_sub(r"[-+]?[.\d]*[\d]+[:,.\d]*", "<number>")
-    text = re_sub(r"#\S+", hashtag)
-    text = re_sub(r"([!?.]){2,}", r"\1 <repeat>")
-    text = re_sub(r"\b(\S*?)(.)\2{2,}\b", r"\1\2 <elong>")
-
-    ## -- I just don't understand why the Ruby script adds <allcaps> to everything so I limited the selection.
-    # text = re_sub(r"([^a-z0-9()<>'`\-]){2,}", allcaps)
-    text = re_sub(r"([A-Z]){2,}", allcaps)
-
-    return text.lower()
-
-NB_WORDS = 10000  # Parameter indicating the number of words we'll put in the dictionary
-VAL_SIZE = 1000  # Size of the validation set
-NB_START_EPOCHS = 2000  # Number of epochs we usually start to train with
-BATCH_SIZE = 64  # Size of the batches used in the mini-batch gradient descent
-MAX_LEN = 26  # Maximum number of words in a sequence
-GLOVE_DIM = 100  # Number of dimensions of the GloVe word embeddings
-LSTM_OUT = 512  # output dimension of language model lstm
-NORMALIZE_TO = 100  # normalize the value of features between 0 to NORMALIZE_TO
-RETWEETS_NORM_TO = 10
-HOURS = 72  # number of hours the dataset was recorded for
-RANDOM_NUM = random.randint(0,100)
-
-def remove_stopwords(input_text):
+import numpy as np
+import pandas as pd
+
+# Local modules
+# The model runs on NumPy with the weights exported by end-to-end.py, so
+# predicting does not import Keras or TensorFlow.
+from numpy_inference import load_forecaster
+
+USER_FIELDS = ['friends_count', 'followers_count', 'account_age', 'total_tweet_count', 'favourited_tweet_count']
+
+
+def account_age_months(values, as_of):
     '''
-    Function to remove English stopwords from a Pandas Series.
-    
+    Function to get account ages in months.
+
+    extract_tweets.py stores the account creation date (YYYY-MM-DD) while
+    the model was trained on the age in months, numbers are taken as
+    already being months.
+
     Parameters:
-        input_text : text to clean
+        values : Pandas Series of account_age values
+        as_of : datetime.date the ages are computed at
     Output:
-        cleaned Pandas Series 
+        float array, NaN where the value is missing or neither a number nor a date
     '''
-    stopwords_list = stopwords.words('english')
-    # Some words which might indicate a certain sentiment are kept via a whitelist
-    whitelist = ["n't", "not", "no"]
-    words = input_text.split() 
-    clean_words = [word for word in words if (word not in stopwords_list or word in whitelist) and len(word) > 1] 
-    return " ".join(clean_words) 
-    
-def remove_mentions(input_text):
+    months = pd.to_numeric(values, errors='coerce')
+    dates = pd.to_datetime(values[months.isnull()], format='%Y-%m-%d', errors='coerce')
+    months[months.isnull()] = (as_of.year - dates.dt.year)*12 + (as_of.month - dates.dt.month)
+    return months.values.astype(np.float64)
+
+
+def read_chunks(input_file, chunk_size):
+    '''
+    Function to read a CSV or JSONL file of tweets chunk by chunk.
+
+    Output:
+        iterator of Pandas DataFrames of at most chunk_size rows
+    '''
+    if input_file.endswith('.jsonl') or input_file.endswith('.json'):
+        return pd.read_json(input_file, lines=True, chunksize=chunk_size, dtype={'tweet_id': str})
+    return pd.read_csv(input_file, chunksize=chunk_size, dtype={'tweet_id': str, 'account_age': str})
+
+
+def _save_progress(progress_file, progress):
+    # written next to its final place and renamed, so it is never half written
+    with open(progress_file + '.tmp', 'w') as f:
+        json.dump(progress, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(progress_file + '.tmp', progress_file)
+
+
+def score_file(forecaster, input_file, output_file, chunk_size=10000, as_of=None):
     '''
-    Function to remove mentions, preceded by @, in a Pandas Series
-    
+    Function to forecast every tweet of a file, streaming the results to a CSV.
+
+    After each chunk the output is flushed and its size and the number of
+    completed chunks are recorded in `<output_file>.progress`. A later call
+    with the same arguments drops anything written after that point and
+    continues with the next chunk. The progress file is removed when the
+    whole input is done.
+
     Parameters:
-        input_text : text to clean
+        forecaster : numpy_inference.Forecaster
+        input_file : CSV or JSONL with tweet_id, text and the five user fields
+        output_file : CSV of tweet_id and the predicted count of each hour
+        chunk_size : rows read and scored at a time
+        as_of : date account creation dates are turned into ages at, today by default
     Output:
-        cleaned Pandas Series 
+        number of rows scored by this call; rows with a missing or invalid
+        user field are skipped and reported
     '''
-    return re.sub(r'@\w+', '', input_text)
-
-df = pd.read_csv(path+'/user_info_with_age.csv') 
-df = df[['tweet_id', 'text', 'friends_count', 'followers_count', 'account_age', 'total_tweet_count', 'favourited_tweet_count']]      # X, y
-df.text = df.text.apply(tokenize).apply(remove_stopwords).apply(remove_mentions)
-
-# find maximum
-dg = pd.read_csv(path+'/retweet_count_new_unnormalized.csv')
-dg = dg[[str(HOURS)]]
-max_retweet_count = int(dg.max())
-
-# user account features
-dh = pd.read_csv(path+'/user_info_with_age.csv') 
-user_featuers = ['friends_count', 'followers_count', 'account_age', 'total_tweet_count', 'favourited_tweet_count']
-
-features = []
-max_feature_values = []
-user_feature_count = len(user_featuers)
-for i in range(user_feature_count-1):
-    for j in range(i+1,user_feature_count):
-        feature = dh[user_featuers[i]]*dh[user_featuers[j]]
-        max_feature_value = feature.max()
-        max_feature_values.append(max_feature_value)
-        feature = (feature/max_feature_value)*NORMALIZE_TO
-        features.append(feature)
-
-features_count = len(features)
-features = pd.concat(features, axis=1)
-
-X_train, X_test, u_train, u_test = train_test_split(df.text, features, test_size=0.1, random_state=RANDOM_NUM)
-
-seq_lengths = X_train.apply(lambda x: len(x.split(' ')))
-tweet_stats = seq_lengths.describe()
-MAX_LEN = int(tweet_stats['max'])
-
-tk = Tokenizer(num_words=NB_WORDS,
-               filters='!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n',
-               lower=True,
-               split=" ")
-tk.fit_on_texts(X_train)      # creates a internal dictionary
-
-
-"""Creating a Dictionary"""
-print('creating Dictionary...')
-glove_file = path+'/glove.twitter.27B.100d.txt'
-# glove_file = 'customWE_100d.txt'
-emb_dict = {}
-glove = open(glove_file)
-for line in glove:
-    values = line.split()
-    word = values[0]
-    vector = np.asarray(values[1:], dtype='float32')
-    emb_dict[word] = vector
-glove.close()
-
-f = open(path+'/keywords.txt')
-keywords = []
-for line in f:
-    word = line.split('  ')[0]
-    word = tokenize(word)
-    keywords.append(word)
-
-custom_glove_file = path+'/custom_WE.txt'
-custom_glove = open(custom_glove_file)
-for line in custom_glove:
-    values = line.split()
-    word = values[0]
-    if word in keywords:
-        vector = np.asarray(values[1:], dtype='float32')
-        emb_dict[word] = vector
-custom_glove.close()
-
-emb_matrix = np.zeros((NB_WORDS, GLOVE_DIM))
-for w, i in tk.word_index.items():
-    # The word_index contains a token for all words of the training data so we need to limit that
-    if i < NB_WORDS:
-        vect = emb_dict.get(w)
-        # Check if the word from the training data occurs in the GloVe word embeddings
-        # Otherwise the vector is kept with only zeros
-        if vect is not None:
-            emb_matrix[i] = vect
+    progress_file = output_file + '.progress'
+    stat = os.stat(input_file)
+    job = {'input': os.path.abspath(input_file), 'input_size': stat.st_size, 'input_mtime': stat.st_mtime,
+           'chunk_size': chunk_size}
+    as_of = as_of or datetime.date.today()
+
+    progress = dict(job, chunks_done=0, output_bytes=0)
+    if os.path.exists(progress_file):
+        with open(progress_file) as f:
+            saved = json.load(f)
+        if {key: saved.get(key) for key in job} != job:
+            raise ValueError('{} belongs to another input or chunk size, delete it to start over'
+                             .format(progress_file))
+        progress = saved
+        print('resuming after chunk {}'.format(progress['chunks_done']))
+    elif os.path.exists(output_file):
+        raise ValueError('{} exists and has no progress file, refusing to overwrite it'.format(output_file))
+
+    hours = forecaster.constants['HOURS']
+    scored = 0
+    with open(output_file, 'a+') as out:
+        out.truncate(progress['output_bytes'])    # drop a chunk that was written but not recorded
+        out.seek(0, os.SEEK_END)
+        for i, chunk in enumerate(read_chunks(input_file, chunk_size)):
+            if i < progress['chunks_done']:
+                continue
+            user_info = chunk[USER_FIELDS].apply(pd.to_numeric, errors='coerce')
+            user_info['account_age'] = account_age_months(chunk['account_age'].astype(str), as_of)
+            # a row with a missing or unreadable user field is left out rather than failing the whole run
+            valid = np.isfinite(user_info.values.astype(np.float64)).all(axis=1)
+            for row in np.flatnonzero(~valid):
+                bad = [field for field in USER_FIELDS if not np.isfinite(user_info[field].values[row])]
+                print('skipping tweet {}: invalid {}'.format(chunk['tweet_id'].values[row], ', '.join(bad)))
+            if valid.any():
+                forecast = forecaster.forecast(chunk['text'].astype(str).values[valid].tolist(),
+                                               user_info.values[valid].astype(np.float64), workers=None)
+                result = pd.DataFrame(forecast, columns=[str(h) for h in range(1, hours + 1)])
+                result.insert(0, 'tweet_id', chunk['tweet_id'].values[valid])
+                result.to_csv(out, header=(out.tell() == 0), index=False)
+            out.flush()
+            os.fsync(out.fileno())
+
+            progress['chunks_done'] = i + 1
+            progress['output_bytes'] = out.tell()
+            _save_progress(progress_file, progress)
+            scored += int(valid.sum())
+            print('chunk {}: {} tweets scored, {} skipped'.format(i + 1, int(valid.sum()), int((~valid).sum())))
+
+    os.remove(progress_file)
+    return scored
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Predict hourly retweet counts')
+    parser.add_argument('--input', help='CSV or JSONL in the user_info layout, scored in bulk')
+    parser.add_argument('--output', help='CSV the bulk forecasts are written to')
+    parser.add_argument('--chunk-size', type=int, default=10000)
+    args = parser.parse_args()
+    if bool(args.input) != bool(args.output):
+        parser.error('--input and --output go together')
+
+    path = os.path.dirname(os.path.realpath(__file__))
+
+    """Preprocessing state and weights saved by end-to-end.py"""
+
+    forecaster = load_forecaster(path)
+
+    if args.input:
+        print('{} tweets scored'.format(score_file(forecaster, args.input, args.output, args.chunk_size)))
     else:
-        break
-
-"""Building Model"""
-
-# This is for training
-encoder_inputs = Input(shape=(MAX_LEN, ), name='input_1')
-embedding = Embedding(NB_WORDS, GLOVE_DIM, name='embedding_1')
-embedding_inputs = embedding(encoder_inputs)
-encoder = LSTM(LSTM_OUT, dropout_U = 0.3, dropout_W = 0.3, name='lstm_1', kernel_regularizer=regularizers.l2(0.05))
-lstm_output = encoder(embedding_inputs)
-user_info_inputs = Input(shape=(features_count,), name='input_2')
-dense1 = Dense(units=128, name='dense_1', kernel_regularizer=regularizers.l2(0.05))     # Whc
-full_info = Concatenate(name='concatenate_1')([lstm_output, user_info_inputs])
-encoder_output_dense1 = dense1(full_info)
-
-decoder_inputs = Input(shape=(None, 1), name='input_3')
-
-# dynamic RNN
-decoder_rnn = SimpleRNN(128, return_sequences=True, return_state=True, name='rnn_1', kernel_regularizer=regularizers.l2(0.05))
-time_distributed = TimeDistributed(Dense(1, activation='relu'), name='time_distributed_1')
-
-# decoder_outputs 
-# We are passing encoder_output as the hidden state of dynamic RNN
-decoder_outputs, _ = decoder_rnn(decoder_inputs, initial_state=encoder_output_dense1)
-decoder_outputs = time_distributed(decoder_outputs)
-final_model = Model([encoder_inputs, user_info_inputs, decoder_inputs], decoder_outputs)
-
-# weights of encoder is already there in decoder, hence we dont need to call it saperatly.
-final_model.load_weights(path+'/saved_models/final_model.h5', by_name=True)
-
-encoder_model = Model([encoder_inputs, user_info_inputs], encoder_output_dense1)
-decoder_state_input = Input(shape=(128,),name='input_4')
-decoder_outputs, decoder_state = decoder_rnn(decoder_inputs, initial_state=decoder_state_input)
-decoder_outputs = time_distributed(decoder_outputs)
-decoder_model = Model([decoder_inputs, decoder_state_input], [decoder_outputs] + [decoder_state])
-
-def decode_sequence(input_seq,user_info_input):
-    input_seq = tokenize(remove_stopwords(remove_mentions(input_seq)))
-    input_seq = tk.texts_to_sequences(pd.Series(input_seq))
-    input_seq = pad_sequences(input_seq, maxlen=MAX_LEN)
- 
-    feature_count = 0 
-    features = []   
-    for i in range(user_feature_count-1):
-        for j in range(i+1,user_feature_count):
-            feature = user_info_input[i]*user_info_input[j]
-            feature = (feature/max_feature_values[feature_count])*NORMALIZE_TO
-            features.append(feature)
-            feature_count += 1
-
-    features = np.array([features])
-    state_value = encoder_model.predict([input_seq, features])
-    
-    target = 0
-    target_list = []
-    for t in range(1,HOURS+1):
-        targets = np.array([[[target]]])
-        targets, state_value = decoder_model.predict([targets,state_value])
-        target = targets[0][0][0]
-        target = (target*max_retweet_count)/RETWEETS_NORM_TO   # unnormalize number of retweets
-        target_list.append(target)
-        target = max(math.ceil(target)-1, math.floor(target))
-        target = (target/max_retweet_count)*RETWEETS_NORM_TO   # normalize number of retweets
-
-    return target_list  
-
-# tweet_text = 'Anyone with coronavirus symptoms can book an appointment at a regional testing site.   John discusses how he suppor… https://t.co/o2CDWInYPB'
-# user_info_input = [818,690640,133,13594,514]
-
-predicted_y = decode_sequence(tweet_text, user_info_input)
-print('predicted retweets: ',predicted_y)
+        # take input
+        tweet_text = input("Enter tweet :")
+        friends_count = int(input("Enter friends_count :"))
+        followers_count = int(input("Enter followers_count :"))
+        account_age = int(input("Enter account_age in MONTHS :"))
+        total_tweet_count = int(input("Enter total_tweet_count :"))
+        favourited_tweet_count = int(input("Enter favourited_tweet_count :"))
+        user_info_input = [friends_count, followers_count, account_age, total_tweet_count, favourited_tweet_count]
+
+        # tweet_text = 'Anyone with coronavirus symptoms can book an appointment at a regional testing site.   John discusses how he suppor… https://t.co/o2CDWInYPB'
+        # user_info_input = [818,690640,133,13594,514]
+
+        # cleaning, tokenizing, the encoder and all decoder steps for one tweet
+        predicted_y = forecaster.forecast([tweet_text], [user_info_input])[0].tolist()
+        print('predicted retweets: ',predicted_y)
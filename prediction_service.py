@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""Long-running local HTTP prediction service.
+
+The bundle and NumPy weights saved by end-to-end.py are loaded once. Each
+POST /predict carries one tweet:
+
+    {"text": "...", "friends_count": 818, "followers_count": 690640,
+     "account_age": 133, "total_tweet_count": 13594, "favourited_tweet_count": 514}
+
+and is answered with its hourly forecast, {"retweets": [h1, ..., h72]}.
+Concurrent requests are coalesced into micro-batches of at most
+--max-batch-size tweets, waiting at most --max-wait-ms for a batch to fill,
+and each batch goes through the encoder and the decoder once.
+
+    python prediction_service.py [--port 8000]
+    python prediction_service.py --load-test [--requests 2000 --concurrency 64]
+
+The second form starts the service and measures it with a local load
+generator (latency p50/p99 and throughput).
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+USER_FIELDS = ['friends_count', 'followers_count', 'account_age', 'total_tweet_count', 'favourited_tweet_count']
+MAX_BODY = 1 << 20
+
+
+class MicroBatcher(object):
+    '''
+    Collects concurrent predictions into batches.
+
+    Parameters:
+        predict : function (texts, user_info) -> (N, HOURS) array, run in a worker thread
+        max_batch_size : largest batch handed to predict
+        max_wait : seconds to wait for a batch to fill once its first request arrived
+    '''
+
+    def __init__(self, predict, max_batch_size=64, max_wait=0.005):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.arrived = asyncio.Event()
+        self.batch_sizes = []
+
+    def submit(self, text, user_info):
+        '''
+        Function to queue one tweet, returns a future of its hourly forecast.
+        '''
+        future = asyncio.get_event_loop().create_future()
+        self.pending.append((text, user_info, future))
+        self.arrived.set()
+        return future
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.arrived.wait()
+            deadline = loop.time() + self.max_wait
+            while len(self.pending) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self.pending[:self.max_batch_size]
+            del self.pending[:self.max_batch_size]
+            if not self.pending:
+                self.arrived.clear()
+            self.batch_sizes.append(len(batch))
+
+            texts = [text for text, _, _ in batch]
+            user_info = [info for _, info, _ in batch]
+            try:
+                forecast = await loop.run_in_executor(None, self.predict, texts, user_info)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, _, future), row in zip(batch, forecast):
+                if not future.done():
+                    future.set_result(row.tolist())
+
+
+def parse_tweet(body, features=None):
+    '''
+    Function to validate a /predict request body.
+
+    Parameters:
+        body : request body
+        features : optional function (user_info rows) -> model user features,
+                   e.g. Forecaster.features, to refuse fields whose features
+                   overflow
+    Output:
+        text, list of the five user fields as floats
+    '''
+    request = json.loads(body.decode('utf-8'))
+    if not isinstance(request, dict) or not isinstance(request.get('text'), str):
+        raise ValueError('"text" must be a string')
+    user_info = []
+    for field in USER_FIELDS:
+        value = request.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError('"{}" must be a number'.format(field))
+        try:
+            value = float(value)
+        except (OverflowError, TypeError):
+            raise ValueError('"{}" is too large'.format(field))
+        # json.loads accepts NaN and Infinity, which would decode to garbage counts
+        if not math.isfinite(value):
+            raise ValueError('"{}" must be finite'.format(field))
+        if value < 0:
+            raise ValueError('"{}" must not be negative'.format(field))
+        user_info.append(value)
+    # finite fields can still overflow in the pairwise products
+    if features is not None:
+        with np.errstate(over='ignore', invalid='ignore'):
+            if not np.isfinite(features([user_info])).all():
+                raise ValueError('the user fields are too large')
+    return request['text'], user_info
+
+
+async def read_request(reader):
+    '''
+    Function to read one HTTP/1.1 request.
+
+    Output:
+        method, path, headers, body; None when the client closed the connection
+    '''
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length > MAX_BODY:
+        raise ValueError('request body too large')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+def write_response(writer, status, payload, keep_alive):
+    body = json.dumps(payload).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}[status]
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'
+                 .format(status, reason, len(body), 'keep-alive' if keep_alive else 'close').encode('latin-1') + body)
+
+
+async def handle_connection(reader, writer, batcher, features=None):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError) as e:
+                write_response(writer, 400, {'error': str(e)}, False)
+                break
+            if request is None:
+                break
+            method, target, headers, body = request
+            keep_alive = headers.get('connection', '').lower() != 'close'
+
+            if method == 'GET' and target == '/health':
+                write_response(writer, 200, {'status': 'ok'}, keep_alive)
+            elif method == 'POST' and target == '/predict':
+                try:
+                    text, user_info = parse_tweet(body, features)
+                except ValueError as e:
+                    write_response(writer, 400, {'error': str(e)}, keep_alive)
+                else:
+                    try:
+                        write_response(writer, 200, {'retweets': await batcher.submit(text, user_info)}, keep_alive)
+                    except Exception as e:
+                        write_response(writer, 500, {'error': str(e)}, keep_alive)
+            else:
+                write_response(writer, 404, {'error': 'use POST /predict'}, keep_alive)
+
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_service(forecaster, host, port, max_batch_size, max_wait):
+    '''
+    Function to start the service on the running event loop.
+
+    Output:
+        asyncio server, MicroBatcher
+    '''
+    batcher = MicroBatcher(forecaster.forecast, max_batch_size, max_wait)
+    asyncio.ensure_future(batcher.run())
+    server = await asyncio.start_server(lambda r, w: handle_connection(r, w, batcher, forecaster.features),
+                                        host, port)
+    return server, batcher
+
+
+async def load_test(host, port, requests, concurrency, payload):
+    '''
+    Function to fire `requests` predictions over `concurrency` keep-alive
+    connections and measure them.
+
+    Output:
+        dict with p50/p99 latency in ms and requests per second
+    '''
+    body = json.dumps(payload).encode('utf-8')
+    request = ('POST /predict HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n'
+               'Content-Length: {}\r\n\r\n'.format(host, len(body))).encode('latin-1') + body
+    latencies = []
+    per_connection = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+    async def client(count):
+        reader, writer = await asyncio.open_connection(host, port)
+        for _ in range(count):
+            start = time.perf_counter()
+            writer.write(request)
+            status = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line == b'\r\n':
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if b' 200 ' not in status:
+                raise RuntimeError('request failed: {}'.format(status))
+        writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(count) for count in per_connection if count])
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array(latencies)*1000
+    return {'requests': len(latencies), 'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)), 'requests_per_s': len(latencies)/elapsed}
+
+
+if __name__ == '__main__':
+    from numpy_inference import load_forecaster
+
+    parser = argparse.ArgumentParser(description='Retweet forecast HTTP service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.)
+    parser.add_argument('--precision', default='float32', choices=['float32', 'float16', 'int8'],
+                        help='weights exported by end-to-end.py to serve')
+    parser.add_argument('--load-test', action='store_true', help='start the service and measure it')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args()
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    forecaster = load_forecaster(path, args.precision)
+
+    loop = asyncio.get_event_loop()
+    server, batcher = loop.run_until_complete(
+        start_service(forecaster, args.host, args.port, args.max_batch_size, args.max_wait_ms/1000))
+    print('serving on {}:{}'.format(args.host, args.port))
+
+    if args.load_test:
+        payload = {'text': 'Anyone with coronavirus symptoms can book an appointment at a regional testing site. '
+                           'https://t.co/o2CDWInYPB',
+                   'friends_count': 818, 'followers_count': 690640, 'account_age': 133,
+                   'total_tweet_count': 13594, 'favourited_tweet_count': 514}
+        stats = loop.run_until_complete(load_test(args.host, args.port, args.requests, args.concurrency, payload))
+        print('{requests} requests: p50 {p50_ms:.1f} ms, p99 {p99_ms:.1f} ms, {requests_per_s:.0f} requests/s'
+              .format(**stats))
+        print('mean batch size: {:.1f}'.format(np.mean(batcher.batch_sizes)))
+    else:
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+    server.close()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Replay a recorded stream through StdOutListener, offline.
+
+The input is a JSONL file of stream messages as the streaming API sends
+them, one status object per line. Every line goes through
+StdOutListener.on_data, the entry point tweepy's Stream calls, so the
+replay parses the statuses, applies the language, follower and
+retweet/quote/reply filters and writes the CSVs exactly like
+extract_tweets.py, only without the connection.
+
+    python replay_stream.py recorded.jsonl [--rate 2000] [--output-dir replay]
+
+--rate paces the replay at that many statuses per second, 0 (the default)
+replays as fast as possible. Replaying at increasing rates until the
+replay falls behind or the writer queue fills up gives the highest ingest
+rate the collector sustains. --keywords also applies the keywords.txt
+filter with a KeywordMatcher, for recordings taken without track=.
+"""
+
+import os
+import time
+
+import numpy as np
+
+
+def replay(listener, lines, rate=0):
+    '''
+    Function to feed recorded stream messages to a listener.
+
+    Parameters:
+        listener : StreamListener, e.g. StdOutListener
+        lines : iterable of raw JSON messages
+        rate : statuses per second, 0 for as fast as possible
+    Output:
+        dict of messages replayed, elapsed seconds, statuses per second,
+        per-message on_data time percentiles and how far behind the
+        requested rate the replay finished
+    '''
+    handle_times = []
+    start = time.time()
+    n = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        if rate:
+            wait = start + n/rate - time.time()
+            if wait > 0:
+                time.sleep(wait)
+        tic = time.perf_counter()
+        keep_going = listener.on_data(line)
+        handle_times.append(time.perf_counter() - tic)
+        n += 1
+        if keep_going is False:
+            break
+    elapsed = time.time() - start
+    handle_times = np.array(handle_times) if handle_times else np.zeros(1)
+    return {'messages': n, 'elapsed_s': elapsed, 'statuses_per_s': n/elapsed if elapsed else float('inf'),
+            'on_data_p50_us': 1e6*float(np.percentile(handle_times, 50)),
+            'on_data_p99_us': 1e6*float(np.percentile(handle_times, 99)),
+            'behind_schedule_s': max(elapsed - n/rate, 0.) if rate else 0.}
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+
+    from extract_tweets import StdOutListener
+    from keyword_matcher import KeywordMatcher, load_keywords
+    from stream_writer import BufferedCSVWriter
+
+    parser = argparse.ArgumentParser(description='Replay a recorded JSONL stream through StdOutListener')
+    parser.add_argument('input', help='JSONL file of recorded stream messages')
+    parser.add_argument('--rate', type=float, default=0, help='statuses per second, 0 for as fast as possible')
+    parser.add_argument('--output-dir', default=None,
+                        help='directory for the CSVs, a new temporary directory by default')
+    parser.add_argument('--max-count', type=int, default=10**9, help='stop after collecting this many tweets')
+    parser.add_argument('--keywords', nargs='?', const=os.path.dirname(os.path.realpath(__file__))+'/keywords.txt',
+                        default=None, help='also filter by the keywords of this file (keywords.txt by default), '
+                                           'for recordings that were not filtered by track=')
+    parser.add_argument('--no-fsync', action='store_true', help='do not fsync the CSVs after every batch')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix='replay_')
+    os.makedirs(output_dir, exist_ok=True)
+    writer = BufferedCSVWriter(output_dir, fsync=not args.no_fsync)
+    matcher = KeywordMatcher(load_keywords(args.keywords)) if args.keywords else None
+    listener = StdOutListener(args.max_count, writer, progress_every=0, matcher=matcher)
+    with open(args.input, encoding='utf-8') as f:
+        stats = replay(listener, f, args.rate)
+    writer.close()
+
+    print('{messages} messages in {elapsed_s:.2f} s: {statuses_per_s:.0f} statuses/s, on_data p50 {on_data_p50_us:.0f} us '
+          'p99 {on_data_p99_us:.0f} us, {behind_schedule_s:.2f} s behind schedule'.format(**stats))
+    statuses = sum(listener.filter_counts.values())
+    for reason, count in sorted(listener.filter_counts.items(), key=lambda item: -item[1]):
+        print('  {:<10} {:>9} {:6.1%}'.format(reason, count, count/statuses))
+    print('writer: {} (CSVs in {})'.format(writer.stats(), output_dir))
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""On-disk cache of the padded token id sequences.
+
+warm_up_lstm.py, warm_up_drnn.py and end-to-end.py all clean the tweet text,
+fit a Tokenizer on the training rows and pad every tweet to MAX_LEN. The
+result only depends on the input CSV, the normaliser version, the tokenizer
+settings and which rows (in which order) the tokenizer is fitted on, so it is
+stored under a hash of exactly those and picked up by the next stage:
+
+    sequences.npy  : (rows, MAX_LEN) uint16 token ids of every row of the CSV
+    tokenizer.json : the fitted Tokenizer
+    meta.json      : MAX_LEN and the settings the entry was built with
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+from tweet_preprocessing import NORMALISER_VERSION, preprocess_texts
+
+TOKENIZER_FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+
+
+def _file_sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(csv_file, train_rows, settings):
+    '''
+    Function to compute the cache entry name of a preprocessing run.
+
+    Parameters:
+        csv_file : input CSV the texts were read from
+        train_rows : positions of the rows the tokenizer is fitted on, in fitting order
+        settings : dict of the tokenizer settings
+    Output:
+        hex digest
+    '''
+    digest = hashlib.sha256()
+    digest.update(_file_sha256(csv_file).encode())
+    digest.update(json.dumps(dict(settings, normaliser_version=NORMALISER_VERSION), sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(train_rows, dtype=np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def load_sequences(csv_file, texts, train_rows, cache_dir, num_words, filters=TOKENIZER_FILTERS,
+                   lower=True, split=' '):
+    '''
+    Function to get the fitted tokenizer and padded sequences of a dataset,
+    from the cache when an earlier stage already computed them.
+
+    Parameters:
+        csv_file : CSV the raw texts were read from
+        texts : raw tweet texts of every row of csv_file, or a function
+                returning them, only called on a cache miss
+        train_rows : positions of the training rows, in the order the
+                     tokenizer should see them (X_train.index)
+        cache_dir : directory holding the cache entries
+        num_words, filters, lower, split : Tokenizer settings
+    Output:
+        fitted Tokenizer, memory-mapped (rows, MAX_LEN) uint16 sequences, MAX_LEN
+    '''
+    from keras.preprocessing.text import Tokenizer, tokenizer_from_json
+    from keras.preprocessing.sequence import pad_sequences
+
+    if num_words > np.iinfo(np.uint16).max + 1:
+        raise ValueError('num_words={} does not fit in uint16 token ids'.format(num_words))
+
+    train_rows = np.asarray(train_rows, dtype=np.int64)
+    settings = {'num_words': num_words, 'filters': filters, 'lower': lower, 'split': split}
+    entry_dir = os.path.join(cache_dir, 'sequences', cache_key(csv_file, train_rows, settings))
+    meta_file = os.path.join(entry_dir, 'meta.json')
+
+    if not os.path.exists(meta_file):
+        print('preprocessing cache miss, cleaning and tokenizing...')
+        if callable(texts):
+            texts = texts()
+        cleaned = list(preprocess_texts(texts))
+        train_texts = [cleaned[i] for i in train_rows]
+        max_len = max(len(text.split(' ')) for text in train_texts)
+
+        tk = Tokenizer(num_words=num_words, filters=filters, lower=lower, split=split)
+        tk.fit_on_texts(train_texts)      # creates a internal dictionary
+        sequences = pad_sequences(tk.texts_to_sequences(cleaned), maxlen=max_len, dtype='uint16')
+
+        # build the entry next to its final place and move it in once complete
+        tmp_dir = entry_dir + '.tmp{}'.format(os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        np.save(os.path.join(tmp_dir, 'sequences.npy'), sequences)
+        with open(os.path.join(tmp_dir, 'tokenizer.json'), 'w') as f:
+            f.write(tk.to_json())
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+            json.dump(dict(settings, max_len=max_len, rows=len(cleaned),
+                           normaliser_version=NORMALISER_VERSION), f, indent=2)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another stage finished the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    else:
+        print('preprocessing cache hit')
+
+    with open(meta_file) as f:
+        max_len = json.load(f)['max_len']
+    with open(os.path.join(entry_dir, 'tokenizer.json')) as f:
+        tk = tokenizer_from_json(f.read())
+    sequences = np.load(os.path.join(entry_dir, 'sequences.npy'), mmap_mode='r')
+
+    return tk, sequences, max_len
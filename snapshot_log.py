@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Append-only log of the hourly retweet count snapshots.
+
+Every sweep of get_retweet_count.py is written as its own segment,
+snapshots/hour_NNN.npy, a record array of (tweet_id, hour, count). A
+segment is written to a temporary file and renamed into place, so a sweep is
+either fully in the log or not at all, and a sweep only writes its own
+records instead of rewriting every earlier hour.
+
+compact() turns the log into the wide tweets x hours 0..HOURS matrix the
+trainers use, as a compact int32 array, with the hours a tweet was not
+polled filled from its previous snapshot:
+
+    python snapshot_log.py [--csv temporal_retweet_count_t1m1.csv]
+
+writes retweet_counts.npz (tweet_ids, counts) and optionally the same
+matrix in the CSV layout of temporal_retweet_count_t1m1.csv.
+"""
+
+import os
+import re
+
+import numpy as np
+
+LOG_DIR = 'snapshots'
+RECORD = np.dtype([('tweet_id', '<i8'), ('hour', '<i2'), ('count', '<i4')])
+NULL = -1       # tweet deleted or unavailable, written as NULL in CSVs
+MISSING = -2    # tweet not polled at that hour
+
+_SEGMENT = re.compile(r'^hour_(\d{3})\.npy$')
+
+
+def _segment_file(log_dir, hour):
+    return os.path.join(log_dir, 'hour_{:03d}.npy'.format(hour))
+
+
+def logged_hours(log_dir):
+    '''
+    Function to list the hours with a segment in the log, in order.
+    '''
+    if not os.path.isdir(log_dir):
+        return []
+    return sorted(int(match.group(1)) for match in map(_SEGMENT.match, os.listdir(log_dir)) if match)
+
+
+def append_sweep(log_dir, hour, tweet_ids, counts):
+    '''
+    Function to atomically add the snapshot of one sweep to the log.
+
+    Writing an hour again replaces that hour's segment, so a retried sweep
+    does not duplicate records.
+
+    Parameters:
+        log_dir : log directory
+        hour : hour of the sweep, 0 for the counts at collection time
+        tweet_ids : polled tweets
+        counts : their retweet counts, 'NULL' (or None) for unavailable tweets
+    '''
+    records = np.empty(len(tweet_ids), dtype=RECORD)
+    records['tweet_id'] = tweet_ids
+    records['hour'] = hour
+    records['count'] = [NULL if count in ('NULL', None) else count for count in counts]
+
+    os.makedirs(log_dir, exist_ok=True)
+    segment_file = _segment_file(log_dir, hour)
+    tmp_file = segment_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.save(f, records)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, segment_file)
+    # make the rename itself durable
+    dir_fd = os.open(log_dir, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def carry_forward(counts):
+    '''
+    Function to fill the MISSING hours of a compacted matrix with the last
+    snapshot before them (NULL once a tweet is deleted). Hours before a
+    tweet's first snapshot stay MISSING.
+    '''
+    counts = counts.copy()
+    for hour in range(1, counts.shape[1]):
+        skipped = counts[:, hour] == MISSING
+        counts[skipped, hour] = counts[skipped, hour - 1]
+    return counts
+
+
+def compact(log_dir, hours=None, fill_missing=False):
+    '''
+    Function to build the wide matrix of the log.
+
+    Parameters:
+        log_dir : log directory
+        hours : last hour of the matrix, the last logged hour by default
+        fill_missing : carry each tweet's last snapshot forward over the
+                       hours it was not polled (see poll_schedule.py)
+    Output:
+        (N,) int64 tweet ids in order of first appearance,
+        (N, hours+1) int32 counts, NULL for unavailable tweets and MISSING
+        for hours without a snapshot of that tweet
+    '''
+    segments = [np.load(_segment_file(log_dir, hour)) for hour in logged_hours(log_dir)]
+    records = np.concatenate(segments) if segments else np.empty(0, dtype=RECORD)
+    if hours is None:
+        hours = int(records['hour'].max()) if len(records) else 0
+    records = records[records['hour'] <= hours]
+
+    tweet_ids, first, rows = np.unique(records['tweet_id'], return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')     # keep the order tweets were collected in
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    counts = np.full((len(tweet_ids), hours + 1), MISSING, dtype=np.int32)
+    counts[position[rows], records['hour']] = records['count']
+    if fill_missing:
+        counts = carry_forward(counts)
+    return tweet_ids[order], counts
+
+
+def write_wide_csv(csv_file, tweet_ids, counts):
+    '''
+    Function to write a compacted matrix in the layout of
+    temporal_retweet_count_t1m1.csv: tweet_id, 0, 1, ... with NULL for
+    unavailable tweets and empty cells for hours that were not polled.
+    '''
+    import pandas as pd
+
+    df = pd.DataFrame(counts.astype(object), columns=[str(hour) for hour in range(counts.shape[1])])
+    df[counts == NULL] = 'NULL'
+    df[counts == MISSING] = None
+    df.insert(0, 'tweet_id', tweet_ids)
+    df.to_csv(csv_file, index=False)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Compact the hourly snapshot log')
+    parser.add_argument('--hours', type=int, default=None, help='last hour of the matrix')
+    parser.add_argument('--csv', default=None, help='also write the matrix in the temporal_retweet_count CSV layout')
+    parser.add_argument('--no-fill', action='store_true',
+                        help='leave the hours a tweet was not polled empty instead of carrying its last count forward')
+    args = parser.parse_args()
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    tweet_ids, counts = compact(path+'/'+LOG_DIR, args.hours, fill_missing=not args.no_fill)
+    np.savez(path+'/retweet_counts.npz', tweet_ids=tweet_ids, counts=counts)
+    if args.csv:
+        write_wide_csv(args.csv, tweet_ids, counts)
+    print('{} tweets, hours 0..{}'.format(counts.shape[0], counts.shape[1] - 1))
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Incremental forecast updates from observed hourly retweet counts.
+
+The decoder steps hour by hour, each step taking the previous hour's count.
+Once the real count of an hour is known it can be fed in instead of the
+prediction, and the forecast of the remaining hours follows from the new
+decoder state. DecoderStateStore keeps, per tweet, the decoder state after
+the last observed hour and the counts observed so far, in one .npz file:
+
+    tweet_ids  : (N,) int64
+    states     : (N, 128) float32 decoder state after consuming hour last_hour
+    last_hour  : (N,) int16 last observed hour, 0 right after start()
+    observed   : (N, HOURS+1) int32 observed counts of hours 0..HOURS, -1 where unknown
+    stepped    : (N, HOURS+1) int32 predicted counts the decoder was stepped
+                 through, for hours up to last_hour without a snapshot, else -1
+
+An hour without a snapshot (poll_schedule.py leaves flat tweets unpolled
+for a few hours) is stepped through with advance(), on the decoder's own
+prediction, so only real polls are fed to the state and kept in observed.
+
+so an hourly refresh is one decoder step per tweet plus the decode of the
+remaining horizon, instead of the encoder and all HOURS steps.
+
+    python state_store.py
+
+refreshes the live cohort collected by extract_tweets.py/get_retweet_count.py:
+new tweets in user_info_t1m1.csv are started, the hours logged in the
+snapshot log since the last refresh are observed, and the current curves are
+written to forecast_t1m1.csv.
+"""
+
+import os
+
+import numpy as np
+
+from numpy_inference import decode_states, decoder_step, dense_projection, output_log_rate
+from inference import unnormalize
+
+STATE_FILE = 'decoder_states.npz'
+
+
+class DecoderStateStore(object):
+    '''
+    Per-tweet decoder states of a Forecaster, persisted to state_file.
+
+    Parameters:
+        forecaster : numpy_inference.Forecaster
+        state_file : .npz the store is loaded from and saved to
+    '''
+
+    def __init__(self, forecaster, state_file):
+        self.forecaster = forecaster
+        self.state_file = state_file
+        self.hours = forecaster.constants['HOURS']
+        self.model_sha256 = forecaster.bundle['model_sha256']
+
+        units = forecaster.weights['rnn_recurrent_kernel'].shape[0]
+        self.tweet_ids = np.zeros(0, dtype=np.int64)
+        self.states = np.zeros((0, units), dtype=np.float32)
+        self.last_hour = np.zeros(0, dtype=np.int16)
+        self.observed = np.zeros((0, self.hours + 1), dtype=np.int32)
+        self.stepped = np.zeros((0, self.hours + 1), dtype=np.int32)
+
+        if os.path.exists(state_file):
+            with np.load(state_file) as data:
+                if str(data['model_sha256']) != self.model_sha256:
+                    raise ValueError('{} was built with another model, delete it to start over'.format(state_file))
+                self.tweet_ids, self.states = data['tweet_ids'], data['states']
+                self.last_hour, self.observed = data['last_hour'], data['observed']
+                self.stepped = data['stepped'] if 'stepped' in data else np.full_like(self.observed, -1)
+        self.rows = {tweet_id: row for row, tweet_id in enumerate(self.tweet_ids.tolist())}
+
+    def __len__(self):
+        return len(self.tweet_ids)
+
+    def __contains__(self, tweet_id):
+        return tweet_id in self.rows
+
+    def _normalize(self, counts):
+        return ((np.asarray(counts, dtype=np.float64)/self.forecaster.max_retweet_count)
+                * self.forecaster.constants['RETWEETS_NORM_TO']).astype(np.float32)
+
+    def _row_indices(self, tweet_ids):
+        try:
+            return np.array([self.rows[tweet_id] for tweet_id in tweet_ids], dtype=np.int64)
+        except KeyError as e:
+            raise ValueError('tweet {} is not in the store'.format(e.args[0]))
+
+    def start(self, tweet_ids, texts, user_info, first_counts=None):
+        '''
+        Function to add new tweets: run the encoder and the hour 0 decoder step.
+
+        Parameters:
+            tweet_ids : ids of the new tweets
+            texts, user_info : as for Forecaster.forecast
+            first_counts : observed retweet counts at hour 0, zeros (what a
+                           plain forecast assumes) when not given
+        Output:
+            (N, HOURS) int64 forecast of hours 1..HOURS
+        '''
+        tweet_ids = np.asarray(tweet_ids, dtype=np.int64)
+        if any(tweet_id in self.rows for tweet_id in tweet_ids.tolist()) or len(set(tweet_ids.tolist())) < len(tweet_ids):
+            raise ValueError('tweets can only be started once')
+        forecaster = self.forecaster
+        state = dense_projection(forecaster.lstm_outputs(forecaster.sequences(texts)), forecaster.features(user_info),
+                                 forecaster.weights)
+        counts = np.zeros(len(tweet_ids)) if first_counts is None else np.asarray(first_counts)
+        _, state = decoder_step(self._normalize(counts), state, forecaster.weights)
+
+        observed = np.full((len(tweet_ids), self.hours + 1), -1, dtype=np.int32)
+        if first_counts is not None:
+            observed[:, 0] = counts
+        for tweet_id in tweet_ids.tolist():
+            self.rows[tweet_id] = len(self.rows)
+        self.tweet_ids = np.concatenate([self.tweet_ids, tweet_ids])
+        self.states = np.concatenate([self.states, state.astype(np.float32)])
+        self.last_hour = np.concatenate([self.last_hour, np.zeros(len(tweet_ids), dtype=np.int16)])
+        self.observed = np.concatenate([self.observed, observed])
+        self.stepped = np.concatenate([self.stepped, np.full_like(observed, -1)])
+        return self.forecast(tweet_ids)
+
+    def observe(self, tweet_ids, counts):
+        '''
+        Function to record the real count of each tweet's next hour
+        (last_hour + 1) and advance its decoder state by one step.
+
+        Parameters:
+            tweet_ids : tweets with a new observation
+            counts : their retweet counts at that hour
+        '''
+        rows = self._row_indices(tweet_ids)
+        if (self.last_hour[rows] >= self.hours).any():
+            raise ValueError('all {} hours of some tweets are already observed'.format(self.hours))
+        _, state = decoder_step(self._normalize(counts), self.states[rows], self.forecaster.weights)
+        self.states[rows] = state
+        self.last_hour[rows] += 1
+        self.observed[rows, self.last_hour[rows]] = counts
+
+    def advance(self, tweet_ids):
+        '''
+        Function to step each tweet's decoder state through its next hour
+        (last_hour + 1) without an observation, feeding the predicted count
+        of that hour as a plain forecast does. The hour stays unknown in
+        observed, the count it was stepped with goes to stepped.
+        '''
+        rows = self._row_indices(tweet_ids)
+        if (self.last_hour[rows] >= self.hours).any():
+            raise ValueError('all {} hours of some tweets are already observed'.format(self.hours))
+        forecaster = self.forecaster
+        state = self.states[rows]
+        predicted = unnormalize(output_log_rate(state, forecaster.weights), forecaster.max_retweet_count,
+                                forecaster.constants['RETWEETS_NORM_TO'])
+        _, state = decoder_step(self._normalize(predicted), state, forecaster.weights)
+        self.states[rows] = state
+        self.last_hour[rows] += 1
+        self.stepped[rows, self.last_hour[rows]] = predicted
+
+    def forecast(self, tweet_ids):
+        '''
+        Function to get the current curves: observed counts up to each
+        tweet's last observed hour (the counts the decoder was stepped with
+        for the hours without a snapshot), the forecast after it.
+
+        Output:
+            (N, HOURS) int64 counts of hours 1..HOURS
+        '''
+        rows = self._row_indices(tweet_ids)
+        observed = self.observed[rows, 1:]
+        curves = np.where(observed >= 0, observed, self.stepped[rows, 1:]).astype(np.int64)
+        forecaster = self.forecaster
+        constants = forecaster.constants
+        # tweets observed up to the same hour have the same horizon left and decode together
+        for last_hour in np.unique(self.last_hour[rows]):
+            remaining = self.hours - int(last_hour)
+            if remaining == 0:
+                continue
+            group = np.flatnonzero(self.last_hour[rows] == last_hour)
+            state = self.states[rows[group]]
+            next_hour = unnormalize(output_log_rate(state, forecaster.weights), forecaster.max_retweet_count,
+                                    constants['RETWEETS_NORM_TO'])
+            curves[group, last_hour] = next_hour
+            if remaining > 1:
+                curves[group, last_hour + 1:] = decode_states(state, forecaster.weights, forecaster.max_retweet_count,
+                                                              constants['RETWEETS_NORM_TO'], remaining - 1,
+                                                              targets=self._normalize(next_hour))
+        return curves
+
+    def drop(self, tweet_ids):
+        '''
+        Function to remove tweets, e.g. deleted ones or ones past the horizon.
+        '''
+        keep = np.ones(len(self.tweet_ids), dtype=bool)
+        keep[self._row_indices(tweet_ids)] = False
+        self.tweet_ids, self.states = self.tweet_ids[keep], self.states[keep]
+        self.last_hour, self.observed, self.stepped = self.last_hour[keep], self.observed[keep], self.stepped[keep]
+        self.rows = {tweet_id: row for row, tweet_id in enumerate(self.tweet_ids.tolist())}
+
+    def save(self):
+        '''
+        Function to write the store, replacing the previous file atomically.
+        '''
+        tmp_file = self.state_file + '.tmp.npz'
+        np.savez(tmp_file, model_sha256=np.array(self.model_sha256), tweet_ids=self.tweet_ids,
+                 states=self.states, last_hour=self.last_hour, observed=self.observed,
+                 stepped=self.stepped)
+        os.replace(tmp_file, self.state_file)
+
+
+if __name__ == '__main__':
+    import pandas as pd
+
+    from numpy_inference import load_forecaster
+    from predict_my_retweet import USER_FIELDS, account_age_months
+    from snapshot_log import LOG_DIR, MISSING, NULL, compact
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    store = DecoderStateStore(load_forecaster(path), path+'/saved_models/'+STATE_FILE)
+
+    user_info = pd.read_csv(path+'/user_info_t1m1.csv', dtype={'account_age': str})
+    # MISSING where poll_schedule.py left an hour unpolled
+    tweet_ids, counts = compact(path+'/'+LOG_DIR)
+    rows = {tweet_id: row for row, tweet_id in enumerate(tweet_ids.tolist())}
+
+    # deleted tweets (NULL) are not started or stop being updated
+    deleted = tweet_ids[(counts == NULL).any(axis=1)]
+    store.drop([tweet_id for tweet_id in deleted if tweet_id in store])
+
+    new = user_info[~user_info.tweet_id.isin(list(store.rows)) & ~user_info.tweet_id.isin(deleted)]
+    if len(new):
+        features = new[USER_FIELDS].copy()
+        features['account_age'] = account_age_months(new['account_age'], pd.Timestamp.today().date())
+        first_counts = [max(counts[rows[tweet_id], 0], 0) if tweet_id in rows else 0 for tweet_id in new.tweet_id]
+        store.start(new.tweet_id.values, new.text.astype(str).tolist(), features.values.astype(np.float64),
+                    first_counts=first_counts)
+        print('{} new tweets'.format(len(new)))
+
+    # every tweet catches up with the hours collected since the last refresh,
+    # up to its last snapshot: polled hours are observed, the hours the
+    # schedule skipped are stepped through on the decoder's own prediction
+    polled_hours = np.where(counts >= 0, np.arange(counts.shape[1]), -1).max(axis=1)
+    while True:
+        ready = np.flatnonzero(np.isin(store.tweet_ids, tweet_ids))
+        log_rows = np.array([rows[tweet_id] for tweet_id in store.tweet_ids[ready].tolist()], dtype=np.int64)
+        behind = store.last_hour[ready] < np.minimum(polled_hours[log_rows], store.hours)
+        ready, log_rows = ready[behind], log_rows[behind]
+        if not len(ready):
+            break
+        hours = store.last_hour[ready] + 1
+        observed = counts[log_rows, hours]
+        polled = observed >= 0
+        store.observe(store.tweet_ids[ready[polled]], observed[polled].astype(np.int64))
+        store.advance(store.tweet_ids[ready[observed == MISSING]])
+        print('hour {}-{}: {} tweets observed, {} not polled'.format(
+            hours.min(), hours.max(), int(polled.sum()), int((observed == MISSING).sum())))
+
+    forecast = pd.DataFrame(store.forecast(store.tweet_ids), columns=[str(h) for h in range(1, store.hours + 1)])
+    forecast.insert(0, 'tweet_id', store.tweet_ids)
+    forecast.to_csv(path+'/forecast_t1m1.csv', index=False)
+    store.save()
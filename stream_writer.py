@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Background CSV writer for the tweets collected by extract_tweets.py.
+
+The stream callback only puts the rows of a tweet on a bounded queue; a
+writer thread appends them to user_info_t1m1.csv and
+temporal_retweet_count_t1m1.csv in batches, flushing (and fsyncing) once
+per batch instead of once per tweet, so a burst of matching tweets does not
+hold up the stream thread reading from the connection.
+
+The files are opened in append mode. When they already exist the tweet ids
+in them are loaded into a SeenTweets set, so a restarted collection skips
+tweets it already has and carries on counting towards max_count. Rows that
+only made it into one of the two files before the previous run stopped are
+cut off first, so the files always hold the same tweets row for row.
+"""
+
+import csv
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+USER_INFO_FILE = 'user_info_t1m1.csv'
+RETWEET_COUNT_FILE = 'temporal_retweet_count_t1m1.csv'
+USER_INFO_FIELDS = ['tweet_id', 'text', 'user_id', 'friends_count', 'followers_count',
+                    'account_age', 'total_tweet_count', 'favourited_tweet_count']
+RETWEET_COUNT_FIELDS = ['tweet_id', 0]
+
+_STOP = object()
+
+
+class SeenTweets(object):
+    '''
+    Set of tweet ids stored as a sorted int64 array (8 bytes per id) plus a
+    small set of recently added ids that is merged into the array in bulk.
+
+    Parameters:
+        tweet_ids : initial ids
+        merge_size : recent ids kept in the set before merging
+    '''
+
+    def __init__(self, tweet_ids=(), merge_size=4096):
+        self.ids = np.unique(np.asarray(tweet_ids, dtype=np.int64))
+        self.recent = set()
+        self.merge_size = merge_size
+
+    def __contains__(self, tweet_id):
+        if tweet_id in self.recent:
+            return True
+        i = np.searchsorted(self.ids, tweet_id)
+        return i < len(self.ids) and self.ids[i] == tweet_id
+
+    def __len__(self):
+        return len(self.ids) + len(self.recent)
+
+    def add(self, tweet_id):
+        if tweet_id in self:
+            return
+        self.recent.add(tweet_id)
+        if len(self.recent) >= self.merge_size:
+            self.ids = np.union1d(self.ids, np.fromiter(self.recent, dtype=np.int64, count=len(self.recent)))
+            self.recent = set()
+
+
+def _read_rows(csv_file):
+    '''
+    Function to read the tweet ids of a CSV written by an earlier run,
+    cutting off a last row that was only partly written when it stopped.
+
+    Output:
+        list of tweet ids (str), list of the byte offsets where the header
+        and every row end
+    '''
+    if not os.path.exists(csv_file) or os.path.getsize(csv_file) == 0:
+        return [], []
+    with open(csv_file, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - (1 << 16), 0))
+        tail = f.read()
+        if not tail.endswith(b'\n'):
+            f.truncate(size - len(tail) + tail.rfind(b'\n') + 1)
+
+    tweet_ids, ends = [], []
+    with open(csv_file, 'rb') as f:
+        def lines():
+            for line in iter(f.readline, b''):
+                yield line.decode('utf-8', errors='replace')
+        # the reader pulls exactly the lines of each row, so tell() is where the row ends
+        for row in csv.reader(lines()):
+            if ends:
+                tweet_ids.append(row[0] if row else '')
+            ends.append(f.tell())
+    return tweet_ids, ends
+
+
+def _open_for_append(csv_file, fields):
+    '''
+    Function to open a CSV for appending, writing the header to a new file.
+    '''
+    f = open(csv_file, 'a', newline='')
+    if f.tell() == 0:
+        csv.writer(f).writerow(fields)
+        f.flush()
+    return f
+
+
+class BufferedCSVWriter(object):
+    '''
+    Writer thread appending collected tweets to the two CSVs.
+
+    Parameters:
+        path : directory of the CSVs
+        max_queue : tweets waiting to be written before write() blocks
+        batch_size : most tweets written per flush
+        fsync : also fsync every batch
+    '''
+
+    def __init__(self, path, max_queue=100000, batch_size=500, fsync=True):
+        self.batch_size = batch_size
+        self.fsync = fsync
+        user_info_file = os.path.join(path, USER_INFO_FILE)
+        retweet_count_file = os.path.join(path, RETWEET_COUNT_FILE)
+        user_info_ids, user_info_ends = _read_rows(user_info_file)
+        retweet_count_ids, retweet_count_ends = _read_rows(retweet_count_file)
+        # both files get the same tweets in the same order; a run stopped
+        # between writing the two leaves a few rows in one file only, which
+        # are cut off so the files match row for row again
+        shared = 0
+        while (shared < min(len(user_info_ids), len(retweet_count_ids))
+               and user_info_ids[shared] == retweet_count_ids[shared]):
+            shared += 1
+        if shared < len(user_info_ids) and shared < len(retweet_count_ids):
+            raise ValueError('{} and {} differ at row {}'.format(USER_INFO_FILE, RETWEET_COUNT_FILE, shared + 1))
+        self.dropped = 0
+        for csv_file, tweet_ids, ends in ((user_info_file, user_info_ids, user_info_ends),
+                                          (retweet_count_file, retweet_count_ids, retweet_count_ends)):
+            if len(tweet_ids) > shared:
+                with open(csv_file, 'rb+') as f:
+                    f.truncate(ends[shared])
+                self.dropped += len(tweet_ids) - shared
+        self.user_info = _open_for_append(user_info_file, USER_INFO_FIELDS)
+        self.retweet_count = _open_for_append(retweet_count_file, RETWEET_COUNT_FIELDS)
+        self.seen = SeenTweets([int(tweet_id) for tweet_id in user_info_ids[:shared] if tweet_id.isdigit()])
+        self.resumed = len(self.seen)
+        self.queue = queue.Queue(max_queue)
+        self.error = None
+        self.written = 0
+        self.batches = 0
+        self.full_waits = 0
+        self.max_depth = 0
+        self.latencies = []     # seconds from write() to the batch being on disk, per tweet
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def write(self, tweet_id, user_info_row, retweet_count_row):
+        '''
+        Function to queue one tweet's rows, called from the stream thread.
+        '''
+        if self.error is not None:
+            raise self.error
+        self.seen.add(tweet_id)
+        item = (time.time(), user_info_row, retweet_count_row)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.full_waits += 1
+            self.queue.put(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def _write_batch(self, batch):
+        csv.writer(self.user_info).writerows(item[1] for item in batch)
+        csv.writer(self.retweet_count).writerows(item[2] for item in batch)
+        for f in (self.user_info, self.retweet_count):
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        done = time.time()
+        self.latencies.extend(done - item[0] for item in batch)
+        self.written += len(batch)
+        self.batches += 1
+
+    def _run(self):
+        # whatever queued up while the previous batch was being written is the
+        # next batch, so batches grow with the rate of matching tweets
+        stopping = False
+        try:
+            while not stopping:
+                batch = []
+                item = self.queue.get()
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._write_batch(batch)
+        except BaseException as e:
+            self.error = e
+            # keep draining so write() never blocks on a dead writer
+            while self.queue.get() is not _STOP:
+                pass
+
+    def close(self):
+        '''
+        Function to write what is still queued and close the files.
+        '''
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.user_info.close()
+        self.retweet_count.close()
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return {'written': self.written, 'batches': self.batches, 'max_queue_depth': self.max_depth,
+                'full_queue_waits': self.full_waits,
+                'latency_p50_ms': 1000*float(np.percentile(latencies, 50)),
+                'latency_p99_ms': 1000*float(np.percentile(latencies, 99))}
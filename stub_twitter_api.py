@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in for the Twitter statuses/lookup endpoint.
+
+Serves GET /1.1/statuses/lookup.json?id=1,2,3 from an in-memory dict of
+tweet id -> retweet count, over plain HTTP on localhost, so the collector
+can be exercised without credentials or network access. Like the real
+endpoint it takes at most 100 ids per request and leaves deleted or
+unknown tweets out of the response.
+
+Accounts are told apart by their bearer token. Tokens given a rate limit
+get the real endpoint's behaviour: x-rate-limit-remaining/-reset headers
+and 429 once the window's requests are used up.
+
+tests/test_get_retweet_count.py sweeps get_retweet_count.py against it,
+tests/test_credential_pool.py sweeps with rate limited accounts in a
+CredentialPool.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+LOOKUP_PATH = '/1.1/statuses/lookup.json'
+MAX_IDS = 100
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload, rate_limit=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if rate_limit is not None:
+            self.send_header('x-rate-limit-remaining', str(max(rate_limit[0], 0)))
+            self.send_header('x-rate-limit-reset', '{:.3f}'.format(rate_limit[1]))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        if url.path != LOOKUP_PATH:
+            self._send(404, {'errors': [{'code': 34, 'message': 'Sorry, that page does not exist.'}]})
+            return
+        ids = [int(i) for i in parse_qs(url.query).get('id', [''])[0].split(',') if i]
+        token = self.headers.get('Authorization', '')[len('Bearer '):]
+        rate_limit = stub.take_request(token)
+        time.sleep(stub.latency)
+        if rate_limit is not None and rate_limit[0] < 0:
+            self._send(429, {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}, rate_limit)
+        elif not ids or len(ids) > MAX_IDS:
+            self._send(400, {'errors': [{'code': 44, 'message': 'id parameter is invalid.'}]}, rate_limit)
+        else:
+            self._send(200, [{'id': i, 'id_str': str(i), 'retweet_count': stub.statuses[i]}
+                             for i in ids if i in stub.statuses], rate_limit)
+
+
+class StubTwitterAPI(object):
+    '''
+    Local HTTP server answering statuses/lookup from a dict.
+
+    Parameters:
+        statuses : dict tweet id -> retweet count of the tweets that exist
+        port : 0 picks a free port
+        rate_limits : dict bearer token -> requests allowed per window,
+                      other tokens are not limited
+        window : rate-limit window in seconds
+        latency : seconds each request takes
+    '''
+
+    def __init__(self, statuses, port=0, rate_limits=None, window=900., latency=0.):
+        self.statuses = statuses
+        self.rate_limits = rate_limits or {}
+        self.window = window
+        self.latency = latency
+        self.requests = 0
+        self.requests_by_token = {}
+        self.windows = {}
+        self.lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', port), _Handler)
+        self.server.stub = self
+        self.base_url = 'http://127.0.0.1:{}/1.1'.format(self.server.server_address[1])
+
+    def take_request(self, token):
+        '''
+        Function to count a request of `token` against its window.
+
+        Output:
+            None for unlimited tokens, else (remaining, reset) where a
+            negative remaining means the request is refused
+        '''
+        with self.lock:
+            self.requests += 1
+            self.requests_by_token[token] = self.requests_by_token.get(token, 0) + 1
+            if token not in self.rate_limits:
+                return None
+            now = time.time()
+            reset, used = self.windows.get(token, (0., 0))
+            if reset <= now:
+                reset, used = now + self.window, 0
+            used += 1
+            self.windows[token] = (reset, used)
+            return self.rate_limits[token] - used, reset
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
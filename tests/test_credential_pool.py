@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from credential_pool import Account, CredentialPool, RateLimited
+from get_retweet_count import http_lookup, lookup_retweet_counts
+from stub_twitter_api import StubTwitterAPI
+
+TWEET_IDS = [1274756460174440000 + i for i in range(2000)]
+STATUSES = {tweet_id: i % 97 for i, tweet_id in enumerate(TWEET_IDS) if i % 13}
+
+
+class Recorder(object):
+    '''Lookup calls and 429s of every account of a pool on a StubTwitterAPI.'''
+
+    def __init__(self, stub):
+        self.stub = stub
+        self.calls = []         # (time, token)
+        self.throttles = []     # (time, token, reset)
+
+    def make_lookup(self, token):
+        def make(rate_limit):
+            lookup = http_lookup(self.stub.base_url, token, rate_limit)
+
+            def recorded(tweet_ids):
+                self.calls.append((time.time(), token))
+                try:
+                    return lookup(tweet_ids)
+                except RateLimited as e:
+                    self.throttles.append((time.time(), token, e.reset))
+                    raise
+            return recorded
+        return make
+
+    def pool(self, tokens, **kwargs):
+        return CredentialPool([Account(token, self.make_lookup(token)) for token in tokens], **kwargs)
+
+    def check_throttles_respected(self):
+        for throttled_at, token, reset in self.throttles:
+            assert not [at for at, caller in self.calls if caller == token and throttled_at < at < reset]
+
+
+def test_throttled_account_is_skipped_and_the_others_finish():
+    # 'spent' has used up a 60 s window, the sweep has to run on the other two
+    rate_limits = {'spent': 0, 'second': 1000, 'third': 1000}
+    with StubTwitterAPI(STATUSES, rate_limits=rate_limits, window=60., latency=0.01) as stub:
+        recorder = Recorder(stub)
+        pool = recorder.pool(['spent', 'second', 'third'], max_in_flight=1)
+        start = time.time()
+        counts = lookup_retweet_counts(pool, TWEET_IDS, workers=pool.concurrency)
+        elapsed = time.time() - start
+
+    assert counts == [STATUSES.get(tweet_id, 'NULL') for tweet_id in TWEET_IDS]
+    assert elapsed < 30
+    stats = pool.stats()
+    assert stats['spent'] == {'requests': 1, 'throttled': 1}
+    assert stub.requests_by_token['spent'] == 1
+    assert stats['second']['throttled'] == stats['third']['throttled'] == 0
+    assert stats['second']['requests'] + stats['third']['requests'] == 20
+    recorder.check_throttles_respected()
+
+
+@pytest.mark.parametrize('max_in_flight', [1, 2])
+def test_throttled_account_waits_for_its_reset(max_in_flight):
+    # 10 requests on one account allowed 3 per 0.3 s window
+    with StubTwitterAPI(STATUSES, rate_limits={'only': 3}, window=0.3) as stub:
+        recorder = Recorder(stub)
+        pool = recorder.pool(['only'], max_in_flight=max_in_flight)
+        start = time.time()
+        counts = lookup_retweet_counts(pool, TWEET_IDS[:1000], workers=pool.concurrency)
+        elapsed = time.time() - start
+
+    assert counts == [STATUSES.get(tweet_id, 'NULL') for tweet_id in TWEET_IDS[:1000]]
+    assert elapsed >= 3*0.3
+    stats = pool.stats()['only']
+    assert stats['requests'] - stats['throttled'] == 10
+    recorder.check_throttles_respected()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from embeddings import load_emb_matrix
+
+GLOVE = '''stay 0.1 0.2 0.3
+home 1.0 1.0 1.0
+mask 0.5 0.5 0.5
+home 2.0 2.0 2.0
+covid 0.0 0.0 0.0
+stay 0.4 0.5 0.6
+'''
+CUSTOM = '''covid 7.0 7.0 7.0
+mask 8.0 8.0 8.0
+covid 9.0 9.0 9.0
+'''
+WORD_INDEX = {'stay': 1, 'home': 2, 'covid': 3, 'mask': 4, 'unseen': 5}
+
+
+def dict_matrix(glove_file, custom_file, keywords):
+    '''The matrix built by filling a dict line by line, as the stage scripts used to.'''
+    emb_dict = {}
+    with open(glove_file) as f:
+        for line in f:
+            values = line.split()
+            emb_dict[values[0]] = np.asarray(values[1:], dtype='float32')
+    with open(custom_file) as f:
+        for line in f:
+            values = line.split()
+            if values[0] in keywords:
+                emb_dict[values[0]] = np.asarray(values[1:], dtype='float32')
+    emb_matrix = np.zeros((len(WORD_INDEX) + 1, 3), dtype=np.float32)
+    for w, i in WORD_INDEX.items():
+        if w in emb_dict:
+            emb_matrix[i] = emb_dict[w]
+    return emb_matrix
+
+
+@pytest.mark.parametrize('binary', [True, False])
+def test_duplicated_words_keep_their_last_vector(tmp_path, binary):
+    glove_file, custom_file = tmp_path/'glove.txt', tmp_path/'custom.txt'
+    glove_file.write_text(GLOVE)
+    custom_file.write_text(CUSTOM)
+    keywords = ['covid']
+
+    emb_matrix, stats = load_emb_matrix(WORD_INDEX, len(WORD_INDEX) + 1, 3, str(glove_file), str(custom_file),
+                                        keywords, binary=binary)
+
+    np.testing.assert_array_equal(emb_matrix, dict_matrix(str(glove_file), str(custom_file), keywords))
+    assert emb_matrix[WORD_INDEX['stay']].tolist() == pytest.approx([0.4, 0.5, 0.6])
+    assert emb_matrix[WORD_INDEX['home']].tolist() == [2., 2., 2.]
+    assert emb_matrix[WORD_INDEX['covid']].tolist() == [9., 9., 9.]
+    assert stats == {'hits': 4, 'custom_hits': 1, 'misses': 1}
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from get_retweet_count import http_lookup, lookup_retweet_counts
+from stub_twitter_api import StubTwitterAPI
+
+
+def sweep_tweets(n, seed=0):
+    '''n tweet ids, the statuses the API still has for them, and the ids that are gone.'''
+    rng = random.Random(seed)
+    tweet_ids = [1274756460174440000 + i*7919 for i in range(n)]
+    deleted = set(rng.sample(tweet_ids, 40))
+    statuses = {tweet_id: rng.randrange(1000) for tweet_id in tweet_ids if tweet_id not in deleted}
+    return tweet_ids, statuses, deleted
+
+
+@pytest.mark.parametrize('n, requests', [(1500, 15), (1501, 16), (99, 1)])
+def test_bulk_lookup_requests(n, requests):
+    tweet_ids, statuses, _ = sweep_tweets(n)
+    with StubTwitterAPI(statuses) as stub:
+        counts = lookup_retweet_counts(http_lookup(stub.base_url), tweet_ids)
+    assert stub.requests == requests
+    assert counts == [statuses.get(tweet_id, 'NULL') for tweet_id in tweet_ids]
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_deleted_and_unknown_tweets_are_null(workers):
+    tweet_ids, statuses, deleted = sweep_tweets(1500)
+    unknown = [1, 2, 3]     # never existed
+    with StubTwitterAPI(statuses) as stub:
+        counts = lookup_retweet_counts(http_lookup(stub.base_url), tweet_ids + unknown, workers=workers)
+    assert stub.requests == 16
+    assert len(counts) == len(tweet_ids) + len(unknown)
+    assert counts[-len(unknown):] == ['NULL']*len(unknown)
+    for tweet_id, count in zip(tweet_ids, counts):
+        assert count == ('NULL' if tweet_id in deleted else statuses[tweet_id])
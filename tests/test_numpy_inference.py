@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from numpy_inference import load_weights, quantization_report, quantize_weights, token_gate_rows
+
+VOCAB, DIM, LSTM_OUT, UNITS, HOURS = 50000, 20, 32, 16, 6
+
+
+@pytest.fixture
+def weights_files(tmp_path):
+    rng = np.random.RandomState(0)
+    weights = {'embedding': rng.randn(VOCAB, DIM)*.1, 'lstm_kernel': rng.randn(DIM, 4*LSTM_OUT)*.3,
+               'lstm_recurrent_kernel': rng.randn(LSTM_OUT, 4*LSTM_OUT)*.3, 'lstm_bias': rng.randn(4*LSTM_OUT)*.1,
+               'dense_kernel': rng.randn(LSTM_OUT + 10, UNITS)*.3, 'dense_bias': np.zeros(UNITS) + .5,
+               'rnn_kernel': rng.randn(1, UNITS)*.3, 'rnn_recurrent_kernel': rng.randn(UNITS, UNITS)*.2,
+               'rnn_bias': np.zeros(UNITS), 'td_kernel': rng.randn(UNITS, 1)*.5, 'td_bias': np.zeros(1) + 1.}
+    weights = {name: value.astype(np.float32) for name, value in weights.items()}
+    files = {'float32': str(tmp_path/'numpy_weights.npz')}
+    np.savez(files['float32'], model_sha256=np.array('test'), recurrent_activation=np.array('hard_sigmoid'),
+             **weights)
+    for precision in ('float16', 'int8'):
+        files[precision] = str(tmp_path/'numpy_weights_{}.npz'.format(precision))
+        quantize_weights(files['float32'], precision, files[precision])
+    return files
+
+
+def test_token_gates_are_built_at_the_file_precision(weights_files):
+    with np.load(weights_files['float32']) as data:
+        expected = data['embedding'] @ data['lstm_kernel'] + data['lstm_bias']
+    ids = np.arange(0, VOCAB, 7)
+
+    tracemalloc.start()
+    weights = {}
+    for precision, dtype in (('float32', np.float32), ('float16', np.float16), ('int8', np.int8)):
+        tracemalloc.reset_peak()
+        held = tracemalloc.get_traced_memory()[0]
+        weights[precision] = load_weights(weights_files[precision])
+        peak = tracemalloc.get_traced_memory()[1] - held
+        assert weights[precision]['token_gates'].dtype == dtype
+        if precision != 'float32':
+            # the whole table is never held in float32, only chunks of it
+            assert peak < expected.nbytes
+    tracemalloc.stop()
+
+    np.testing.assert_allclose(token_gate_rows(weights['float32'], ids), expected[ids], rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(token_gate_rows(weights['float16'], ids), expected[ids], atol=2e-3)
+    np.testing.assert_allclose(token_gate_rows(weights['int8'], ids), expected[ids], atol=2e-2)
+
+
+def test_report_counts_the_token_gates(weights_files):
+    rng = np.random.RandomState(1)
+    input_seqs, features = rng.randint(0, VOCAB, (8, 5)), rng.rand(8, 10).astype(np.float32)
+    report = quantization_report(weights_files, input_seqs, features, 500, 10, HOURS)
+
+    table = VOCAB*4*LSTM_OUT
+    assert report['float32']['token_gates_bytes'] == table*4
+    assert report['float16']['token_gates_bytes'] == table*2
+    assert report['int8']['token_gates_bytes'] == table + VOCAB*4
+    for row in report.values():
+        assert row['token_gates_bytes'] < row['memory_bytes']
+    assert report['int8']['memory_bytes'] < report['float16']['memory_bytes'] < report['float32']['memory_bytes']
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from predict_my_retweet import USER_FIELDS, account_age_months, score_file
+
+
+class FlatForecaster(object):
+    '''Forecaster double returning the followers count for every hour.'''
+    constants = {'HOURS': 3}
+
+    def __init__(self):
+        self.calls = []
+
+    def forecast(self, texts, user_info, workers=None):
+        self.calls.append((texts, user_info))
+        return np.repeat(user_info[:, 1:2], 3, axis=1)
+
+
+def test_account_age_months_missing_and_invalid():
+    values = pd.Series(['2019-10-18', '12', 'nan', 'not a date'])
+    months = account_age_months(values, datetime.date(2020, 4, 1))
+    assert months[:2].tolist() == [6., 12.]
+    assert np.isnan(months[2:]).all()
+
+
+def test_score_file_skips_rows_with_missing_account_age(tmp_path, capsys):
+    rows = pd.DataFrame({'tweet_id': [1, 2, 3, 4], 'text': ['a', 'b', 'c', 'd'],
+                         'friends_count': [1, 1, 1, 1], 'followers_count': [10, 20, 30, 40],
+                         'account_age': ['2019-01-01', None, '24', '2018-06-01'],
+                         'total_tweet_count': [5, 5, None, 5], 'favourited_tweet_count': [0, 0, 0, 0]})
+    input_file, output_file = str(tmp_path/'in.csv'), str(tmp_path/'out.csv')
+    rows.to_csv(input_file, index=False)
+
+    forecaster = FlatForecaster()
+    scored = score_file(forecaster, input_file, output_file, chunk_size=2, as_of=datetime.date(2020, 1, 1))
+
+    assert scored == 2
+    result = pd.read_csv(output_file)
+    assert result['tweet_id'].tolist() == [1, 4]
+    assert result['1'].tolist() == [10, 40]
+    out = capsys.readouterr().out
+    assert 'skipping tweet 2: invalid account_age' in out
+    assert 'skipping tweet 3: invalid total_tweet_count' in out
+    assert all(user_info.shape[1] == len(USER_FIELDS) for _, user_info in forecaster.calls)
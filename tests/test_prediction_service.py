@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import json
+
+import pytest
+
+from inference import user_features
+from prediction_service import USER_FIELDS, handle_connection, parse_tweet
+
+
+def body(**fields):
+    request = dict({'text': 'stay home'}, **{field: 10 for field in USER_FIELDS})
+    request.update(fields)
+    return json.dumps(request).encode('utf-8')
+
+
+def test_valid_request():
+    assert parse_tweet(body(followers_count=250)) == ('stay home', [10, 250, 10, 10, 10])
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_rejects_non_finite_numbers(value):
+    # json.dumps writes NaN/Infinity, which json.loads reads back
+    with pytest.raises(ValueError, match='finite'):
+        parse_tweet(body(followers_count=value))
+
+
+@pytest.mark.parametrize('field', USER_FIELDS)
+def test_rejects_negative_values(field):
+    with pytest.raises(ValueError, match='negative'):
+        parse_tweet(body(**{field: -1}))
+
+
+def test_rejects_non_numbers():
+    with pytest.raises(ValueError, match='number'):
+        parse_tweet(body(friends_count='12'))
+    with pytest.raises(ValueError, match='number'):
+        parse_tweet(body(friends_count=True))
+
+
+def features(user_info):
+    return user_features(user_info, [1.]*10, 10)
+
+
+def test_rejects_integers_too_large_for_a_float():
+    with pytest.raises(ValueError, match='too large'):
+        parse_tweet(body(followers_count=10**400))
+
+
+def test_rejects_fields_whose_features_overflow():
+    text, user_info = parse_tweet(body(followers_count=1e300))    # finite on its own
+    assert user_info[1] == 1e300
+    with pytest.raises(ValueError, match='too large'):
+        parse_tweet(body(followers_count=1e300, friends_count=1e300), features)
+    assert parse_tweet(body(followers_count=1e6), features)[1][1] == 1e6
+
+
+class EchoBatcher(object):
+    def submit(self, text, user_info):
+        future = asyncio.get_event_loop().create_future()
+        future.set_result([int(user_info[1])])
+        return future
+
+
+@pytest.mark.parametrize('fields, status', [
+    ({'followers_count': 250}, b'200'),
+    ({'followers_count': 10**400}, b'400'),
+    ({'followers_count': 1e300, 'friends_count': 1e300}, b'400'),
+])
+def test_service_answers_bad_numbers_with_400(fields, status):
+    async def post(payload):
+        server = await asyncio.start_server(lambda r, w: handle_connection(r, w, EchoBatcher(), features),
+                                            '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'POST /predict HTTP/1.1\r\nContent-Length: ' + str(len(payload)).encode() +
+                     b'\r\nConnection: close\r\n\r\n' + payload)
+        response = await reader.read()
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        return response
+
+    assert asyncio.run(post(body(**fields))).split(b' ')[1] == status
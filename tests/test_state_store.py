@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+import pytest
+
+from numpy_inference import Forecaster
+from state_store import DecoderStateStore
+
+HOURS = 12
+
+
+@pytest.fixture
+def forecaster():
+    rng = np.random.RandomState(0)
+    vocab, dim, lstm_out, units = 20, 6, 8, 16
+    weights = {'embedding': rng.randn(vocab, dim)*.1, 'lstm_kernel': rng.randn(dim, 4*lstm_out)*.3,
+               'lstm_recurrent_kernel': rng.randn(lstm_out, 4*lstm_out)*.3, 'lstm_bias': np.zeros(4*lstm_out),
+               'dense_kernel': rng.randn(lstm_out + 10, units)*.3, 'dense_bias': np.zeros(units) + .5,
+               'rnn_kernel': rng.randn(1, units)*.3, 'rnn_recurrent_kernel': rng.randn(units, units)*.2,
+               'rnn_bias': np.zeros(units), 'td_kernel': rng.randn(units, 1)*.5, 'td_bias': np.zeros(1) + 1.}
+    weights = {name: value.astype(np.float32) for name, value in weights.items()}
+    weights['token_gates'] = weights.pop('embedding') @ weights['lstm_kernel'] + weights['lstm_bias']
+    weights['recurrent_activation'] = 'hard_sigmoid'
+    words = ['stay', 'home', 'covid', 'mask']
+    tokenizer_json = json.dumps({'config': {'word_index': {word: i + 1 for i, word in enumerate(words)},
+                                            'num_words': vocab, 'filters': '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n',
+                                            'lower': True, 'split': ' '}})
+    bundle = {'constants': {'MAX_LEN': 5, 'NORMALIZE_TO': 10, 'RETWEETS_NORM_TO': 10, 'HOURS': HOURS},
+              'max_retweet_count': 500, 'max_feature_values': [1e6]*10, 'tokenizer_json': tokenizer_json,
+              'model_sha256': 'test'}
+    return Forecaster(bundle, weights)
+
+
+def started_store(forecaster, tmp_path):
+    store = DecoderStateStore(forecaster, str(tmp_path/'states.npz'))
+    store.start([1, 2], ['stay home', 'covid mask'], np.array([[10, 200, 30, 400, 5], [1, 2, 3, 4, 5]]),
+                first_counts=[3, 0])
+    return store
+
+
+def test_advance_keeps_the_forecast_and_records_nothing(forecaster, tmp_path):
+    store = started_store(forecaster, tmp_path)
+    before = store.forecast([1, 2])
+    store.advance([1, 2])
+    store.advance([1])
+
+    assert store.last_hour.tolist() == [2, 1]
+    assert (store.observed[:, 1:] == -1).all()
+    assert (store.stepped[0, 1:3] >= 0).all() and (store.stepped[0, 3:] == -1).all()
+    # stepping on the predicted counts is what the forecast already assumed
+    np.testing.assert_array_equal(store.forecast([1, 2]), before)
+
+
+def test_observed_hours_after_skipped_ones(forecaster, tmp_path):
+    store = started_store(forecaster, tmp_path)
+    store.observe([1], [7])         # hour 1 polled
+    store.advance([1])              # hour 2 not polled
+    store.observe([1], [9])         # hour 3 polled
+
+    assert store.observed[0, :4].tolist() == [3, 7, -1, 9]
+    assert store.stepped[0, :4].tolist() == [-1, -1, store.forecast([1])[0][1], -1]
+    assert store.forecast([1])[0][[0, 2]].tolist() == [7, 9]
+
+    store.save()
+    loaded = DecoderStateStore(forecaster, store.state_file)
+    np.testing.assert_array_equal(loaded.forecast([1, 2]), store.forecast([1, 2]))
+    with pytest.raises(ValueError):
+        for _ in range(HOURS):
+            store.advance([1])
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pandas as pd
+import pytest
+
+from replay_stream import replay
+from stream_writer import RETWEET_COUNT_FILE, USER_INFO_FILE, BufferedCSVWriter, SeenTweets
+
+RECORDED_STREAM = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'recorded_stream.jsonl')
+MAX_COUNT = 25
+
+
+def recorded_lines():
+    with open(RECORDED_STREAM, encoding='utf-8') as f:
+        return f.readlines()
+
+
+def collect(output_dir, lines):
+    '''Replays lines through a StdOutListener writing to output_dir, as one run of extract_tweets.py.'''
+    from extract_tweets import StdOutListener
+
+    writer = BufferedCSVWriter(str(output_dir), batch_size=4, fsync=False)
+    listener = StdOutListener(MAX_COUNT, writer, progress_every=0)
+    replay(listener, lines)
+    writer.close()
+    return writer, listener
+
+
+def read_bytes(output_dir, csv_file):
+    with open(str(output_dir/csv_file), 'rb') as f:
+        return f.read()
+
+
+def test_seen_tweets():
+    seen = SeenTweets([5, 3], merge_size=2)
+    for tweet_id in (7, 3, 11, 13):
+        seen.add(tweet_id)
+    assert len(seen) == 5
+    assert all(tweet_id in seen for tweet_id in (3, 5, 7, 11, 13))
+    assert 4 not in seen and 14 not in seen
+
+
+def test_resumed_collection_matches_an_uninterrupted_one(tmp_path):
+    pytest.importorskip('tweepy')
+    lines = recorded_lines()
+    whole_dir, resumed_dir = tmp_path/'whole', tmp_path/'resumed'
+    whole_dir.mkdir()
+    resumed_dir.mkdir()
+
+    writer, listener = collect(whole_dir, lines)
+    assert writer.written == MAX_COUNT
+    assert listener.filter_counts['seen'] > 0    # the redelivered statuses
+    whole = {csv_file: read_bytes(whole_dir, csv_file) for csv_file in (USER_INFO_FILE, RETWEET_COUNT_FILE)}
+
+    # the first run is stopped after part of the stream, while writing the
+    # next user_info row
+    collect(resumed_dir, lines[:20])
+    written = read_bytes(resumed_dir, USER_INFO_FILE)
+    next_row = whole[USER_INFO_FILE][len(written):].split(b'\n')[0]
+    assert next_row
+    with open(str(resumed_dir/USER_INFO_FILE), 'ab') as f:
+        f.write(next_row[:len(next_row)//2])
+
+    # the restarted run gets the stream from the beginning again
+    writer, _ = collect(resumed_dir, lines)
+    assert 0 < writer.resumed < MAX_COUNT
+    assert writer.resumed + writer.written == MAX_COUNT
+    for csv_file, content in whole.items():
+        assert read_bytes(resumed_dir, csv_file) == content
+        rows = pd.read_csv(str(resumed_dir/csv_file))
+        assert len(rows) == MAX_COUNT
+        assert rows['tweet_id'].is_unique
+        assert not rows.isnull().values.any()
+
+
+def write_tweets(output_dir, first, last):
+    '''Writes tweets first..last-1 directly through a BufferedCSVWriter.'''
+    writer = BufferedCSVWriter(str(output_dir), batch_size=3, fsync=False)
+    for i in range(first, last):
+        tweet_id = 1238800000000000000 + i
+        if tweet_id not in writer.seen:
+            writer.write(tweet_id, [tweet_id, "'tweet {}, \"quoted\"\rwith a carriage return'".format(i), 5000 + i,
+                                    10, 200, '2014-01-01', 30, 4], [tweet_id, i % 3])
+    writer.close()
+    return writer
+
+
+@pytest.mark.parametrize('ahead', [USER_INFO_FILE, RETWEET_COUNT_FILE])
+def test_crash_between_the_two_files(tmp_path, ahead):
+    whole_dir, resumed_dir = tmp_path/'whole', tmp_path/'resumed'
+    whole_dir.mkdir()
+    resumed_dir.mkdir()
+    write_tweets(whole_dir, 0, 20)
+    whole = {csv_file: read_bytes(whole_dir, csv_file) for csv_file in (USER_INFO_FILE, RETWEET_COUNT_FILE)}
+
+    # the run stops after writing tweets 8..9 to one file but not yet the other
+    write_tweets(resumed_dir, 0, 8)
+    # csv ends rows with \r\n, a lone \r is inside a quoted text
+    ahead_rows = whole[ahead].split(b'\r\n')
+    written = len(read_bytes(resumed_dir, ahead).split(b'\r\n')) - 1
+    with open(str(resumed_dir/ahead), 'ab') as f:
+        f.write(b''.join(row + b'\r\n' for row in ahead_rows[written:written + 2]))
+
+    writer = write_tweets(resumed_dir, 0, 20)
+    assert writer.resumed == 8 and writer.dropped == 2 and writer.written == 12
+    for csv_file, content in whole.items():
+        assert read_bytes(resumed_dir, csv_file) == content
+
+
+def test_files_differing_before_their_end_are_refused(tmp_path):
+    write_tweets(tmp_path, 0, 5)
+    rows = read_bytes(tmp_path, RETWEET_COUNT_FILE).split(b'\r\n')
+    with open(str(tmp_path/RETWEET_COUNT_FILE), 'wb') as f:
+        f.write(b'\r\n'.join(rows[:2] + rows[3:]))
+    with pytest.raises(ValueError, match='differ at row 2'):
+        BufferedCSVWriter(str(tmp_path))
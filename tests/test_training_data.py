@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from training_data import (COUNTS_FILE, TWEETS_FILE, USER_FEATURES, ShardStream, build_shards, read_shards,
+                           scan_dataset)
+
+ROWS = 40
+HOURS = 3
+
+
+@pytest.fixture
+def dataset_dir(tmp_path):
+    rng = np.random.RandomState(0)
+    tweets = pd.DataFrame({'tweet_id': np.arange(1000, 1000 + ROWS), 'text': ['tweet {}'.format(i) for i in range(ROWS)]})
+    for field in USER_FEATURES:
+        tweets[field] = rng.randint(1, 1000, ROWS)
+    counts = pd.DataFrame(np.cumsum(rng.poisson(3, (ROWS, HOURS + 1)), axis=1),
+                          columns=[str(hour) for hour in range(HOURS + 1)])
+    counts.insert(0, 'tweet_id', tweets['tweet_id'])
+    tweets.to_csv(str(tmp_path/TWEETS_FILE), index=False)
+    counts.to_csv(str(tmp_path/COUNTS_FILE), index=False)
+    return tmp_path
+
+
+def expected(path, rows, normalize_to, retweets_norm_to):
+    '''The normalised rows computed with the whole dataset in memory.'''
+    tweets = pd.read_csv(str(path/TWEETS_FILE))
+    counts = pd.read_csv(str(path/COUNTS_FILE)).iloc[:, 1:].values.astype(np.float64)
+    user = tweets[USER_FEATURES].values.astype(np.float64)
+    first, second = np.triu_indices(len(USER_FEATURES), k=1)
+    pairwise = user[:, first]*user[:, second]
+    rows = np.sort(rows)
+    return (pairwise[rows]/pairwise.max(axis=0)*normalize_to,
+            counts[rows]/counts[:, HOURS].max()*retweets_norm_to)
+
+
+def test_scan_dataset_in_chunks(dataset_dir):
+    whole = scan_dataset(str(dataset_dir), HOURS, chunk_size=ROWS)
+    chunked = scan_dataset(str(dataset_dir), HOURS, chunk_size=7)
+    assert chunked['tweet_ids'].tolist() == list(range(1000, 1000 + ROWS))
+    assert chunked['max_retweet_count'] == whole['max_retweet_count']
+    assert chunked['max_feature_values'] == whole['max_feature_values']
+
+
+def test_build_shards_matches_in_memory_rows(dataset_dir):
+    dataset = scan_dataset(str(dataset_dir), HOURS, chunk_size=7)
+    sequences = np.arange(ROWS*4, dtype=np.uint16).reshape(ROWS, 4)
+    rows = np.random.RandomState(1).permutation(ROWS)[:25]
+    shard_dir = str(dataset_dir/'shards'/'train')
+
+    assert build_shards(shard_dir, str(dataset_dir), dataset, sequences, rows, 10, 10, chunk_size=7, shard_size=5)
+    shards = read_shards(shard_dir)
+    user, hours = expected(dataset_dir, rows, 10, 10)
+    np.testing.assert_array_equal(shards['seq'], sequences[np.sort(rows)])
+    np.testing.assert_allclose(shards['user'], user, rtol=1e-6)
+    np.testing.assert_allclose(shards['hours'], hours, rtol=1e-6)
+
+
+def test_build_shards_only_rebuilds_when_the_source_changes(dataset_dir):
+    dataset = scan_dataset(str(dataset_dir), HOURS)
+    sequences = np.zeros((ROWS, 4), dtype=np.uint16)
+    shard_dir = str(dataset_dir/'shards'/'train')
+    rows = np.arange(20)
+
+    assert build_shards(shard_dir, str(dataset_dir), dataset, sequences, rows, 10, 10, chunk_size=7)
+    assert not build_shards(shard_dir, str(dataset_dir), dataset, sequences, rows[::-1], 10, 10, chunk_size=7)
+    assert build_shards(shard_dir, str(dataset_dir), dataset, sequences, rows[1:], 10, 10, chunk_size=7)
+    assert build_shards(shard_dir, str(dataset_dir), dataset, sequences, rows[1:], 100, 10, chunk_size=7)
+    sequences[0, 0] = 1
+    assert build_shards(shard_dir, str(dataset_dir), dataset, sequences, rows[1:], 100, 10, chunk_size=7)
+    assert not build_shards(shard_dir, str(dataset_dir), dataset, sequences, rows[1:], 100, 10, chunk_size=7)
+
+
+def test_shard_stream_batches(dataset_dir):
+    dataset = scan_dataset(str(dataset_dir), HOURS)
+    sequences = np.arange(ROWS, dtype=np.uint16)[:, np.newaxis]     # the row position as the only token
+    shard_dir = str(dataset_dir/'shards'/'train')
+    build_shards(shard_dir, str(dataset_dir), dataset, sequences, np.arange(ROWS), 10, 10, shard_size=8)
+
+    stream = ShardStream(shard_dir, 6, shuffle_buffer=4, seed=0)
+    batches = iter(stream)
+    seen = []
+    for _ in range(stream.steps):
+        (seq, user, hours_in), hours_out = next(batches)
+        assert hours_in.shape == hours_out.shape == (len(seq), HOURS, 1)
+        np.testing.assert_array_equal(hours_in[:, 1:], hours_out[:, :-1])
+        seen.extend(seq[:, 0].tolist())
+    assert sorted(seen) == list(range(ROWS))
+
+    (seq, user), last_hour = next(iter(ShardStream(shard_dir, 6, shuffle=False, last_hour_only=True)))
+    _, hours = expected(dataset_dir, np.arange(ROWS), 10, 10)
+    np.testing.assert_allclose(last_hour[:, 0], hours[:6, HOURS], rtol=1e-6)
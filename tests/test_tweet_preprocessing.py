@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pandas as pd
+import pytest
+
+from tweet_preprocessing import (_original_clean, _original_tokenize, clean_text, preprocess_texts, tokenize,
+                                 tokenize_batch)
+
+SAMPLE_TWEETS = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'data', 'tweets.csv')
+TEXTS = pd.read_csv(SAMPLE_TWEETS).text.astype(str).tolist() + ['', ' ', '\n']
+
+
+@pytest.mark.parametrize('text', TEXTS)
+def test_tokenize_matches_original(text):
+    assert tokenize(text) == _original_tokenize(text)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Cases rise https://t.co/AbC123xyz', 'cases rise <url>'),
+    ('@CDCgov please update', '<user> please update'),
+    # the original normaliser's quirks are kept: the camel-case split leaves
+    # an empty first word, an all-caps hashtag gets <allcaps> twice
+    ('#StayHome', '<hashtag>  stay home'),
+    ('#WHO', '<hashtag> who <allcaps> <allcaps>'),
+    ('Stay safe 😷🙏', 'stay safe 😷🙏'),
+    ('', ''),
+])
+def test_tokenize_tokens(text, expected):
+    assert tokenize(text) == expected
+
+
+def test_batches_match_original():
+    assert tokenize_batch(TEXTS) == [_original_tokenize(text) for text in TEXTS]
+    expected = [_original_clean(text) for text in TEXTS]
+    assert [clean_text(text) for text in TEXTS] == expected
+    # duplicated texts, and more than one chunk so a worker pool is used
+    texts = TEXTS*3
+    assert preprocess_texts(texts, workers=1) == expected*3
+    assert preprocess_texts(texts, workers=2, chunk_size=7) == expected*3
+    series = pd.Series(TEXTS, index=range(100, 100 + len(TEXTS)), name='text')
+    cleaned = preprocess_texts(series, workers=1)
+    assert cleaned.index.equals(series.index) and cleaned.tolist() == expected
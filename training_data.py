@@ -0,0 +1,414 @@
+# -*- coding: utf-8 -*-
+"""Training data of warm_up_lstm.py, warm_up_drnn.py and end-to-end.py.
+
+scan_dataset() reads the tweet and retweet count CSVs once, chunk by chunk,
+for the tweet ids and the maxima the user features and counts are normalised
+by, and load_splits() gives the train/valid/test rows. The splits are drawn
+once and saved to saved_models/splits.npz, so every stage and every later
+run trains, validates and tests on the same tweets.
+
+build_shards() then reads the CSVs again, a chunk at a time, and writes the
+normalised rows of a split to shards on disk, each an .npz of
+
+    seq   : (rows, MAX_LEN) token ids
+    user  : (rows, features) normalised pairwise user features
+    hours : (rows, HOURS+1) normalised retweet counts of hours 0..HOURS
+
+with ShardWriter. The shards are kept for later runs until the CSVs, the
+split, the sequences or the normalisation change. ShardStream reads them
+back as a generator of the batches deep_model trains on:
+
+    ([seq, user, hours 0..HOURS-1], hours 1..HOURS)
+
+Only one chunk, one shard and the shuffle buffer are in memory at a time,
+so the training and validation splits can be far larger than RAM. Rows are
+shuffled by reading the shards in random order and mixing each one with the
+rows left over from the previous ones; batches are assembled on a background
+thread, ahead of the training loop.
+
+    python training_data.py [--rows 1000000]
+
+streams a synthetic dataset of that size and reports batches/s and memory.
+"""
+
+import hashlib
+import itertools
+import json
+import math
+import os
+import queue
+import shutil
+import threading
+
+import numpy as np
+
+TWEETS_FILE = 'user_info_with_age.csv'
+COUNTS_FILE = 'retweet_count_new_unnormalized.csv'
+SPLITS_FILE = 'splits.npz'
+USER_FEATURES = ['friends_count', 'followers_count', 'account_age', 'total_tweet_count', 'favourited_tweet_count']
+CHUNK_SIZE = 100000     # CSV rows read at a time
+SHARD_SIZE = 50000      # rows per shard
+SHUFFLE_BUFFER = 50000  # rows kept back to mix with the next shard
+FIELDS = ('seq', 'user', 'hours')
+
+
+def read_chunks(path, hours=72, chunk_size=CHUNK_SIZE):
+    '''
+    Function to read the training data chunk by chunk.
+
+    Parameters:
+        path : directory of TWEETS_FILE and COUNTS_FILE, whose rows are the same tweets in the same order
+        hours : number of hours the counts were recorded for
+        chunk_size : rows read at a time
+    Output:
+        generator of dicts of
+            tweet_ids : (n,) ids of the tweets
+            texts : (n,) Series of tweet texts
+            counts : (n, hours+1) retweet counts of hours 0..hours
+            pairwise : (n, 10) products of every pair of USER_FEATURES
+    '''
+    import pandas as pd
+
+    columns = [str(hour) for hour in range(hours + 1)]
+    first, second = np.triu_indices(len(USER_FEATURES), k=1)    # (0, 1), (0, 2), ... (3, 4)
+    tweet_chunks = pd.read_csv(os.path.join(path, TWEETS_FILE), chunksize=chunk_size)
+    count_chunks = pd.read_csv(os.path.join(path, COUNTS_FILE), usecols=columns, chunksize=chunk_size)
+    for tweets, counts in itertools.zip_longest(tweet_chunks, count_chunks):
+        if tweets is None or counts is None or len(tweets) != len(counts):
+            raise ValueError('{} and {} do not have the same number of rows'.format(TWEETS_FILE, COUNTS_FILE))
+        user = tweets[USER_FEATURES].values.astype(np.float64)
+        yield {'tweet_ids': tweets['tweet_id'].values, 'texts': tweets['text'],
+               'counts': counts[columns].values.astype(np.float64), 'pairwise': user[:, first]*user[:, second]}
+
+
+def scan_dataset(path, hours=72, chunk_size=CHUNK_SIZE):
+    '''
+    Function to read what training needs of the whole dataset in one
+    chunked pass: the tweet ids and the maxima the features and counts are
+    normalised by.
+
+    Output:
+        dict of
+            tweet_ids : (N,) ids of the tweets
+            max_retweet_count : largest count at the last hour
+            max_feature_values : column maxima of the pairwise user features
+            hours : number of hours the counts were recorded for
+    '''
+    tweet_ids, max_retweet_count, max_feature_values = [], 0, None
+    for chunk in read_chunks(path, hours, chunk_size):
+        tweet_ids.append(chunk['tweet_ids'])
+        max_retweet_count = max(max_retweet_count, int(chunk['counts'][:, hours].max()))
+        chunk_max = chunk['pairwise'].max(axis=0)
+        max_feature_values = chunk_max if max_feature_values is None else np.maximum(max_feature_values, chunk_max)
+    if not tweet_ids:
+        raise ValueError('{} is empty'.format(TWEETS_FILE))
+    return {'tweet_ids': np.concatenate(tweet_ids), 'max_retweet_count': max_retweet_count,
+            'max_feature_values': max_feature_values.tolist(), 'hours': hours}
+
+
+def load_texts(path):
+    '''
+    Function to read the tweet texts, for building the sequence cache.
+    '''
+    import pandas as pd
+
+    return pd.read_csv(os.path.join(path, TWEETS_FILE), usecols=['text'])['text']
+
+
+def load_splits(splits_file, tweet_ids, test_size=0.1, valid_size=0.1, seed=None):
+    '''
+    Function to get the train/valid/test rows of the dataset, drawn on the
+    first call and read back from splits_file afterwards.
+
+    Parameters:
+        splits_file : where the splits are saved
+        tweet_ids : ids of the dataset rows, the splits are refused if they
+                    were drawn for different tweets
+        test_size : share of all rows held out for testing
+        valid_size : share of the remaining rows used for validation
+        seed : random seed of the first draw
+    Output:
+        dict of train, valid and test row indices
+    '''
+    tweet_ids = np.asarray(tweet_ids)
+    if os.path.exists(splits_file):
+        with np.load(splits_file) as data:
+            if not np.array_equal(data['tweet_ids'], tweet_ids):
+                raise ValueError('{} was drawn for a different dataset, delete it to draw new splits'.format(splits_file))
+            return {split: data[split] for split in ('train', 'valid', 'test')}
+
+    rows = np.random.RandomState(seed).permutation(len(tweet_ids))
+    n_test = int(math.ceil(test_size*len(rows)))
+    n_valid = int(math.ceil(valid_size*(len(rows) - n_test)))
+    splits = {'test': rows[:n_test], 'valid': rows[n_test:n_test + n_valid], 'train': rows[n_test + n_valid:]}
+    os.makedirs(os.path.dirname(splits_file) or '.', exist_ok=True)
+    tmp_file = splits_file + '.tmp.npz'
+    np.savez(tmp_file, tweet_ids=tweet_ids, **splits)
+    os.replace(tmp_file, splits_file)
+    return splits
+
+
+_END = object()
+
+
+class ShardWriter(object):
+    '''
+    Writes training rows into shards of shard_size rows. The shards are
+    built in a temporary directory that replaces shard_dir on close().
+
+    Parameters:
+        shard_dir : output directory
+        shard_size : rows per shard
+        source : what the rows were built from, saved in meta.json
+    '''
+
+    def __init__(self, shard_dir, shard_size=SHARD_SIZE, source=None):
+        self.shard_dir = shard_dir
+        self.shard_size = shard_size
+        self.source = source
+        self.tmp_dir = shard_dir + '.tmp{}'.format(os.getpid())
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.pending = []
+        self.pending_rows = 0
+        self.shards = []
+
+    def add(self, seq, user, hours):
+        '''
+        Function to add a chunk of rows.
+
+        Parameters:
+            seq : (n, MAX_LEN) token ids
+            user : (n, features) user features
+            hours : (n, HOURS+1) retweet counts of hours 0..HOURS
+        '''
+        if not len(seq) == len(user) == len(hours):
+            raise ValueError('seq, user and hours have {}, {} and {} rows'.format(len(seq), len(user), len(hours)))
+        self.pending.append((np.asarray(seq), np.asarray(user, dtype=np.float32), np.asarray(hours, dtype=np.float32)))
+        self.pending_rows += len(seq)
+        while self.pending_rows >= self.shard_size:
+            self._write_shard(self.shard_size)
+
+    def _write_shard(self, rows):
+        seq, user, hours = (np.concatenate([chunk[i] for chunk in self.pending]) for i in range(3))
+        shard_file = 'shard_{:05d}.npz'.format(len(self.shards))
+        np.savez(os.path.join(self.tmp_dir, shard_file), seq=seq[:rows], user=user[:rows], hours=hours[:rows])
+        self.shards.append({'file': shard_file, 'rows': rows})
+        self.pending = [(seq[rows:], user[rows:], hours[rows:])]
+        self.pending_rows -= rows
+
+    def close(self):
+        if self.pending_rows:
+            self._write_shard(self.pending_rows)
+        with open(os.path.join(self.tmp_dir, 'meta.json'), 'w') as f:
+            json.dump({'rows': sum(shard['rows'] for shard in self.shards), 'shards': self.shards,
+                       'source': self.source}, f, indent=2)
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
+        os.rename(self.tmp_dir, self.shard_dir)
+
+
+def _sequences_sha256(sequences, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    for start in range(0, len(sequences), chunk_size):
+        digest.update(np.ascontiguousarray(sequences[start:start + chunk_size]).tobytes())
+    return digest.hexdigest()
+
+
+def build_shards(shard_dir, path, dataset, sequences, rows, normalize_to, retweets_norm_to,
+                 chunk_size=CHUNK_SIZE, shard_size=SHARD_SIZE):
+    '''
+    Function to write the rows of a split to shards, reading, normalising
+    and sharding the CSVs chunk by chunk. Shards already built from the same
+    files, rows, sequences and settings are kept as they are.
+
+    Parameters:
+        shard_dir : output directory
+        path : directory of TWEETS_FILE and COUNTS_FILE
+        dataset : output of scan_dataset
+        sequences : (N, MAX_LEN) token ids of every row, e.g. the memory-mapped sequence cache
+        rows : positions of the split's rows
+        normalize_to : the features are scaled between 0 and normalize_to
+        retweets_norm_to : the counts are scaled between 0 and retweets_norm_to
+    Output:
+        True if the shards were (re)built, False if they were up to date
+    '''
+    rows = np.sort(np.asarray(rows, dtype=np.int64))
+    source = {'files': [[name, os.stat(os.path.join(path, name)).st_size, os.stat(os.path.join(path, name)).st_mtime_ns]
+                        for name in (TWEETS_FILE, COUNTS_FILE)],
+              'rows': hashlib.sha256(rows.tobytes()).hexdigest(),
+              'sequences': _sequences_sha256(sequences, chunk_size),
+              'hours': dataset['hours'], 'normalize_to': normalize_to, 'retweets_norm_to': retweets_norm_to}
+    meta_file = os.path.join(shard_dir, 'meta.json')
+    if os.path.exists(meta_file):
+        with open(meta_file) as f:
+            if json.load(f).get('source') == source:
+                return False
+
+    in_split = np.zeros(len(dataset['tweet_ids']), dtype=bool)
+    in_split[rows] = True
+    max_feature_values = np.array(dataset['max_feature_values'])
+    writer = ShardWriter(shard_dir, shard_size, source)
+    start = 0
+    for chunk in read_chunks(path, dataset['hours'], chunk_size):
+        stop = start + len(chunk['tweet_ids'])
+        keep = in_split[start:stop]
+        if keep.any():
+            writer.add(np.asarray(sequences[start:stop])[keep],
+                       chunk['pairwise'][keep]/max_feature_values*normalize_to,
+                       chunk['counts'][keep]/dataset['max_retweet_count']*retweets_norm_to)
+        start = stop
+    writer.close()
+    return True
+
+
+def read_shards(shard_dir):
+    '''
+    Function to read every row of a directory of shards into memory, for
+    the test split.
+
+    Output:
+        dict of seq, user and hours arrays
+    '''
+    with open(os.path.join(shard_dir, 'meta.json')) as f:
+        meta = json.load(f)
+    chunks = {field: [] for field in FIELDS}
+    for shard in meta['shards']:
+        with np.load(os.path.join(shard_dir, shard['file'])) as data:
+            for field in FIELDS:
+                chunks[field].append(data[field])
+    return {field: np.concatenate(chunks[field]) for field in FIELDS}
+
+
+class ShardStream(object):
+    '''
+    Endless generator of shuffled training batches read from shards.
+
+    Parameters:
+        shard_dir : directory written by ShardWriter
+        batch_size : rows per batch, the last batch of an epoch may be smaller
+        shuffle : shuffle the rows (off for validation)
+        shuffle_buffer : rows held back from each shard to mix with the next one
+        prefetch : batches prepared ahead of the training loop
+        seed : random seed of the shuffling
+        last_hour_only : yield ([seq, user], count of the last hour) batches,
+                         the targets the encoder is warmed up on
+    Usage:
+        model.fit_generator(iter(stream), steps_per_epoch=stream.steps, ...)
+    '''
+
+    def __init__(self, shard_dir, batch_size, shuffle=True, shuffle_buffer=SHUFFLE_BUFFER, prefetch=8, seed=None,
+                 last_hour_only=False):
+        with open(os.path.join(shard_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.files = [os.path.join(shard_dir, shard['file']) for shard in meta['shards']]
+        self.rows = meta['rows']
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch = prefetch
+        self.seed = seed
+        self.last_hour_only = last_hour_only
+        self.steps = -(-self.rows // batch_size)    # batches per epoch
+
+    def _batch(self, pool, start, stop):
+        seq, user, hours = (pool[field][start:stop] for field in FIELDS)
+        if self.last_hour_only:
+            return [seq, user], hours[:, -1:]
+        return [seq, user, hours[:, :-1, np.newaxis]], hours[:, 1:, np.newaxis]
+
+    def epoch(self, rng):
+        '''
+        Function to generate the batches of one pass over the shards, every
+        batch but the last one full.
+        '''
+        order = rng.permutation(len(self.files)) if self.shuffle else range(len(self.files))
+        pool = None
+        for shard in order:
+            with np.load(self.files[shard]) as data:
+                rows = {field: data[field] for field in FIELDS}
+            if pool is not None:
+                rows = {field: np.concatenate([pool[field], rows[field]]) for field in FIELDS}
+            if self.shuffle:
+                permutation = rng.permutation(len(rows['seq']))
+                rows = {field: rows[field][permutation] for field in FIELDS}
+            # hand out full batches, keeping shuffle_buffer rows to mix with the next shard
+            ready = max(len(rows['seq']) - self.shuffle_buffer, 0) // self.batch_size * self.batch_size
+            for start in range(0, ready, self.batch_size):
+                yield self._batch(rows, start, start + self.batch_size)
+            pool = {field: rows[field][ready:] for field in FIELDS}
+        if pool is not None:
+            for start in range(0, len(pool['seq']), self.batch_size):
+                yield self._batch(pool, start, start + self.batch_size)
+
+    def __iter__(self):
+        batches = queue.Queue(self.prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            rng = np.random.RandomState(self.seed)
+            try:
+                while True:
+                    for batch in self.epoch(rng):
+                        if not put(batch):
+                            return
+            except BaseException as e:
+                put(e)
+
+        threading.Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                item = batches.get()
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+
+if __name__ == '__main__':
+    import argparse
+    import resource
+    import tempfile
+    import time
+
+    parser = argparse.ArgumentParser(description='Stream a synthetic dataset through ShardStream')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=512)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    shard_dir = os.path.join(tempfile.mkdtemp(prefix='shards_'), 'train')
+    start = time.time()
+    writer = ShardWriter(shard_dir)
+    for chunk in range(0, args.rows, 100000):
+        n = min(100000, args.rows - chunk)
+        hours = np.cumsum(rng.poisson(0.1, (n, 73)), axis=1)
+        # the row index in the first token column lets the check below see every row once per epoch
+        seq = rng.randint(0, 10000, (n, 26)).astype(np.uint32)
+        seq[:, 0] = np.arange(chunk, chunk + n)
+        writer.add(seq, rng.rand(n, 10), hours)
+    writer.close()
+    print('wrote {} rows in {:.1f} s'.format(args.rows, time.time() - start))
+
+    stream = ShardStream(shard_dir, args.batch_size, seed=0)
+    start = time.time()
+    seen = np.zeros(args.rows, dtype=np.int64)
+    batches = iter(stream)
+    for _ in range(stream.steps):
+        (seq, user, hours_in), hours_out = next(batches)
+        seen[seq[:, 0]] += 1
+        assert (hours_in[:, 1:] == hours_out[:, :-1]).all()
+    elapsed = time.time() - start
+    print('one epoch: {} batches in {:.1f} s ({:.0f} batches/s, {:.0f} rows/s), every row once: {}, '
+          'max RSS {:.0f} MB'.format(stream.steps, elapsed, stream.steps/elapsed, args.rows/elapsed, (seen == 1).all(),
+                                     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024))
+    shutil.rmtree(os.path.dirname(shard_dir))
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Tweet text pre-processing shared by the training scripts and the predictor.
+
+tokenize() is the GloVe-twitter style normaliser (<url>, <user>, <hashtag>,
+<allcaps>, <elong>, ...). All patterns are compiled once at import time and
+substitutions that cannot match are skipped with a cheap substring check, so
+the output is exactly the one of the original per-call re.sub chain.
+
+clean_text() is the full chain the vocabulary is fitted on (tokenize, then
+stopword and mention removal) and preprocess_texts() runs it over a whole
+column: identical texts are cleaned once and the unique texts are spread
+over a process pool in chunks.
+
+Run `python tweet_preprocessing.py [csv_file]` to check equivalence with the
+original implementation on the text column of a dataset (the sample tweets
+of tests/data/tweets.csv by default) and print the throughput of both.
+"""
+
+import multiprocessing
+import os
+import re
+import regex
+
+# Bump whenever the output of tokenize() changes, cached preprocessing keys on it
+NORMALISER_VERSION = 1
+
+FLAGS = re.MULTILINE | re.DOTALL | regex.VERSION1
+
+# Different regex parts for smiley faces
+EYES = r"[8:=;]"
+NOSE = r"['`\-]?"
+
+_URL = re.compile(r"https?:\/\/\S+\b|www\.(\w+\.)+\S*", FLAGS)
+_USER = re.compile(r"@\w+", FLAGS)
+_SMILE = re.compile(r"{}{}[)dD]+|[)dD]+{}{}".format(EYES, NOSE, NOSE, EYES), FLAGS)
+_LOLFACE = re.compile(r"{}{}p+".format(EYES, NOSE), FLAGS)
+_SADFACE = re.compile(r"{}{}\(+|\)+{}{}".format(EYES, NOSE, NOSE, EYES), FLAGS)
+_NEUTRALFACE = re.compile(r"{}{}[\/|l*]".format(EYES, NOSE), FLAGS)
+_NUMBER = re.compile(r"[-+]?[.\d]*[\d]+[:,.\d]*", FLAGS)
+_HASHTAG = re.compile(r"#\S+", FLAGS)
+_REPEAT = re.compile(r"([!?.]){2,}", FLAGS)
+_ELONG = re.compile(r"\b(\S*?)(.)\2{2,}\b", FLAGS)
+## -- I just don't understand why the Ruby script adds <allcaps> to everything so I limited the selection.
+# _ALLCAPS = re.compile(r"([^a-z0-9()<>'`\-]){2,}", FLAGS)
+_ALLCAPS = re.compile(r"([A-Z]){2,}", FLAGS)
+_CAMEL_SPLIT = regex.compile(r"(?=[A-Z])", FLAGS)
+
+
+def hashtag(text):
+    text = text.group()
+    hashtag_body = text[1:]
+    if hashtag_body.isupper():
+        result = "<hashtag> {} <allcaps>".format(hashtag_body)
+    else:
+        result = " ".join(["<hashtag>"] + _CAMEL_SPLIT.split(hashtag_body))
+    return result
+
+
+def allcaps(text):
+    text = text.group()
+    return text.lower() + " <allcaps>"
+
+
+def tokenize(text):
+    if 'http' in text or 'www.' in text:
+        text = _URL.sub("<url>", text)
+    text = text.replace("/", " / ")
+    if '@' in text:
+        text = _USER.sub("<user>", text)
+    text = _SMILE.sub("<smile>", text)
+    text = _LOLFACE.sub("<lolface>", text)
+    text = _SADFACE.sub("<sadface>", text)
+    text = _NEUTRALFACE.sub("<neutralface>", text)
+    text = text.replace("<3", "<heart>")
+    text = _NUMBER.sub("<number>", text)
+    if '#' in text:
+        text = _HASHTAG.sub(hashtag, text)
+    text = _REPEAT.sub(r"\1 <repeat>", text)
+    text = _ELONG.sub(r"\1\2 <elong>", text)
+    text = _ALLCAPS.sub(allcaps, text)
+
+    return text.lower()
+
+
+def tokenize_batch(texts):
+    '''
+    Function to normalise many tweets at once.
+
+    Parameters:
+        texts : list or Pandas Series of tweet texts
+    Output:
+        list of normalised texts, or a Pandas Series with the same
+        index if a Series was given
+    '''
+    normalised = [tokenize(text) for text in texts]
+    if hasattr(texts, 'index') and hasattr(texts, 'name'):
+        import pandas as pd
+        return pd.Series(normalised, index=texts.index, name=texts.name)
+    return normalised
+
+
+# Some words which might indicate a certain sentiment are kept via a whitelist
+WHITELIST = ["n't", "not", "no"]
+_MENTION = re.compile(r'@\w+')
+_stopwords = None
+
+
+def stopword_set():
+    '''
+    Function to get the English stopwords minus the whitelist, loaded once.
+    '''
+    global _stopwords
+    if _stopwords is None:
+        from nltk.corpus import stopwords
+        try:
+            words = stopwords.words('english')
+        except LookupError:
+            import nltk
+            nltk.download('stopwords')
+            words = stopwords.words('english')
+        _stopwords = frozenset(words) - frozenset(WHITELIST)
+    return _stopwords
+
+
+def remove_stopwords(input_text):
+    '''
+    Function to remove English stopwords and one letter words from a text.
+
+    Parameters:
+        input_text : text to clean
+    Output:
+        cleaned text
+    '''
+    stopwords = stopword_set()
+    return " ".join([word for word in input_text.split() if word not in stopwords and len(word) > 1])
+
+
+def remove_mentions(input_text):
+    '''
+    Function to remove mentions, preceded by @, from a text.
+
+    Parameters:
+        input_text : text to clean
+    Output:
+        cleaned text
+    '''
+    return _MENTION.sub('', input_text)
+
+
+def clean_text(text):
+    return remove_mentions(remove_stopwords(tokenize(text)))
+
+
+def _clean_chunk(texts):
+    return [clean_text(text) for text in texts]
+
+
+def preprocess_texts(texts, workers=None, chunk_size=5000):
+    '''
+    Function to run clean_text over many tweets.
+
+    Identical texts are only cleaned once. When there is more than one
+    chunk of unique texts they are cleaned by a pool of forked worker
+    processes and the results are scattered back in input order.
+
+    Parameters:
+        texts : list or Pandas Series of tweet texts
+        workers : number of processes, all cores by default, 1 to stay in-process
+        chunk_size : number of unique texts sent to a worker at a time
+    Output:
+        list of cleaned texts, or a Pandas Series with the same index
+        if a Series was given
+    '''
+    positions = {}
+    codes = [positions.setdefault(text, len(positions)) for text in texts]
+    unique = list(positions)
+
+    workers = workers or os.cpu_count() or 1
+    chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+    # forking keeps the workers from re-importing the training script that called us
+    if workers > 1 and len(chunks) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        stopword_set()    # load once here so the forked workers inherit it
+        with multiprocessing.get_context('fork').Pool(min(workers, len(chunks))) as pool:
+            cleaned = [text for chunk in pool.imap(_clean_chunk, chunks) for text in chunk]
+    else:
+        cleaned = _clean_chunk(unique)
+
+    result = [cleaned[code] for code in codes]
+    if hasattr(texts, 'index') and hasattr(texts, 'name'):
+        import pandas as pd
+        return pd.Series(result, index=texts.index, name=texts.name)
+    return result
+
+
+def _original_tokenize(text):
+    # the per-call implementation tokenize() replaced, kept for the equivalence check below
+    def re_sub(pattern, repl):
+        return re.sub(pattern, repl, text, flags=FLAGS)
+
+    def original_hashtag(text):
+        text = text.group()
+        hashtag_body = text[1:]
+        if hashtag_body.isupper():
+            result = "<hashtag> {} <allcaps>".format(hashtag_body)
+        else:
+            result = " ".join(["<hashtag>"] + regex.split(r"(?=[A-Z])", hashtag_body, flags=FLAGS))
+        return result
+
+    text = re_sub(r"https?:\/\/\S+\b|www\.(\w+\.)+\S*", "<url>")
+    text = re_sub(r"/"," / ")
+    text = re_sub(r"@\w+", "<user>")
+    text = re_sub(r"{}{}[)dD]+|[)dD]+{}{}".format(EYES, NOSE, NOSE, EYES), "<smile>")
+    text = re_sub(r"{}{}p+".format(EYES, NOSE), "<lolface>")
+    text = re_sub(r"{}{}\(+|\)+{}{}".format(EYES, NOSE, NOSE, EYES), "<sadface>")
+    text = re_sub(r"{}{}[\/|l*]".format(EYES, NOSE), "<neutralface>")
+    text = re_sub(r"<3","<heart>")
+    text = re_sub(r"[-+]?[.\d]*[\d]+[:,.\d]*", "<number>")
+    text = re_sub(r"#\S+", original_hashtag)
+    text = re_sub(r"([!?.]){2,}", r"\1 <repeat>")
+    text = re_sub(r"\b(\S*?)(.)\2{2,}\b", r"\1\2 <elong>")
+    text = re_sub(r"([A-Z]){2,}", allcaps)
+
+    return text.lower()
+
+
+def _original_clean(text):
+    # the original tokenize -> remove_stopwords -> remove_mentions chain of the trainers
+    from nltk.corpus import stopwords
+    stopwords_list = stopwords.words('english')
+    words = _original_tokenize(text).split()
+    clean_words = [word for word in words if (word not in stopwords_list or word in WHITELIST) and len(word) > 1]
+    return re.sub(r'@\w+', '', " ".join(clean_words))
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    import pandas as pd
+
+    path = os.path.dirname(os.path.realpath(__file__))
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else path+'/tests/data/tweets.csv'
+    texts = pd.read_csv(csv_file).text.astype(str).tolist()
+    print('tweets: ', len(texts), ' unique: ', len(set(texts)), ' cores: ', os.cpu_count())
+    stopword_set()
+
+    def check(name, original, new):
+        start = time.perf_counter()
+        expected = [original(text) for text in texts]
+        original_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        result = new(texts)
+        new_time = time.perf_counter() - start
+
+        mismatches = [i for i, (a, b) in enumerate(zip(expected, result)) if a != b]
+        for i in mismatches[:10]:
+            print('MISMATCH: ', repr(texts[i]))
+            print('  original: ', repr(expected[i]))
+            print('  new:      ', repr(result[i]))
+        print('{}: {} mismatches, original {:.0f} tweets/s, new {:.0f} tweets/s ({:.1f}x)'.format(
+            name, len(mismatches), len(texts) / original_time, len(texts) / new_time, original_time / new_time))
+        return len(mismatches)
+
+    mismatches = check('tokenize', _original_tokenize, tokenize_batch)
+    mismatches += check('clean_text, 1 process', _original_clean, lambda t: preprocess_texts(t, workers=1))
+    mismatches += check('clean_text, all cores', _original_clean, preprocess_texts)
+    sys.exit(1 if mismatches else 0)